@@ -0,0 +1,137 @@
+# checkDup on synthetic file listings. The former implementation (cubic in
+# the number of duplicated names) is only run on a small listing, to check
+# that output and return value are identical.
+# Usage: python -m benchmarks.bench_checkDup [number of files]
+
+import io
+import re
+import sys
+import time
+import random
+import contextlib
+
+from combine import checkDup, splitExt
+
+
+def checkDupCubic(corrPathNames_in, keep='first'):
+    # checkDup before hash indexes
+    corrPathNames_out = {}
+    uniqueNames = set()
+    noneUnique = set()
+    allNames = set()
+    count = 0
+    noneUniquePrefix = '_name_rep'
+    hasAssignedChecker = re.compile(noneUniquePrefix+r'\d+$')
+    for p, corrNames_in in corrPathNames_in.items():
+        corrPathNames_out[p] = []
+        count += len(corrNames_in)
+        for fn0, fn1 in corrNames_in:
+            fn = (fn0 if fn1 is None else fn1)
+            name, ext = splitExt(fn)
+            uniqueNames.add(name.lower())
+            lenAll = len(allNames)
+            allNames.add(name.lower())
+            isUnique = (lenAll != len(allNames))
+            if not isUnique: noneUnique.add(name.lower())
+            noneUniqueIndex = 0
+            while lenAll == len(allNames):
+                noneUniqueIndex += 1
+                hasAssigned = hasAssignedChecker.search(name)
+                if hasAssigned:
+                    name = name[:hasAssigned.start()]
+                name += noneUniquePrefix + str(noneUniqueIndex)
+                allNames.add(name.lower())
+            if isUnique and fn1 is None:
+                corrName = None
+            elif isUnique:
+                corrName = fn1
+            else:
+                corrName = name+ext
+            if keep == 'all' or isUnique:
+                corrPathNames_out[p].append((fn0, corrName))
+        corrPathNames_out[p].sort(key=lambda x:x[0].lower())
+    sortedNoneUnique = sorted(list(noneUnique))
+    dups = {}
+    for p, corrNames_in in corrPathNames_in.items():
+        for nn in sortedNoneUnique:
+            for n0, n1 in corrNames_in:
+                nx = splitExt(n0)[0].lower()
+                ny = splitExt(n1)[0]
+                ny = (ny if ny is None else ny.lower())
+                if nn in [nx, ny]:
+                    isIncluded = False
+                    for n0_o, n1_o in corrPathNames_out[p]:
+                        if n0 == n0_o:
+                            isIncluded = True
+                            n1 = (n0 if n1_o is None else n1_o)
+                            break
+                    if not isIncluded: n1 = None
+                    if nn not in dups:
+                        dups[nn] = [(p, n0, n1)]
+                    else: dups[nn].append((p, n0, n1))
+    for dup, itemlist in dups.items():
+        print(f'Found duplicated name {dup}:')
+        for p, n0, n1 in itemlist:
+            print('\t'+p+'/'+n0)
+            if n1 is None:
+                print('\t\t!!Will be EXCLUDED!!')
+            else:
+                if n1 == n0:
+                    print('\t\t--> (no change) '+n1)
+                else:
+                    print('\t\t--> '+n1)
+    if len(noneUnique) == 0:
+        print('No possible duplication found in dir(s):')
+        print('\t'+'\n'.join(corrPathNames_in.keys()))
+    else:
+        print(f'Found {len(dups)} none unique name(s), ' + \
+            f'{len(uniqueNames)} unique one(s).')
+    print(f'Total checked files: {count}\n')
+    return corrPathNames_out
+
+
+def makeListing(nFiles: int, nPaths: int = 4, seed: int = 0):
+    # About one in ten names is repeated (in another case, path, extension,
+    # or with an illegal character that is corrected to the same name).
+    random.seed(seed)
+    nNames = max(1, nFiles * 9 // 10)
+    exts = ['.fna.gz', '.faa.xz', '.gbff.gz', '.txt']
+    listing = {f'db{i}': {} for i in range(nPaths)}
+    for i in range(nFiles):
+        n = random.randrange(nNames)
+        name = f'Streptomyces_sp_{n}'
+        if random.random() < 0.3:
+            name = name.upper()
+        if random.random() < 0.05:
+            name += '_name_rep1'
+        p = f'db{random.randrange(nPaths)}'
+        fn0 = name + random.choice(exts)
+        if random.random() < 0.1:
+            listing[p][fn0.replace('_sp_', ' sp ')] = fn0
+        else:
+            listing[p][fn0] = None
+    return {p: sorted(names.items(), key=lambda x: x[0].lower())
+            for p, names in listing.items()}
+
+
+def run(func, listing, keep):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        ret = func(listing, keep=keep)
+    return out.getvalue(), ret
+
+
+if __name__ == '__main__':
+    nFiles = (int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
+    for seed in range(3):
+        listing = makeListing(2000, seed=seed)
+        for keep in ['first', 'all']:
+            assert run(checkDup, listing, keep) == run(checkDupCubic, listing, keep)
+    print('Output identical to the former implementation on 2000 files.')
+
+    listing = makeListing(nFiles)
+    for keep in ['first', 'all']:
+        start = time.perf_counter()
+        out, _ = run(checkDup, listing, keep)
+        print(f'checkDup({nFiles} files, keep={keep}): ' +
+              f'{time.perf_counter() - start:.2f}s, {out.count("Found duplicated name")} duplicated names')
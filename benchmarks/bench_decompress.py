@@ -0,0 +1,69 @@
+# Decompression throughput of iterChunks on a synthetic genome, written as
+# plain gzip and as BGZF, for each installed gzip backend and a range of
+# threads (threads only apply to BGZF).
+# Usage: python -m benchmarks.bench_decompress [MiB of sequence] [max threads]
+
+import os
+import sys
+import time
+import gzip
+import random
+import tempfile
+
+from tidy import iterChunks, countRecords, setDecompression, gzipBackends, \
+    compressBlock, BGZF_EOF, BGZF_BLOCK_SIZE
+
+
+def makeGenome(nBytes: int, seed: int = 0) -> bytes:
+    # contigs of 10-500 kb, 80 bases per line
+    random.seed(seed)
+    toBases = bytes(b'ACGGCCTA'[i % 8] for i in range(256)) # GC rich
+    parts = []
+    size = 0
+    i = 0
+    while size < nBytes:
+        n = random.randrange(10000, 500000)
+        seq = random.randbytes(n).translate(toBases)
+        lines = b'\n'.join(seq[j:j+80] for j in range(0, n, 80))
+        parts.append(b'>contig_%d\n' % i + lines + b'\n')
+        size += len(parts[-1])
+        i += 1
+    return b''.join(parts)
+
+
+def writeBgzf(file: str, content: bytes):
+    with open(file, 'wb') as fh:
+        for i in range(0, len(content), BGZF_BLOCK_SIZE):
+            fh.write(compressBlock(content[i:i+BGZF_BLOCK_SIZE]))
+        fh.write(BGZF_EOF)
+
+
+def timeRead(file: str) -> tuple[float, int]:
+    start = time.perf_counter()
+    n = countRecords(iterChunks(file), b'\n>')
+    return time.perf_counter() - start, n
+
+
+if __name__ == '__main__':
+    mib = (int(sys.argv[1]) if len(sys.argv) > 1 else 200)
+    maxThreads = (int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count())
+    content = makeGenome(mib * 1024**2)
+    print(f'{len(content) / 1024**2:.0f} MiB of sequence, {content.count(b">")} contigs')
+    with tempfile.TemporaryDirectory() as tmpDir:
+        gzFile = os.path.join(tmpDir, 'genome.fna.gz')
+        bgzfFile = os.path.join(tmpDir, 'genome.bgzf.fna.gz')
+        with gzip.open(gzFile, 'wb', compresslevel=6) as fh:
+            fh.write(content)
+        writeBgzf(bgzfFile, content)
+        threadList = sorted({1, 2, 4, maxThreads} & set(range(1, maxThreads + 1)))
+        for backend, funcs in gzipBackends.items():
+            if funcs is None:
+                print(f'{backend}: not installed')
+                continue
+            for name, file, threadsToRun in [('gzip', gzFile, [1]), ('bgzf', bgzfFile, threadList)]:
+                for threads in threadsToRun:
+                    setDecompression(backend, threads)
+                    elapsed, n = timeRead(file)
+                    print(f'{backend:8} {name} threads={threads}: {elapsed:.2f}s, ' +
+                          f'{len(content) / 1024**2 / elapsed:.0f} MiB/s ({n} records)')
+    setDecompression('stdlib', 1)
@@ -0,0 +1,97 @@
+# Compare getInfoFrom with the former DataFrame.iterrows implementation on a
+# synthetic metadata table: run time, and memory held by the returned strains.
+# Usage: python -m benchmarks.bench_getInfoFrom [number of rows]
+
+import os
+import sys
+import time
+import random
+import tempfile
+import tracemalloc
+from collections import namedtuple
+
+import pandas as pd
+
+from tidy import getInfoFrom, removeDup
+
+argParser = namedtuple('argParser', ['dir', 'tsv', 'threads'], defaults=[8])
+
+testTsv = 'tests/test_data/ncbi-ftp-download.tsv'
+
+
+def getInfoFromIterrows(args):
+    # getInfoFrom before column-wise string operations
+    dirName = os.path.split(args.dir)[1]
+    infoDf = pd.read_csv(args.tsv, sep='\t', header=0, index_col=0)
+    strains = {}
+    for acc, row in infoDf.iterrows():
+        org = row.organism_name.strip()
+        strain = str(row.infraspecific_name).replace( 'strain=', '').strip()
+        if "type strain" in strain:
+            strain = strain.replace('type strain', '').\
+                replace(':', '').replace('(', '').replace(')', '').strip()
+        if strain == 'nan': strain = ''
+        names = f'{org} {strain}'.split(' ')
+        org = " ".join(names[:2])
+        strain = removeDup(" ".join(names[2:]))
+        name = f'{org} {strain}'.strip()
+        filePath = os.path.join(args.dir,
+            row.local_filename.split(dirName)[1][1:])
+        assert os.path.isfile(filePath), filePath
+        data = row.to_dict()
+        data['local_filename'] = filePath
+        try:
+            strains[name][acc] = data
+        except KeyError:
+            strains[name] = {}
+            strains[name][acc] = data
+    return strains
+
+
+def makeTable(nRows: int, tsv: str):
+    # Rows are sampled from the test table, with new accessions and strain
+    # names, all pointing to the test download dir.
+    random.seed(0)
+    df = pd.read_csv(testTsv, sep='\t', header=0, dtype=str)
+    rows = df.sample(n=nRows, replace=True, random_state=0).reset_index(drop=True)
+    rows['assembly_accession'] = [f'GCF_{i:09d}.1' for i in range(nRows)]
+    strainNames = [
+        'strain=MA-4680 = NBRC 14893', 'strain=type strain: GW41-1564/R2',
+        'strain=C34 = DSM 42122 = NRRL B-24963', 'strain=M1154 M1154',
+    ] + [f'strain=ISO{i} = DSM {i}' for i in range(max(1, nRows // 4))]
+    rows['infraspecific_name'] = [random.choice(strainNames) for _ in range(nRows)]
+    rows.to_csv(tsv, sep='\t', index=False)
+
+
+def compare(a, b):
+    assert list(a) == list(b)
+    for name in a:
+        assert list(a[name]) == list(b[name])
+        for acc in a[name]:
+            assert a[name][acc]['local_filename'] == b[name][acc]['local_filename']
+
+
+if __name__ == '__main__':
+    nRows = (int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+    with tempfile.TemporaryDirectory() as tmpDir:
+        tsv = os.path.join(tmpDir, 'metadata.tsv')
+        makeTable(nRows, tsv)
+        args = argParser(dir='tests/test_data/ncbi-ftp-download', tsv=tsv)
+        timings = {}
+        memory = {}
+        results = {}
+        for func in [getInfoFrom, getInfoFromIterrows]:
+            start = time.perf_counter()
+            results[func.__name__] = func(args)
+            timings[func.__name__] = time.perf_counter() - start
+        for func in [getInfoFrom, getInfoFromIterrows]:
+            results.pop(func.__name__)
+            tracemalloc.start()
+            results[func.__name__] = func(args)
+            memory[func.__name__] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+    compare(results['getInfoFrom'], results['getInfoFromIterrows'])
+    print(f'{nRows} rows, {len(results["getInfoFrom"])} strains')
+    for name, t in timings.items():
+        print(f'{name:>20}: {t:.2f}s, {memory[name] / 1024**2:.0f} MiB held')
+    print(f'Speedup: {timings["getInfoFromIterrows"] / timings["getInfoFrom"]:.1f}x')
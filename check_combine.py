@@ -1,9 +1,19 @@
-from combine import checkCombine
+from combine import checkCombine, writeCombinePlan
 import argparse
 
 parser = argparse.ArgumentParser()
 parser.add_argument('p', nargs="+", help="pathes of databases (folders) you want to combine")
+parser.add_argument('--keep', type=str, help='If duplicated file names found, keep "first" or "all"',
+                    default='first')
+parser.add_argument('--plan', type=str,
+                    help='Write the checked result to this file, execute it with combine_database.py --plan')
+parser.add_argument('--threads', type=int, help='Number of dirs listed at the same time',
+                    default=8)
+parser.add_argument('--page', action='store_true',
+                    help='Show the full report in a pager, instead of a summary')
 
 args = parser.parse_args()
 
-checkCombine(args.p)
\ No newline at end of file
+corrPathNames = checkCombine(args.p, keep=args.keep, threads=args.threads, page=args.page)
+if not args.plan is None:
+    writeCombinePlan(corrPathNames, args.plan, keep=args.keep)
@@ -1,2 +1,4 @@
 from .check_database_combine import *
-from .combine_databases import *
\ No newline at end of file
+from .combine_plan import *
+from .dedup import *
+from .combine_databases import *
@@ -2,32 +2,49 @@
 # This script should check:
 # - Replication of file names, including those only differ in letter cases.
 # - File name safety, make sure there is no illegal characters, using the function safeName
+# The dirs are listed concurrently, the report is summarized (or paged).
 
 import os
 import re
+import pydoc
+from io import StringIO
+from contextlib import redirect_stdout, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from typing import overload, Literal
-from tidy import safeName
+from tidy import safeNames
 
 
-def checkIllegal(names: list[str]) -> list[tuple[str, None|str]]:
-    corrNames: list[tuple[str, None|str]] = []
-    containsIllegalNames = False
-    for name in names:
-        sname: None|str = safeName(name)
-        if sname == name:
-            sname = None
-        corrNames.append((name, sname))
+def scanDir(path: str) -> list[tuple[str, bool]]:
+    # [(name, is dir)], the type comes from the dir entry, no stat call per
+    # file (a round trip each on network file systems)
+    with os.scandir(path) as it:
+        return [(entry.name, entry.is_dir()) for entry in it]
+
+
+def scanDirs(paths: list[str], threads: int = 8) -> dict[str, list[tuple[str, bool]]]:
+    # scanDir of all paths at the same time
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(paths)))) as executor:
+        return dict(zip(paths, executor.map(scanDir, paths)))
+
+
+def checkIllegal(names: list[str], maxShown: None|int = None) -> list[tuple[str, None|str]]:
+    # maxShown: number of illegal names printed, None for all
+    corrNames: list[tuple[str, None|str]] = [
+        (name, (None if sname == name else sname))
+        for name, sname in zip(names, safeNames(names))
+    ]
+    corrNames.sort(key=lambda x: x[0].lower())
     illegalNames = [ns for ns in corrNames if not ns[1] is None]
     if len(illegalNames) > 0:
-        containsIllegalNames = True
-        for ns in illegalNames:
+        print(f'Found {len(illegalNames)} file(s) with illegal characters:')
+        for ns in illegalNames[:maxShown]:
             print(f'File with illegal character: "{ns[0]}",\n' +
                   f'\tshould be corrected to "{ns[1]}"')
-    if not containsIllegalNames:
-        print('No illegal characters found.')
-    else:
+        if not maxShown is None and len(illegalNames) > maxShown:
+            print(f'... and {len(illegalNames) - maxShown} more')
         print()
-    corrNames.sort(key=lambda x: x[0].lower())
+    else:
+        print('No illegal characters found.')
     return corrNames
 
 
@@ -40,7 +57,7 @@ def splitExt(n: None) -> tuple[None, None]:
 def splitExt(n):
     if n is None: return None, None
     name, ext = os.path.splitext(n)
-    if ext in ['.gz', '.xz']:
+    if ext in ['.gz', '.xz', '.bz2', '.zst']:
         name, subExt = os.path.splitext(name)
         ext = subExt+ext
     return name, ext
@@ -48,36 +65,50 @@ def splitExt(n):
 
 def checkDup(
     corrPathNames_in: dict[str, list[tuple[str, None|str]]],
-    keep='first'
+    keep='first',
+    maxShown: None|int = None
 ) -> dict[str, list[tuple[str, None|str]]]:
+    # maxShown: number of duplicated names printed, None for all
 
     corrPathNames_out: dict[str, list[tuple[str, None|str]]] = {}
     uniqueNames: set[str] = set() # track all unique names
     noneUnique: set[str] = set() # track none unique names
     allNames: set[str] = set() # track all names, with suffix added to the none unique ones
+    nextIndex: dict[str, int] = {} # lower case base name -> first suffix index not tried yet
     count = 0 # track total files
     noneUniquePrefix = '_name_rep'
     hasAssignedChecker = re.compile(noneUniquePrefix+r'\d+$')
 
+    stems: dict[str, list[tuple[str, None|str]]] = {} # lower case stems of (fn0, fn1), for the report
+
     for p, corrNames_in in corrPathNames_in.items():
         corrPathNames_out[p] = []
+        stems[p] = []
         count += len(corrNames_in)
 
         for fn0, fn1 in corrNames_in: 
             fn = (fn0 if fn1 is None else fn1)
             name, ext = splitExt(fn)
             uniqueNames.add(name.lower())
+            if fn1 is None:
+                stems[p].append((name.lower(), None))
+            else:
+                stems[p].append((splitExt(fn0)[0].lower(), name.lower()))
 
-            lenAll = len(allNames)
+            isUnique = not name.lower() in allNames
             allNames.add(name.lower())
-            isUnique = (lenAll != len(allNames))
-            if not isUnique: noneUnique.add(name.lower())
-            noneUniqueIndex = 0
-            while lenAll == len(allNames):
-                noneUniqueIndex += 1
+            if not isUnique:
+                noneUnique.add(name.lower())
+                # first free name<prefix><index>, names are never removed from
+                # allNames, so indexes tried before stay taken
                 hasAssigned = hasAssignedChecker.search(name)
                 if hasAssigned:
                     name = name[:hasAssigned.start()]
+                base = name.lower()
+                noneUniqueIndex = nextIndex.get(base, 1)
+                while base + noneUniquePrefix + str(noneUniqueIndex) in allNames:
+                    noneUniqueIndex += 1
+                nextIndex[base] = noneUniqueIndex + 1
                 name += noneUniquePrefix + str(noneUniqueIndex)
                 allNames.add(name.lower())
 
@@ -95,27 +126,22 @@ def checkDup(
                 #print(f'File {os.path.join(p, fn0)} will be excluded.')
         corrPathNames_out[p].sort(key=lambda x:x[0].lower())
 
-    sortedNoneUnique = sorted(list(noneUnique))
+    # Report, per path: none unique name -> entries with that (original or
+    # corrected) name, in input order
     dups: dict[str, list[tuple[str, str, str|None]]] = {}
     for p, corrNames_in in corrPathNames_in.items():
-        for nn in sortedNoneUnique:
-            for n0, n1 in corrNames_in:
-                nx = splitExt(n0)[0].lower()
-                ny = splitExt(n1)[0]
-                ny = (ny if ny is None else ny.lower())
-                if nn in [nx, ny]:
-                    isIncluded = False
-                    for n0_o, n1_o in corrPathNames_out[p]:
-                        if n0 == n0_o:
-                            isIncluded = True
-                            n1 = (n0 if n1_o is None else n1_o)
-                            break
-                    if not isIncluded: n1 = None
-                    if nn not in dups:
-                        dups[nn] = [(p, n0, n1)]
-                    else: dups[nn].append((p, n0, n1))
-
-    for dup, itemlist in dups.items():
+        outNames: dict[str, None|str] = {}
+        for n0_o, n1_o in corrPathNames_out[p]:
+            outNames.setdefault(n0_o, (n0_o if n1_o is None else n1_o))
+        pathDups: dict[str, list[tuple[str, str, str|None]]] = {}
+        for (n0, n1), (nx, ny) in zip(corrNames_in, stems[p]):
+            for nn in ([nx] if ny in [None, nx] else [nx, ny]):
+                if nn in noneUnique:
+                    pathDups.setdefault(nn, []).append((p, n0, outNames.get(n0)))
+        for nn in sorted(pathDups):
+            dups.setdefault(nn, []).extend(pathDups[nn])
+
+    for dup, itemlist in list(dups.items())[:maxShown]:
         print(f'Found duplicated name {dup}:')
         for p, n0, n1 in itemlist:
             print('\t'+os.path.join(p, n0))
@@ -127,6 +153,8 @@ def checkDup(
                 else:
                     print('\t\t--> '+n1)
 
+    if not maxShown is None and len(dups) > maxShown:
+        print(f'... and {len(dups) - maxShown} more duplicated name(s)')
     if len(noneUnique) == 0:
         print('No possible duplication found in dir(s):')
         print('\t'+'\n'.join(corrPathNames_in.keys()))
@@ -140,17 +168,100 @@ def checkDup(
     
 def checkCombine(
     paths: list[str],
-    keep: Literal['first','all']='first'
+    keep: Literal['first','all']='first',
+    threads: int = 8,
+    maxShown: None|int = 10,
+    page: bool = False
 ) -> dict[str, list[tuple[str, None|str]]]:
-    namesEachPath = {}
+    # maxShown: number of illegal and duplicated names printed per check,
+    # with page, the full report is shown in a pager instead.
+    with pagedReport(page):
+        if page:
+            maxShown = None
+        listings = scanDirs(paths, threads=threads)
+        namesEachPath = {}
+        print()
+        for p in paths:
+            print(f'Checking dir {p} individually.')
+            names = getFileNames(listings[p])
+            # check illegal names in each path
+            corrNames = checkIllegal(names, maxShown=maxShown)
+            namesEachPath[p] = corrNames
+            # check duplication in single path
+            checkDup({p:corrNames}, maxShown=maxShown)
+        # check duplication if combined
+        print('Checking dirs as combined:')
+        return checkDup(namesEachPath, keep=keep, maxShown=maxShown)
+
+
+def getFileNames(listing: list[tuple[str, bool]]) -> list[str]:
+    # names of the files in a scanDir listing, sub dirs are not combined
+    names = [n for n, isDir in listing if not isDir]
+    if len(names) < len(listing):
+        print(f'{len(listing) - len(names)} sub dir(s) skipped.')
+    return names
+
+
+@contextmanager
+def pagedReport(page: bool = False):
+    # With page, everything printed inside is collected and shown in a pager
+    # (or printed at once when output is not a terminal).
+    if not page:
+        yield
+        return
+    buffer = StringIO()
+    try:
+        with redirect_stdout(buffer):
+            yield
+    finally:
+        pydoc.pager(buffer.getvalue())
+
+
+def checkCombineUpdate(
+    paths: list[str],
+    target: str,
+    known: dict[str, str],
+    keep: Literal['first','all']='first',
+    threads: int = 8,
+    maxShown: None|int = 10
+) -> tuple[dict[str, list[tuple[str, None|str]]], list[tuple[str, str]]]:
+    # checkCombine for adding to an existing combined dir.
+    # known is {source realpath: target name} of files combined before, they
+    # keep their target name. A source not known but with its (safe) name and
+    # size already in target is taken as combined before as well (only these
+    # sources and targets are stat'ed), if no other source has that target
+    # name in known or was taken for it before.
+    # The names of files in target are taken, new files get names (and
+    # _name_rep numbers) that do not clash with them.
+    # Returns the new files like checkCombine, and (source, target name) of
+    # the files combined before.
+    listings = scanDirs([target] + paths, threads=threads)
+    targetNames = {n for n, isDir in listings[target]
+                   if not isDir and not (n.startswith('.') and n.endswith('.part'))}
+    namesEachPath = {target: [(n, None) for n in sorted(targetNames, key=str.lower)]}
+    combinedBefore = []
+    takenNames = set(known.values())
     print()
     for p in paths:
         print(f'Checking dir {p} individually.')
-        # check illegal names in each path
-        corrNames = checkIllegal(os.listdir(p))
-        namesEachPath[p] = corrNames
-        # check duplication in single path
-        checkDup({p:corrNames})
-    # check duplication if combined
-    print('Checking dirs as combined:')
-    return checkDup(namesEachPath, keep=keep)
\ No newline at end of file
+        corrNames = checkIllegal(getFileNames(listings[p]), maxShown=maxShown)
+        checkDup({p:corrNames}, maxShown=maxShown)
+        newNames = []
+        for fn0, fn1 in corrNames:
+            src = os.path.join(p, fn0)
+            fn = (fn0 if fn1 is None else fn1)
+            if os.path.realpath(src) in known:
+                combinedBefore.append((src, known[os.path.realpath(src)]))
+            elif fn in targetNames and not fn in takenNames and \
+                    os.path.getsize(src) == os.path.getsize(os.path.join(target, fn)):
+                combinedBefore.append((src, fn))
+                takenNames.add(fn)
+            else:
+                newNames.append((fn0, fn1))
+        namesEachPath[p] = newNames
+    print(f'{len(combinedBefore)} file(s) combined before, ' +
+          f'{sum(len(ns) for ns in namesEachPath.values()) - len(targetNames)} new.')
+    print(f'Checking new files combined with {target}:')
+    corrPathNames = checkDup(namesEachPath, keep=keep, maxShown=maxShown)
+    del corrPathNames[target]
+    return corrPathNames, combinedBefore
@@ -1,13 +1,84 @@
 import os
-import shutil
 from typing import Literal
-from combine import checkCombine
+from combine import checkCombine, checkCombineUpdate, readCombinePlan, checkCombinePlan, \
+    dedupPairs, reportDedup
+from tidy import syncFiles, printUsedModes, getManifestFile, readManifest, getManifestEntry, \
+    manifestHeader, getTranscodeMode, getTranscodedName, transcodeFiles, getArchiveExt, \
+    getArchiveBase, ArchiveWriter, archiveFiles
 
-def combineDatabases(paths, target, keep: Literal['first','all']='first'):
-    corrPathNames = checkCombine(paths, keep=keep)
-    os.makedirs(target)
-    for p, corrNames in corrPathNames.items():
-        for fn0, fn1 in corrNames:
-            src = os.path.join(p, fn0)
-            dst = os.path.join(target, (fn0 if fn1 is None else fn1))
-            shutil.copyfile(src, dst)
\ No newline at end of file
+def combineDatabases(paths, target, keep: Literal['first','all']='first',
+                     linkMode: Literal['copy','hardlink','reflink','symlink']='copy',
+                     threads: int = 1, plan: None|str = None, dedup: bool = False,
+                     update: bool = False, transcode: None|str = None,
+                     transcodeLevel: None|int = None):
+    # With a plan file (written by check_combine.py --plan), paths and keep
+    # are taken from the plan and the directories are not checked again.
+    # With dedup, files with identical content are only combined once, also
+    # compared with the files combined before in update mode.
+    # With update, files are added to an existing target: files combined
+    # before keep their names and are only copied again when changed.
+    # With transcode ("plain", "bgzf" or "zstd"), files are recompressed in
+    # `threads` processes instead of copied/linked, their extensions changed
+    # accordingly.
+    # What is in target is recorded in the manifest file next to it.
+    # A target ending with .tar or .zip is an archive, the files are streamed
+    # into it (no manifest, no update).
+    if update and not plan is None:
+        raise ValueError('A combine plan can not be executed in update mode.')
+    isArchive = not getArchiveExt(target) is None
+    if isArchive and update:
+        raise ValueError('An archive target can not be updated.')
+    if isArchive and os.path.lexists(target):
+        raise FileExistsError(f'Archive target exists: {target}')
+    mode = (linkMode if transcode is None else getTranscodeMode(transcode, transcodeLevel))
+    combinedBefore = []
+    existing = [] # (source, target name) of files in target, for dedup
+    if plan is not None:
+        info, entries = readCombinePlan(plan)
+        print(f'Executing combine plan {plan} (keep {info.get("keep", [""])[0]}) of dir(s):')
+        print('\t' + '\n\t'.join(info.get('paths', [])))
+        pairs, _ = checkCombinePlan(entries)
+    else:
+        if update and os.path.isdir(target):
+            manifestFile = getManifestFile(target)
+            manifest = readManifest(manifestFile)
+            known = {entry[0]: entry[3] for entry in manifest.values()}
+            corrPathNames, combinedBefore = checkCombineUpdate(
+                paths, target, known, keep=keep, threads=threads)
+            # found in target without manifest entry, record them as they are
+            adopted = [(src, dst) for src, dst in combinedBefore
+                       if not os.path.realpath(src) in known]
+            if len(adopted) > 0:
+                with open(manifestFile, 'a') as mf:
+                    if len(manifest) == 0:
+                        mf.write('\t'.join(manifestHeader) + '\n')
+                    for src, dst in adopted:
+                        mf.write('\t'.join(getManifestEntry(src, dst, mode)) + '\n')
+            # also the ones of dirs not given this time, if still there
+            existing = [(entry[0], entry[3]) for entry in readManifest(manifestFile).values()
+                        if os.path.isfile(entry[0])]
+        else:
+            corrPathNames = checkCombine(paths, keep=keep, threads=threads)
+        pairs = []
+        for p, corrNames in corrPathNames.items():
+            for fn0, fn1 in corrNames:
+                pairs.append((os.path.join(p, fn0), (fn0 if fn1 is None else fn1)))
+    if dedup:
+        pairs, merged = dedupPairs(pairs, threads=threads, existing=existing)
+    reportBase = (getArchiveBase(target) if isArchive else target)
+    if not isArchive:
+        os.makedirs(target, exist_ok=update)
+    dedupReport = (reportDedup(reportBase, merged) if dedup else None)
+    if not transcode is None:
+        # files combined before already have their final names
+        pairs = [(src, getTranscodedName(dst, transcode)) for src, dst in pairs]
+    if isArchive:
+        with ArchiveWriter(target) as archive:
+            archiveFiles(archive, pairs, (None if transcode is None else mode))
+            if not dedupReport is None:
+                archive.addReport(dedupReport)
+        return
+    pairs = [(src, os.path.join(target, dst)) for src, dst in combinedBefore + pairs]
+    usedModes = syncFiles(pairs, target, mode, threads=threads, delete=False,
+                          transfer=(None if transcode is None else transcodeFiles))
+    printUsedModes(usedModes, mode)
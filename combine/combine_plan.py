@@ -0,0 +1,77 @@
+# Combine plan: the result of checkCombine written to a TSV file by
+# check_combine.py, so that combine_database.py can copy without listing and
+# checking the directories again.
+# Sizes and modification times of the sources are recorded, a source that
+# changed after planning is skipped when the plan is executed.
+# Fields are quoted by the csv module where needed, source names may contain
+# tabs or newlines (the illegal characters the target names are cleaned of).
+
+import os
+import csv
+from typing import Literal
+
+planHeader = ['source', 'target', 'size', 'mtime_ns']
+
+
+def writeCombinePlan(
+    corrPathNames: dict[str, list[tuple[str, None|str]]],
+    planFile: str,
+    keep: Literal['first','all']='first'
+) -> int:
+    n = 0
+    with open(planFile, 'w', newline='') as pf:
+        writer = csv.writer(pf, delimiter='\t', lineterminator='\n')
+        writer.writerow(['# keep', keep])
+        writer.writerow(['# paths'] + list(corrPathNames))
+        writer.writerow(planHeader)
+        for p, corrNames in corrPathNames.items():
+            for fn0, fn1 in corrNames:
+                src = os.path.join(p, fn0)
+                st = os.stat(src)
+                writer.writerow([
+                    src, (fn0 if fn1 is None else fn1),
+                    str(st.st_size), str(st.st_mtime_ns)
+                ])
+                n += 1
+    print(f'Combine plan of {n} file(s) written to {planFile}')
+    return n
+
+
+def readCombinePlan(planFile: str) -> tuple[dict[str, list[str]], list[tuple[str, str, int, int]]]:
+    # Returns ({"keep": [...], "paths": [...]}, [(source, target name, size, mtime_ns)])
+    info = {}
+    entries = []
+    with open(planFile, 'r', newline='') as pf:
+        for cols in csv.reader(pf, delimiter='\t'):
+            if len(cols) > 0 and cols[0].startswith('#'):
+                info[cols[0][1:].strip()] = cols[1:]
+            elif cols == planHeader or len(cols) == 0:
+                continue
+            else:
+                src, dst, size, mtime = cols
+                entries.append((src, dst, int(size), int(mtime)))
+    return info, entries
+
+
+def checkCombinePlan(
+    entries: list[tuple[str, str, int, int]]
+) -> tuple[list[tuple[str, str]], list[tuple[str, str]]]:
+    # Split plan entries in (src, target name) pairs that can be executed and
+    # the ones whose source is gone or changed since planning.
+    valid = []
+    changed = []
+    for src, dst, size, mtime in entries:
+        try:
+            st = os.stat(src)
+        except FileNotFoundError:
+            changed.append((src, dst))
+            continue
+        if st.st_size == size and st.st_mtime_ns == mtime:
+            valid.append((src, dst))
+        else:
+            changed.append((src, dst))
+    if len(changed) > 0:
+        print(f'{len(changed)} file(s) changed or removed since planning, skipped:')
+        for src, _ in changed:
+            print('\t' + src)
+    return valid, changed
@@ -0,0 +1,72 @@
+# Optional content deduplication before combining: files with identical bytes
+# (eg. the same assembly downloaded into two databases under different names)
+# are put in the target dir only once.
+# Only files sharing their size with another file are hashed, reading is
+# streamed and done in parallel. Empty files are left alone.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from tidy import getFileHash
+
+
+def getIdenticalFiles(files: list[str], threads: int = 1) -> list[list[str]]:
+    # Groups of (more than one) files with the same content, in input order.
+    bySize: dict[int, list[str]] = {}
+    for f in files:
+        bySize.setdefault(os.path.getsize(f), []).append(f)
+    candidates = [f for size, fs in bySize.items() if size > 0 and len(fs) > 1
+                  for f in fs]
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        hashes = list(executor.map(getFileHash, candidates))
+    byContent: dict[tuple[int, str], list[str]] = {}
+    for f, h in zip(candidates, hashes):
+        byContent.setdefault((os.path.getsize(f), h), []).append(f)
+    order = {f: i for i, f in enumerate(files)}
+    groups = [fs for fs in byContent.values() if len(fs) > 1]
+    groups.sort(key=lambda fs: order[fs[0]])
+    return groups
+
+
+def dedupPairs(
+    pairs: list[tuple[str, str]],
+    threads: int = 1,
+    existing: None|list[tuple[str, str]] = None
+) -> tuple[list[tuple[str, str]], list[tuple[str, str, str]]]:
+    # pairs are (source, target name). Of identical sources only the first
+    # pair is kept. existing are (source, target name) of files already in the
+    # target (update mode), they are always kept and come first, a new source
+    # identical to one of them is merged into it.
+    # Returns the kept pairs and the merged ones as
+    # [(kept target name, merged source, merged target name)].
+    existing = ([] if existing is None else existing)
+    existingTargets = dict(existing)
+    targetOf = {**existingTargets, **dict(pairs)}
+    dropped: dict[str, str] = {} # merged source -> kept source
+    files = [src for src, _ in existing] + [src for src, _ in pairs]
+    for group in getIdenticalFiles(files, threads=threads):
+        for src in group[1:]:
+            if not src in existingTargets:
+                dropped[src] = group[0]
+    keptPairs = [(src, dst) for src, dst in pairs if not src in dropped]
+    merged = [(targetOf[dropped[src]], src, dst) for src, dst in pairs if src in dropped]
+    return keptPairs, merged
+
+
+def getDedupReportFile(target: str) -> str:
+    return os.path.realpath(target) + '-dedup.tsv'
+
+
+def reportDedup(target: str, merged: list[tuple[str, str, str]]) -> None|str:
+    # Print a summary and write the mapping next to the target dir.
+    # Returns the report file, None when nothing was merged.
+    if len(merged) == 0:
+        print('No files with identical content found.')
+        return None
+    reportFile = getDedupReportFile(target)
+    print(f'{len(merged)} file(s) with content identical to another file are not combined, ' +
+          f'mapping in {reportFile}')
+    with open(reportFile, 'w') as rf:
+        rf.write('kept_target\tmerged_source\tmerged_target\n')
+        for entry in merged:
+            rf.write('\t'.join(entry) + '\n')
+    return reportFile
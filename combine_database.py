@@ -2,10 +2,35 @@ from combine import combineDatabases
 import argparse
 
 parser = argparse.ArgumentParser()
-parser.add_argument('p', nargs="+", help="pathes of databases (folders) you want to combine")
-parser.add_argument('-t', type=str, help='target dir to store combined files')
+parser.add_argument('p', nargs="*", help="pathes of databases (folders) you want to combine")
+parser.add_argument('-t', '--target', dest='t', type=str,
+                    help='target dir to store combined files, or a .tar/.zip archive to stream them into')
 parser.add_argument('--keep', type=str, help='If duplicated file names found, keep "first" or "all"')
+parser.add_argument('--linkMode', '--link-mode', choices=['copy', 'hardlink', 'reflink', 'symlink'],
+                    help='How files are put in target dir, falls back to hardlink/copy when not supported',
+                    default='copy')
+parser.add_argument('--threads', type=int, help='Number of files copied at the same time',
+                    default=4)
+parser.add_argument('--plan', type=str,
+                    help='Execute a plan written by check_combine.py --plan instead of checking p again')
+parser.add_argument('--dedup', action='store_true',
+                    help='Combine files with identical content only once, mapping written to T-dedup.tsv')
+parser.add_argument('--update', action='store_true',
+                    help='Add to an existing target dir, files combined before keep their names ' +
+                         'and are only copied again when changed')
+parser.add_argument('--transcode', choices=['plain', 'bgzf', 'zstd'],
+                    help='Recompress files (in --threads processes) instead of copying/linking them: ' +
+                         'plain text, BGZF (.gz) or zstd (.zst, needs the zstandard package)',
+                    default=None)
+parser.add_argument('--transcodeLevel', type=int,
+                    help='Compression level of --transcode, default 6 for bgzf and 3 for zstd',
+                    default=None)
 
 args = parser.parse_args()
+if len(args.p) == 0 and args.plan is None:
+    parser.error('give pathes of databases or --plan')
 
-combineDatabases(args.p, args.t, keep=args.keep)
\ No newline at end of file
+combineDatabases(args.p, args.t, keep=args.keep, linkMode=args.linkMode,
+                 threads=args.threads, plan=args.plan,
+                 dedup=args.dedup, update=args.update,
+                 transcode=args.transcode, transcodeLevel=args.transcodeLevel)
\ No newline at end of file
@@ -10,9 +10,77 @@ parser.add_argument('--excludeList', help="Exclusion list file, one item per lin
 parser.add_argument('--maxCtg', type=int,
                     help="Maximum number of contigs that a genome will be kept.",
                     default=None)
-parser.add_argument('--targetDir', type=str,
-                    help='Valid assemblies will be copied to this directory.',
+parser.add_argument('--targetDir', '--target', type=str,
+                    help='Valid assemblies will be copied to this directory, or ' +
+                    'streamed into this archive if it ends with .tar or .zip.',
+                    default=None)
+parser.add_argument('--jobs', type=int,
+                    help="Number of processes used to count contigs (and to transcode files).",
+                    default=1)
+parser.add_argument('--cache', choices=['use', 'rebuild', 'clear', 'off'],
+                    help="Contig number cache stored next to `dir`: use it, " +
+                    "rebuild it from scratch, clear (remove) it, or turn it off.",
+                    default='use')
+parser.add_argument('--cacheHash', action='store_true',
+                    help="Also store file content hash in the cache, keeps " +
+                    "cached counts valid for re-downloaded identical files.")
+parser.add_argument('--linkMode', '--link-mode',
+                    choices=['copy', 'hardlink', 'reflink', 'symlink'],
+                    help="How valid assemblies are put in target dir. Falls " +
+                    "back to hardlink/copy when not supported (eg. across devices).",
+                    default='copy')
+parser.add_argument('--threads', type=int,
+                    help="Number of threads for file system I/O: " +
+                    "scanning `dir` and copying files to target dir.",
+                    default=4)
+parser.add_argument('--tieBreakers', nargs='+', default=[],
+                    choices=['refseq_category', 'relation_to_type_material'],
+                    help="When assembly level and release date are the same " +
+                    "for one strain, prefer reference/representative genomes " +
+                    "and/or assemblies from type material.")
+parser.add_argument('--minN50', type=int,
+                    help="Minimum N50 of the sequences that a genome will be kept.",
+                    default=None)
+parser.add_argument('--minLength', type=int,
+                    help="Minimum total length that a genome will be kept.",
+                    default=None)
+parser.add_argument('--maxNs', type=float,
+                    help="Maximum percentage of N in the sequences that a genome will be kept.",
+                    default=None)
+parser.add_argument('--minGC', type=float,
+                    help="Minimum GC percentage that a genome will be kept.",
+                    default=None)
+parser.add_argument('--maxGC', type=float,
+                    help="Maximum GC percentage that a genome will be kept.",
+                    default=None)
+parser.add_argument('--stats', action='store_true',
+                    help="Add genome statistics to the -included.tsv report " +
+                    "(always done when one of the filters above is set).")
+parser.add_argument('--decompressor', choices=['auto', 'stdlib', 'isal', 'zlib-ng'],
+                    help="gzip implementation used to read genomes, " +
+                    "\"auto\" is the fastest one installed.",
+                    default='auto')
+parser.add_argument('--decompressThreads', type=int,
+                    help="Number of threads decompressing one BGZF file " +
+                    "(eg. compressed by bgzip), per job.",
+                    default=1)
+parser.add_argument('--verifyMd5', '--verify-md5', action='store_true',
+                    help="Check each genome against MD5SUMS in its folder, " +
+                    "in the same read as counting contigs.")
+parser.add_argument('--transcode', choices=['plain', 'bgzf', 'zstd'],
+                    help="Recompress the selected genomes on their way to target dir " +
+                    "(in --jobs processes) instead of copying/linking them: " +
+                    "plain text, BGZF (.gz) or zstd (.zst, needs the zstandard package).",
+                    default=None)
+parser.add_argument('--transcodeLevel', type=int,
+                    help="Compression level of --transcode, default 6 for bgzf and 3 for zstd.",
+                    default=None)
+parser.add_argument('--concat', type=str,
+                    help="Write all selected genomes (fasta) to this one file instead of a " +
+                    "target dir, headers prefixed by the strain name, with a samtools .fai " +
+                    "index and a .accessions.tsv map of sequences to assemblies next to it.",
                     default=None)
-args = parser.parse_args()
 
-gatherAssemblies(args)
+if __name__ == '__main__':
+    args = parser.parse_args()
+    gatherAssemblies(args)
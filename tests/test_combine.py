@@ -3,10 +3,16 @@ from unittest.mock import patch
 from io import StringIO
 import os
 import shutil
+import tempfile
+import gzip
+import zipfile
 from typing import Callable, Any
 from collections import namedtuple
 
 from combine import checkIllegal, splitExt, checkDup, checkCombine, combineDatabases
+from combine import scanDirs
+from combine import writeCombinePlan, readCombinePlan, getIdenticalFiles, dedupPairs
+from tidy import getManifestFile, readManifest
 
 argParser = namedtuple(
     'argParser',
@@ -16,16 +22,27 @@ argParser = namedtuple(
 )
 combinedDatabaseTarget = 'tests/test_data/combined'
 combinedDatabaseTarget_ka = 'tests/test_data/combined_ka'
+combinedDatabaseTarget_hl = 'tests/test_data/combined_hl'
+combinedDatabaseTarget_pl = 'tests/test_data/combined_pl'
+combinePlanFile = 'tests/test_data/combine_plan.tsv'
 
 class Test_check_safe_combine_databases(unittest.TestCase):
     
     @classmethod
     def tearDownClass(cls):
-        for dir in [combinedDatabaseTarget, combinedDatabaseTarget_ka]:
+        for dir in [combinedDatabaseTarget, combinedDatabaseTarget_ka, combinedDatabaseTarget_hl,
+                    combinedDatabaseTarget_pl]:
             try:
                 shutil.rmtree(dir)
             except FileNotFoundError:
                 pass
+        for f in [combinePlanFile] + [getManifestFile(dir) for dir in [
+                combinedDatabaseTarget, combinedDatabaseTarget_ka,
+                combinedDatabaseTarget_hl, combinedDatabaseTarget_pl]]:
+            try:
+                os.remove(f)
+            except FileNotFoundError:
+                pass
 
     def test_checkIllegal(self):
         # major function implemented in safeName(), also tested there.
@@ -44,10 +61,33 @@ class Test_check_safe_combine_databases(unittest.TestCase):
         for tupT, tupC in zip(checkIllegal(sources), corr):
             self.assertTupleEqual(tupT, tupC)
 
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_checkIllegalSummary(self, mock_stdout):
+        names = [f'name {i}.fna' for i in range(25)] + ['correct_name.fna']
+        corrNames = checkIllegal(names, maxShown=3)
+        self.assertEqual(len(corrNames), 26)
+        self.assertIn(('name 7.fna', 'name_7.fna'), corrNames)
+        self.assertIn(('correct_name.fna', None), corrNames)
+        lines = mock_stdout.getvalue().strip().split('\n')
+        self.assertEqual(lines[0], 'Found 25 file(s) with illegal characters:')
+        self.assertEqual(lines[-1], '... and 22 more')
+        self.assertEqual(len(lines), 1 + 3 * 2 + 1)
+
+    def test_scanDirs(self):
+        paths = ['tests/test_data/tdbs/tdb1', 'tests/test_data/tdbs/tdb2', 'tests/test_data/tdbs']
+        listings = scanDirs(paths, threads=2)
+        self.assertListEqual(list(listings), paths)
+        for p in paths:
+            self.assertListEqual(sorted(n for n, _ in listings[p]), sorted(os.listdir(p)))
+        self.assertIn(('tdb1', True), listings['tests/test_data/tdbs'])
+        self.assertIn(('file5.fna.gz', False), listings['tests/test_data/tdbs/tdb2'])
+
     def test_splitExt(self):
         self.assertTupleEqual(splitExt('file.name.faa.gz'), ('file.name', '.faa.gz'))
         self.assertTupleEqual(splitExt('file.name.fna.xz'), ('file.name', '.fna.xz'))
         self.assertTupleEqual(splitExt('file.name.fna'), ('file.name', '.fna'))
+        self.assertTupleEqual(splitExt('file.name.fna.zst'), ('file.name', '.fna.zst'))
+        self.assertTupleEqual(splitExt('file.name.gbff.bz2'), ('file.name', '.gbff.bz2'))
         self.assertTupleEqual(splitExt(None), (None, None))
     
 
@@ -191,6 +231,47 @@ class Test_check_safe_combine_databases(unittest.TestCase):
         for p in retB_ka:
             self.assertListEqual(retB_ka[p], retB_keepAll_expects[p], retB_ka)
 
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_checkDupNameRep(self, mock_stdout):
+        # names that already carry the suffix, several repeats of one name
+        inputD = {
+            'd1': [('a.txt', None), ('A.fna', None), ('a_name_rep1.txt', None)],
+            'd2': [('a.faa', None), ('A_name_rep2.txt', None), ('a b.txt', 'a_b.txt')],
+            'd3': [('a_b.txt', None), ('a.gz', None)],
+        }
+        outputD_expects = '\n'.join([
+            "Found duplicated name a:",
+                "\td1/a.txt",
+                    "\t\t--> (no change) a.txt",
+                "\td1/A.fna",
+                    "\t\t--> A_name_rep1.fna",
+                "\td2/a.faa",
+                    "\t\t--> a_name_rep3.faa",
+                "\td3/a.gz",
+                    "\t\t--> a_name_rep5.gz",
+            "Found duplicated name a_name_rep1:",
+                "\td1/a_name_rep1.txt",
+                    "\t\t--> a_name_rep2.txt",
+            "Found duplicated name a_b:",
+                "\td2/a b.txt",
+                    "\t\t--> a_b.txt",
+                "\td3/a_b.txt",
+                    "\t\t--> a_b_name_rep1.txt",
+            "Found duplicated name a_name_rep2:",
+                "\td2/A_name_rep2.txt",
+                    "\t\t--> A_name_rep4.txt",
+            "Found 4 none unique name(s), 4 unique one(s).",
+            "Total checked files: 8",
+        ]) + '\n\n'
+        retD_keepAll_expects = {
+            'd1': [('A.fna', 'A_name_rep1.fna'), ('a.txt', None), ('a_name_rep1.txt', 'a_name_rep2.txt')],
+            'd2': [('a b.txt', 'a_b.txt'), ('a.faa', 'a_name_rep3.faa'), ('A_name_rep2.txt', 'A_name_rep4.txt')],
+            'd3': [('a.gz', 'a_name_rep5.gz'), ('a_b.txt', 'a_b_name_rep1.txt')],
+        }
+        retD = checkDup(inputD, keep='all')
+        self.assertEqual(mock_stdout.getvalue(), outputD_expects)
+        self.assertDictEqual(retD, retD_keepAll_expects)
+
     @patch('sys.stdout', new_callable=StringIO)
     def test_checkCombine(self, mock_stdout):
         retC = checkCombine(
@@ -265,6 +346,24 @@ class Test_check_safe_combine_databases(unittest.TestCase):
         for p in retC_ka:
             self.assertListEqual(retC_ka[p], retC_keepAll_expects[p], retC_ka)
 
+        # summarized, and full report in a pager
+        mock_stdout.seek(0)
+        mock_stdout.truncate(0)
+        checkCombine(['tests/test_data/tdbs/tdb1', 'tests/test_data/tdbs/tdb2', 'tests/test_data/tdbs/tdb3'],
+                     keep='all', maxShown=1)
+        self.assertIn('... and 3 more duplicated name(s)', mock_stdout.getvalue())
+        mock_stdout.seek(0)
+        mock_stdout.truncate(0)
+        with patch('pydoc.pager') as mock_pager:
+            retC_pg = checkCombine(
+                ['tests/test_data/tdbs/tdb1', 'tests/test_data/tdbs/tdb2', 'tests/test_data/tdbs/tdb3'],
+                keep='all', maxShown=1, page=True
+            )
+        self.assertEqual(mock_stdout.getvalue(), '')
+        self.assertNotIn('more duplicated name(s)', mock_pager.call_args[0][0])
+        self.assertIn('Found duplicated name illegal_patt_a_b_:', mock_pager.call_args[0][0])
+        self.assertDictEqual(retC_pg, retC_ka)
+
         
     def test_combineDatabases(self):
         combineDatabases(
@@ -303,6 +402,261 @@ class Test_check_safe_combine_databases(unittest.TestCase):
         combinedDirFiles_ka = sorted(os.listdir(combinedDatabaseTarget_ka))
         self.assertListEqual(combinedDirFiles_ka, expectFiles_ka, combinedDirFiles_ka)
 
+        combineDatabases(
+            ['tests/test_data/tdbs/tdb1', 'tests/test_data/tdbs/tdb2', 'tests/test_data/tdbs/tdb3'],
+            combinedDatabaseTarget_hl,
+            linkMode='hardlink'
+        )
+        combinedDirFiles_hl = sorted(os.listdir(combinedDatabaseTarget_hl))
+        self.assertListEqual(combinedDirFiles_hl, expectFiles, combinedDirFiles_hl)
+        self.assertTrue(os.path.samefile(
+            os.path.join(combinedDatabaseTarget_hl, 'illegal_patt_a_b_.txt'),
+            'tests/test_data/tdbs/tdb1/illegal patt(a)[b*].txt'
+        ))
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_combinePlan(self, mock_stdout):
+        paths = ['tests/test_data/tdbs/tdb1', 'tests/test_data/tdbs/tdb2', 'tests/test_data/tdbs/tdb3']
+        corrPathNames = checkCombine(paths, keep='all')
+        n = writeCombinePlan(corrPathNames, combinePlanFile, keep='all')
+        self.assertEqual(n, 11)
+        info, entries = readCombinePlan(combinePlanFile)
+        self.assertListEqual(info['keep'], ['all'])
+        self.assertListEqual(info['paths'], paths)
+        self.assertIn(
+            ('tests/test_data/tdbs/tdb2/FIle4.aa.gz', 'FIle4_name_rep1.aa.gz'),
+            [e[:2] for e in entries]
+        )
+
+        # a source changed after planning is skipped
+        changedSrc = 'tests/test_data/tdbs/tdb1/file1.txt'
+        st = os.stat(changedSrc)
+        os.utime(changedSrc, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        try:
+            with patch('combine.combine_databases.checkCombine') as mock_check:
+                combineDatabases([], combinedDatabaseTarget_pl, plan=combinePlanFile)
+                mock_check.assert_not_called()
+        finally:
+            os.utime(changedSrc, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertIn(changedSrc, mock_stdout.getvalue())
+        expectFiles_pl = sorted(e[1] for e in entries if e[0] != changedSrc)
+        combinedDirFiles_pl = sorted(os.listdir(combinedDatabaseTarget_pl))
+        self.assertListEqual(combinedDirFiles_pl, expectFiles_pl, combinedDirFiles_pl)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_combinePlanIllegalNames(self, mock_stdout):
+        # tabs and newlines in source names survive the plan file
+        with tempfile.TemporaryDirectory() as tmpDir:
+            src = os.path.join(tmpDir, 'd1')
+            os.makedirs(src)
+            for n in ['a\tb.fna.gz', 'c\nd "e".fna.gz']:
+                with open(os.path.join(src, n), 'wb') as fh:
+                    fh.write(n.encode())
+            planFile = os.path.join(tmpDir, 'plan.tsv')
+            writeCombinePlan(checkCombine([src]), planFile)
+            info, entries = readCombinePlan(planFile)
+            self.assertListEqual(info['paths'], [src])
+            self.assertListEqual(sorted(e[:2] for e in entries), [
+                (os.path.join(src, 'a\tb.fna.gz'), 'a_b.fna.gz'),
+                (os.path.join(src, 'c\nd "e".fna.gz'), 'c_d_e_.fna.gz'),
+            ])
+            target = os.path.join(tmpDir, 'combined')
+            combineDatabases([], target, plan=planFile)
+            self.assertListEqual(sorted(os.listdir(target)), ['a_b.fna.gz', 'c_d_e_.fna.gz'])
+            with open(os.path.join(target, 'a_b.fna.gz'), 'rb') as fh:
+                self.assertEqual(fh.read(), b'a\tb.fna.gz')
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_dedup(self, mock_stdout):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            contents = {
+                'd1/a.fna': b'>1\nACGT\n',
+                'd1/b.fna': b'>2\nACGA\n', # same size as a, other content
+                'd2/a_copy.fna': b'>1\nACGT\n',
+                'd2/c.fna': b'>3\nAC\n',
+                'd3/a.fna': b'>1\nACGT\n',
+                'd3/empty.txt': b'',
+                'd3/empty2.txt': b'',
+            }
+            for f, c in contents.items():
+                os.makedirs(os.path.join(tmpDir, os.path.dirname(f)), exist_ok=True)
+                with open(os.path.join(tmpDir, f), 'wb') as fh:
+                    fh.write(c)
+            files = [os.path.join(tmpDir, f) for f in contents]
+            groups = getIdenticalFiles(files, threads=2)
+            self.assertListEqual(groups, [[files[0], files[2], files[4]]])
+
+            pairs = [(f, os.path.basename(f)) for f in files]
+            pairs[4] = (files[4], 'a_name_rep1.fna')
+            keptPairs, merged = dedupPairs(pairs, threads=2)
+            self.assertListEqual(keptPairs, [p for i, p in enumerate(pairs) if not i in [2, 4]])
+            self.assertListEqual(merged, [
+                ('a.fna', files[2], 'a_copy.fna'),
+                ('a.fna', files[4], 'a_name_rep1.fna'),
+            ])
+
+            target = os.path.join(tmpDir, 'combined')
+            combineDatabases([os.path.join(tmpDir, d) for d in ['d1', 'd2', 'd3']],
+                             target, keep='all', dedup=True)
+            self.assertListEqual(sorted(os.listdir(target)),
+                                 ['a.fna', 'b.fna', 'c.fna', 'empty.txt', 'empty2.txt'])
+            with open(target + '-dedup.tsv') as rf:
+                self.assertEqual(len(rf.readlines()), 3)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_combineDatabasesUpdate(self, mock_stdout):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            contents = {
+                'd1/a.fna': b'>1\nACGT\n',
+                'd1/b c.fna': b'>2\nACGA\n',
+                'd2/A.faa': b'>3\nMK\n',
+                'd2/d.fna': b'>4\nAC\n',
+                'd3/a.gbff': b'LOCUS 5\n',
+            }
+            for f, c in contents.items():
+                os.makedirs(os.path.join(tmpDir, os.path.dirname(f)), exist_ok=True)
+                with open(os.path.join(tmpDir, f), 'wb') as fh:
+                    fh.write(c)
+            d1, d2, d3 = [os.path.join(tmpDir, d) for d in ['d1', 'd2', 'd3']]
+            target = os.path.join(tmpDir, 'combined')
+            combineDatabases([d1], target, keep='all')
+            with self.assertRaises(FileExistsError):
+                combineDatabases([d1, d2], target, keep='all')
+            inode = os.stat(os.path.join(target, 'a.fna')).st_ino
+
+            # only the new dir given, numbering continues after the files in target
+            mock_stdout.seek(0)
+            mock_stdout.truncate(0)
+            combineDatabases([d2], target, keep='all', update=True)
+            self.assertIn('0 file(s) unchanged, 2 to transfer, 2 other(s) kept', mock_stdout.getvalue())
+            self.assertListEqual(sorted(os.listdir(target)),
+                                 ['A_name_rep1.faa', 'a.fna', 'b_c.fna', 'd.fna'])
+            self.assertEqual(os.stat(os.path.join(target, 'a.fna')).st_ino, inode)
+
+            # all dirs given, files combined before keep their names
+            mock_stdout.seek(0)
+            mock_stdout.truncate(0)
+            combineDatabases([d1, d2, d3], target, keep='all', update=True)
+            self.assertIn('4 file(s) combined before, 1 new.', mock_stdout.getvalue())
+            self.assertIn('4 file(s) unchanged, 1 to transfer', mock_stdout.getvalue())
+            self.assertListEqual(sorted(os.listdir(target)),
+                                 ['A_name_rep1.faa', 'a.fna', 'a_name_rep2.gbff', 'b_c.fna', 'd.fna'])
+
+            # changed source copied again under the same name
+            with open(os.path.join(d2, 'A.faa'), 'wb') as fh:
+                fh.write(b'>3\nMKL\n')
+            mock_stdout.seek(0)
+            mock_stdout.truncate(0)
+            combineDatabases([d1, d2, d3], target, keep='all', update=True)
+            self.assertIn('4 file(s) unchanged, 1 to transfer', mock_stdout.getvalue())
+            with open(os.path.join(target, 'A_name_rep1.faa'), 'rb') as fh:
+                self.assertEqual(fh.read(), b'>3\nMKL\n')
+
+            # target combined without manifest, files found by name and size
+            os.remove(getManifestFile(target))
+            mock_stdout.seek(0)
+            mock_stdout.truncate(0)
+            combineDatabases([d1], target, keep='all', update=True)
+            self.assertIn('2 file(s) combined before, 0 new.', mock_stdout.getvalue())
+            self.assertIn('2 file(s) unchanged, 0 to transfer', mock_stdout.getvalue())
+            self.assertEqual(len(readManifest(getManifestFile(target))), 2)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_combineDatabasesUpdateSameName(self, mock_stdout):
+        # same name and size in another dir, not taken for the file in target
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for f, c in [('d1/a.fna', b'>1\nACGT\n'), ('d2/a.fna', b'>2\nACGA\n'),
+                         ('d3/a.fna', b'>3\nACGC\n')]:
+                os.makedirs(os.path.join(tmpDir, os.path.dirname(f)), exist_ok=True)
+                with open(os.path.join(tmpDir, f), 'wb') as fh:
+                    fh.write(c)
+            d1, d2, d3 = [os.path.join(tmpDir, d) for d in ['d1', 'd2', 'd3']]
+            target = os.path.join(tmpDir, 'combined')
+            combineDatabases([d1], target, keep='all')
+            mock_stdout.seek(0)
+            mock_stdout.truncate(0)
+            combineDatabases([d2, d3], target, keep='all', update=True)
+            self.assertIn('0 file(s) combined before, 2 new.', mock_stdout.getvalue())
+            self.assertListEqual(sorted(os.listdir(target)),
+                                 ['a.fna', 'a_name_rep1.fna', 'a_name_rep2.fna'])
+            with open(os.path.join(target, 'a.fna'), 'rb') as fh:
+                self.assertEqual(fh.read(), b'>1\nACGT\n')
+            manifest = readManifest(getManifestFile(target))
+            self.assertEqual(sorted(entry[3] for entry in manifest.values()),
+                             ['a.fna', 'a_name_rep1.fna', 'a_name_rep2.fna'])
+
+            # without manifest, only one source is taken for a.fna
+            os.remove(getManifestFile(target))
+            for f in ['a_name_rep1.fna', 'a_name_rep2.fna']:
+                os.remove(os.path.join(target, f))
+            mock_stdout.seek(0)
+            mock_stdout.truncate(0)
+            combineDatabases([d2, d3], target, keep='all', update=True)
+            self.assertIn('1 file(s) combined before, 1 new.', mock_stdout.getvalue())
+            self.assertListEqual(sorted(os.listdir(target)), ['a.fna', 'a_name_rep1.fna'])
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_combineDatabasesUpdateDedup(self, mock_stdout):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for f, c in [('d1/a.fna', b'>1\nACGT\n'), ('d2/b.fna', b'>1\nACGT\n'),
+                         ('d2/c.fna', b'>2\nACGA\n'), ('d3/e.fna', b'>2\nACGA\n')]:
+                os.makedirs(os.path.join(tmpDir, os.path.dirname(f)), exist_ok=True)
+                with open(os.path.join(tmpDir, f), 'wb') as fh:
+                    fh.write(c)
+            d1, d2, d3 = [os.path.join(tmpDir, d) for d in ['d1', 'd2', 'd3']]
+            target = os.path.join(tmpDir, 'combined')
+            combineDatabases([d1], target, dedup=True)
+            # b.fna is identical to a.fna combined before
+            combineDatabases([d2], target, dedup=True, update=True)
+            self.assertListEqual(sorted(os.listdir(target)), ['a.fna', 'c.fna'])
+            with open(os.path.join(tmpDir, 'combined-dedup.tsv'), 'r') as fh:
+                self.assertIn(f'a.fna\t{os.path.join(d2, "b.fna")}\tb.fna', fh.read())
+            # files combined before are never merged, new ones compared to them
+            combineDatabases([d1, d2, d3], target, dedup=True, update=True)
+            self.assertListEqual(sorted(os.listdir(target)), ['a.fna', 'c.fna'])
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_combineDatabasesTranscode(self, mock_stdout):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            d1, d2 = [os.path.join(tmpDir, d) for d in ['d1', 'd2']]
+            os.makedirs(d1)
+            os.makedirs(d2)
+            with open(os.path.join(d1, 'a.fna'), 'wb') as fh:
+                fh.write(b'>1\nACGT\n')
+            with gzip.open(os.path.join(d2, 'b.fna.gz'), 'wb') as fh:
+                fh.write(b'>2\nACGA\n')
+            target = os.path.join(tmpDir, 'combined')
+            combineDatabases([d1, d2], target, transcode='bgzf')
+            self.assertListEqual(sorted(os.listdir(target)), ['a.fna.gz', 'b.fna.gz'])
+            self.assertIn('Transcoded 2 file(s) to bgzf:6', mock_stdout.getvalue())
+            for f, content in [('a.fna.gz', b'>1\nACGT\n'), ('b.fna.gz', b'>2\nACGA\n')]:
+                with gzip.open(os.path.join(target, f), 'rb') as fh:
+                    self.assertEqual(fh.read(), content)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_combineDatabasesArchive(self, mock_stdout):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            d1, d2 = [os.path.join(tmpDir, d) for d in ['d1', 'd2']]
+            os.makedirs(d1)
+            os.makedirs(d2)
+            for f, c in [('d1/a b.fna', b'>1\nACGT\n'), ('d2/c.fna', b'>1\nACGT\n'),
+                         ('d2/d.faa', b'>2\nMK\n')]:
+                with open(os.path.join(tmpDir, f), 'wb') as fh:
+                    fh.write(c)
+            target = os.path.join(tmpDir, 'combined.zip')
+            combineDatabases([d1, d2], target, dedup=True, transcode='bgzf')
+            with zipfile.ZipFile(target) as zf:
+                self.assertListEqual(sorted(zf.namelist()), [
+                    'combined-dedup.tsv', 'combined/a_b.fna.gz', 'combined/d.faa.gz'])
+                self.assertEqual(gzip.decompress(zf.read('combined/d.faa.gz')), b'>2\nMK\n')
+            # no target dir or manifest, only the archive and its report
+            self.assertListEqual(sorted(os.listdir(tmpDir)),
+                                 ['combined-dedup.tsv', 'combined.zip', 'd1', 'd2'])
+            with self.assertRaises(FileExistsError):
+                combineDatabases([d1, d2], target)
+            with self.assertRaises(ValueError):
+                combineDatabases([d1, d2], os.path.join(tmpDir, 'other.tar'), update=True)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,17 +1,43 @@
 import unittest
 import os
 import shutil
+import gzip
+import bz2
+import lzma
+import tempfile
+import tarfile
+import zipfile
+import pandas as pd
+import errno
+from unittest.mock import patch
+from io import StringIO
 from collections import namedtuple
+from functools import partial
 
 from tidy import getInfoFrom, removeDup, removeEqu, getNumCtgs, \
     getExclusion, filterDownloads, filterTooManyCtgs, gatherAssemblies, \
-    generateTargetDir, safeName
+    generateTargetDir, safeName, countRecords, iterChunks, recordStarts, \
+    CtgCache, openCtgCache, getCacheFile, getAssemblyStats, getStatsFile, \
+    getNumCtgsFromStats, transferFile, transferFiles, syncFiles, \
+    getManifestFile, readManifest, getStrainNames, SubstringMatcher, \
+    compileExclusions, selectBestAssemblies, parseDates, scanDownloadDir, \
+    getScanReportFile, AssemblyRecord, getGenomeStats, filterGenomeStats, \
+    statsColumns, setDecompression, getDecompression, compressBlock, BGZF_EOF, \
+    BGZF_BLOCK_SIZE, isBgzf, readMd5Sums, readVerified, filterVerified, getFileHash, \
+    getTranscodeMode, getTranscodedName, transcodeFiles, zstandard, concatAssemblies, \
+    transcodeFileRetry
 
 argParser = namedtuple(
     'argParser',
     [
-        'dir', 'tsv', 'excludeList', 'maxCtg', 'targetDir'
-    ]
+        'dir', 'tsv', 'excludeList', 'maxCtg', 'targetDir', 'jobs',
+        'cache', 'cacheHash', 'linkMode', 'threads', 'tieBreakers',
+        'minN50', 'minLength', 'maxNs', 'minGC', 'maxGC', 'stats',
+        'decompressor', 'decompressThreads', 'verifyMd5', 'transcode', 'transcodeLevel',
+        'concat'
+    ],
+    defaults=[1, 'off', False, 'copy', 2, (), None, None, None, None, None, False, 'auto', 1,
+              False, None, None, None]
 )
 
 class Test_strainNameComprehension(unittest.TestCase):
@@ -45,7 +71,11 @@ class Test_strainNameComprehension(unittest.TestCase):
             "M1154/pAMX4/pGP1416",
             "M1154 M1154",
             "C34 = DSM 42122 = NRRL B-24963",
-            ""
+            "",
+            "MA-4680 = NBRC 14893 MA-4680 = NBRC 14893",
+            "NBRC 14893 = NBRC 14893 = NBRC 14893",
+            "DSM 1 = NBRC 1",
+            "B-2 = DSM B-24963",
         ]
         results = [
             "MA-4680 NBRC 14893",
@@ -57,10 +87,44 @@ class Test_strainNameComprehension(unittest.TestCase):
             "M1154/pAMX4/pGP1416",
             "M1154",
             "C34 DSM 42122 NRRL B-24963",
-            ""
+            "",
+            "MA-4680 NBRC 14893",
+            "NBRC 14893",
+            "DSM 1 NBRC 1",
+            "B-2 DSM B-24963",
         ]
+        self.assertEqual(len(sources), len(results))
         for s, r in zip(sources, results):
             self.assertEqual(removeDup(s), r)
+        # repeated names are served from the cache
+        hits = removeDup.cache_info().hits
+        removeDup(sources[0])
+        self.assertEqual(removeDup.cache_info().hits, hits + 1)
+
+    def test_getStrainNames(self):
+        infoDf = pd.DataFrame({
+            'organism_name': [
+                'Streptomyces avermitilis MA-4680 = NBRC 14893 ',  # trailing space
+                'Streptomyces specialis',
+                'Streptomyces leeuwenhoekii',
+                'Streptomyces sp.',
+                'Streptomyces coelicolor M1154',
+            ],
+            'infraspecific_name': [
+                'strain=NBRC 14893',
+                'strain=type strain: GW41-1564/R2',
+                'strain=type strain (C34 = DSM 42122 = NRRL B-24963)',
+                float('nan'),
+                'strain=M1154',
+            ],
+        })
+        self.assertListEqual(getStrainNames(infoDf).tolist(), [
+            'Streptomyces avermitilis MA-4680 NBRC 14893',
+            'Streptomyces specialis GW41-1564/R2',
+            'Streptomyces leeuwenhoekii C34 DSM 42122 NRRL B-24963',
+            'Streptomyces sp.',
+            'Streptomyces coelicolor M1154',
+        ])
 
 class Test_biosequenceCounting(unittest.TestCase):
     def setUp(self) -> None:
@@ -81,6 +145,445 @@ class Test_biosequenceCounting(unittest.TestCase):
             self.assertEqual(getNumCtgs(f), n)
         self.assertRaises(Exception, getNumCtgs, "abc.unknown.gz")
 
+    def test_countCtgsEarlyExit(self):
+        f = 'tests/test_data/ncbi-ftp-download/refseq/bacteria/GCF_002289305.1/GCF_002289305.1_CMB-CS145_genomic.fna.gz'
+        self.assertEqual(getNumCtgs(f), 461)
+        self.assertEqual(getNumCtgs(f, 500), 461)
+        self.assertEqual(getNumCtgs(f, 461), 461)
+        self.assertGreater(getNumCtgs(f, 400), 400)
+        chunks = [b'>a\n', b'>b\n', b'>c\n', b'>d\n']
+        self.assertEqual(countRecords(iter(chunks), b'\n>', limit=1), 2)
+
+    def test_countCtgsBgzf(self):
+        with gzip.open('tests/test_data/ncbi-ftp-download/refseq/bacteria/GCF_002289305.1/' +
+                       'GCF_002289305.1_CMB-CS145_genomic.fna.gz', 'rb') as fh:
+            content = fh.read()
+        with tempfile.TemporaryDirectory() as tmpDir:
+            f = os.path.join(tmpDir, 'test.fna.gz')
+            with open(f, 'wb') as fh:
+                for i in range(0, len(content), 1000): # many small blocks
+                    fh.write(compressBlock(content[i:i+1000]))
+                fh.write(BGZF_EOF)
+            with open(f, 'rb') as fh:
+                self.assertTrue(isBgzf(fh.read(64)))
+            self.assertFalse(isBgzf(gzip.compress(content)))
+            try:
+                for threads in [1, 4]:
+                    setDecompression('stdlib', threads)
+                    self.assertEqual(b''.join(iterChunks(f, chunkSize=3000)), content)
+                    self.assertEqual(getNumCtgs(f), 461)
+                    self.assertGreater(getNumCtgs(f, 10), 10)
+                # truncated
+                with open(f, 'r+b') as fh:
+                    fh.truncate(os.path.getsize(f) - 100)
+                self.assertRaises(EOFError, getNumCtgs, f)
+            finally:
+                setDecompression('stdlib', 1)
+        self.assertRaises(ValueError, setDecompression, 'unknown')
+        setDecompression('auto')
+        self.assertIn(getDecompression()[0], ['isal', 'zlib-ng', 'stdlib'])
+        setDecompression('stdlib')
+
+    def test_genomeStats(self):
+        content = b'>a desc\nACGTNN\nGG\n>b\n\nAT\n>c\nGGCC\nCC\nnn\n'
+        expects = {'contigs': 3, 'total_length': 18, 'N50': 8, 'L50': 2,
+                   'GC_percent': 71.43, 'N_percent': 22.2222}
+        with tempfile.TemporaryDirectory() as tmpDir:
+            f = os.path.join(tmpDir, 'test.fna.gz')
+            with gzip.open(f, 'wb') as fh:
+                fh.write(content[:-1]) # no newline at the end
+            self.assertDictEqual(getGenomeStats(f), expects)
+            # records and lines across chunk boundaries
+            with patch('tidy.genome_stats.iterChunks',
+                       lambda file: (content[i:i+3] for i in range(0, len(content), 3))):
+                self.assertDictEqual(getGenomeStats(f), expects)
+        gbStats = getGenomeStats('tests/test_data/numCtgs/test.gpff.gz')
+        self.assertEqual(gbStats['contigs'], 27)
+        self.assertEqual(gbStats['total_length'], 5348)
+        self.assertEqual(gbStats['N50'], 272)
+        self.assertEqual(getGenomeStats('tests/test_data/numCtgs/test.fna.gz')['contigs'], 3)
+
+    def test_countCtgsCompression(self):
+        with gzip.open('tests/test_data/numCtgs/test.fna.gz', 'rb') as fh:
+            content = fh.read()
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for ext, opener in [
+                ('.fna', open),
+                ('.fna.gz', gzip.open),
+                ('.fna.xz', lzma.open),
+                ('.fna.bz2', bz2.open),
+                ('.fasta', gzip.open), # compressed without the extension
+            ]:
+                f = os.path.join(tmpDir, f'test file (1){ext}')
+                with opener(f, 'wb') as fh:
+                    fh.write(content)
+                self.assertEqual(getNumCtgs(f), 3, f)
+
+    def test_countRecordsChunkBoundary(self):
+        for f, n in [
+            ('tests/test_data/numCtgs/test.fna.gz', 3),
+            ('tests/test_data/numCtgs/test.gpff.gz', 27),
+        ]:
+            pattern = recordStarts['genbank' if 'gpff' in f else 'fasta']
+            for chunkSize in [1, 2, 3, 5, 7, 64]:
+                self.assertEqual(
+                    countRecords(iterChunks(f, chunkSize), pattern), n, chunkSize)
+        # record marker not at line start must not be counted
+        self.assertEqual(countRecords([b'>a\nAC>G\n', b'>b\n'], b'\n>'), 2)
+        self.assertEqual(countRecords([b'LOC', b'US a\n', b'xLOCUS \nLOCUS b'],
+                                      recordStarts['genbank']), 2)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_concatAssemblies(self, mock_stdout):
+        src = 'tests/test_data/numCtgs/test.fna.gz'
+        records = {}
+        with gzip.open(src, 'rt') as fh:
+            for block in fh.read().split('>')[1:]:
+                header, seq = block.split('\n', 1)
+                records[header.split()[0]] = seq.replace('\n', '')
+        with tempfile.TemporaryDirectory() as tmpDir:
+            gbFile = os.path.join(tmpDir, 'b.fna')
+            with open(gbFile, 'w') as fh:
+                fh.write('>x desc\nAC\nGTA\n\n>y\n>z\nACGTACGTAC\n')
+            records.update({'x': 'ACGTA', 'y': '', 'z': 'ACGTACGTAC'})
+            concatFile = os.path.join(tmpDir, 'all.fna')
+            faiFile, mapFile = concatAssemblies(
+                [('Strain_A', 'Strain A', 'GCF_1', src), ('Strain_B', 'Strain B', 'GCF_2', gbFile)],
+                concatFile, lineWidth=7)
+            self.assertListEqual(sorted(os.listdir(tmpDir)), ['all.fna', 'all.fna.accessions.tsv',
+                                                              'all.fna.fai', 'b.fna'])
+            with open(faiFile, 'r') as fh:
+                fai = [l.rstrip('\n').split('\t') for l in fh]
+            self.assertEqual(len(fai), 6)
+            # every sequence found from its index entry alone
+            with open(concatFile, 'rb') as fh:
+                for name, length, offset, lineBases, lineWidth in fai:
+                    length, offset, lineBases, lineWidth = \
+                        int(length), int(offset), int(lineBases), int(lineWidth)
+                    nLines = (length + lineBases - 1) // lineBases if length > 0 else 0
+                    fh.seek(offset)
+                    seq = fh.read(nLines * lineWidth).decode().replace('\n', '')[:length]
+                    self.assertEqual(seq, records[name.split('|', 1)[1]])
+                fh.seek(0)
+                content = fh.read().decode()
+            self.assertIn('>Strain_B|x desc\nACGTA\n>Strain_B|y\n>Strain_B|z\nACGTACG\nTAC\n', content)
+            self.assertEqual(fai[0][:2], ['Strain_A|NR_075742.1', '116'])
+            with open(mapFile, 'r') as fh:
+                rows = [l.rstrip('\n').split('\t') for l in fh]
+            self.assertListEqual(rows[0], ['sequence', 'assembly_accession', 'strain'])
+            self.assertListEqual(rows[-1], ['Strain_B|z', 'GCF_2', 'Strain B'])
+            self.assertRaises(Exception, concatAssemblies,
+                              [('s', 's', 'a', 'tests/test_data/numCtgs/test.gpff.gz')],
+                              os.path.join(tmpDir, 'gb.fna'))
+            self.assertNotIn('gb.fna', os.listdir(tmpDir))
+
+class Test_assemblyStats(unittest.TestCase):
+    def test_getAssemblyStats(self):
+        statsFile = 'tests/test_data/assemblyStats/GCF_000009765.2_ASM976v2_assembly_stats.txt'
+        self.assertEqual(
+            getStatsFile('GCF_000009765.2/GCF_000009765.2_ASM976v2_genomic.fna.gz'),
+            'GCF_000009765.2/GCF_000009765.2_ASM976v2_assembly_stats.txt')
+        self.assertEqual(
+            getStatsFile('GCF_001493375.1/GCF_001493375.1_Streptomyces_specialis_protein.faa.gz'),
+            'GCF_001493375.1/GCF_001493375.1_Streptomyces_specialis_assembly_stats.txt')
+        stats = getAssemblyStats(statsFile)
+        self.assertEqual(stats['total-length'], 9119895)
+        self.assertEqual(stats['scaffold-count'], 2)
+        self.assertEqual(stats['contig-N50'], 9025608)
+        self.assertEqual(getNumCtgsFromStats(
+            'tests/test_data/assemblyStats/GCF_000009765.2_ASM976v2_protein.faa.gz'), 2)
+        self.assertIsNone(getNumCtgsFromStats('tests/test_data/numCtgs/test.fna.gz'))
+
+    def test_filterTooManyCtgsStats(self):
+        # stats file is preferred over scanning the (protein) sequence file
+        with tempfile.TemporaryDirectory() as tmpDir:
+            seqFile = os.path.join(tmpDir, 'GCF_000009765.2_ASM976v2_protein.gpff.gz')
+            shutil.copy('tests/test_data/numCtgs/test.gpff.gz', seqFile)
+            validAssemblies = {
+                'a': ('GCF_000009765.2', {'assembly_level': 'Scaffold', 'local_filename': seqFile}),
+            }
+            validAssemblies, tooManyContigs, _ = filterTooManyCtgs(dict(validAssemblies), 10, [])
+            self.assertEqual(len(tooManyContigs), 1)
+            shutil.copy('tests/test_data/assemblyStats/GCF_000009765.2_ASM976v2_assembly_stats.txt', tmpDir)
+            validAssemblies = {
+                'a': ('GCF_000009765.2', {'assembly_level': 'Scaffold', 'local_filename': seqFile}),
+            }
+            validAssemblies, tooManyContigs, _ = filterTooManyCtgs(validAssemblies, 10, [])
+            self.assertEqual(len(tooManyContigs), 0)
+            self.assertListEqual(list(validAssemblies), ['a'])
+            # the count from the stats file is exact
+            validAssemblies, tooManyContigs, _ = filterTooManyCtgs(validAssemblies, 1, [])
+            self.assertListEqual(tooManyContigs, [('a', 'GCF_000009765.2', '2')])
+
+    def test_filterGenomeStats(self):
+        folder = 'tests/test_data/ncbi-ftp-download/refseq/bacteria/'
+        validAssemblies = {
+            'a': ('GCF_001493375.1', {'assembly_level': 'Contig', 'local_filename':
+                folder + 'GCF_001493375.1/GCF_001493375.1_Streptomyces_specialis_genomic.fna.gz'}),
+            'b': ('GCF_002289305.1', {'assembly_level': 'Contig', 'local_filename':
+                folder + 'GCF_002289305.1/GCF_002289305.1_CMB-CS145_genomic.fna.gz'}),
+            'c': ('GCF_000009765.2', {'assembly_level': 'Complete Genome', 'local_filename':
+                folder + 'GCF_000009765.2/GCF_000009765.2_ASM976v2_genomic.fna.gz'}),
+            'd': ('GCF_000764715.1', {'assembly_level': 'Contig', 'local_filename':
+                folder + 'GCF_000764715.1/GCF_000764715.1_ASM76471v1_genomic.fna.gz'}),
+        }
+        validAssemblies, genomeStats, tooManyContigs, lowQuality, unreadable = filterGenomeStats(
+            validAssemblies, {'minLength': 1000, 'maxGC': 75}, [], maxCtg=400, tooManyContigs=[])
+        self.assertListEqual(list(validAssemblies), ['a', 'd'])
+        self.assertListEqual(list(genomeStats), ['a', 'd'])
+        self.assertEqual(genomeStats['a']['contigs'], 143)
+        self.assertListEqual(tooManyContigs, [('b', 'GCF_002289305.1', '461')])
+        self.assertListEqual(lowQuality, [('c', 'GCF_000009765.2', 'total_length=160 (minLength 1000)')])
+        self.assertListEqual(unreadable, [])
+
+    def test_verifyMd5(self):
+        src = 'tests/test_data/ncbi-ftp-download/refseq/bacteria/GCF_002289305.1/' + \
+            'GCF_002289305.1_CMB-CS145_genomic.fna.gz'
+        with open(src, 'rb') as fh:
+            raw = fh.read()
+        content = gzip.decompress(raw)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            files = {}
+            for name, data in [
+                ('ok', raw),
+                ('truncated', raw[:len(raw) // 2]),
+                ('flipped', raw[:100] + bytes([raw[100] ^ 1]) + raw[101:]),
+                ('bgzf', b''.join(compressBlock(content[i:i+5000])
+                                  for i in range(0, len(content), 5000)) + BGZF_EOF),
+            ]:
+                os.makedirs(os.path.join(tmpDir, name))
+                files[name] = os.path.join(tmpDir, name, f'{name}_genomic.fna.gz')
+                with open(files[name], 'wb') as fh:
+                    fh.write(data)
+                with open(os.path.join(tmpDir, name, 'MD5SUMS'), 'w') as fh:
+                    fh.write(f'0123\t./{name}_other.txt\n')
+                    fh.write(f'{getFileHash(src if name != "bgzf" else files[name])}  ./{name}_genomic.fna.gz\n')
+            noSum = os.path.join(tmpDir, 'noSum.fna.gz')
+            shutil.copy(src, noSum)
+            self.assertEqual(len(readMd5Sums(os.path.join(tmpDir, 'ok', 'MD5SUMS'))), 2)
+
+            self.assertTupleEqual(readVerified(files['ok']), (None, None, 'ok'))
+            self.assertTupleEqual(readVerified(noSum), (None, None, 'missing'))
+            self.assertEqual(readVerified(files['flipped'])[2], 'mismatch')
+            count = partial(countRecords, pattern=b'\n>')
+            self.assertTupleEqual(readVerified(files['ok'], count), (461, None, 'ok'))
+            # early exit of the count, the md5 is still of the whole file
+            self.assertTupleEqual(readVerified(files['ok'], partial(count, limit=10))[1:], (None, 'ok'))
+            n, error, check = readVerified(files['truncated'], count)
+            self.assertTrue(error.startswith('EOFError'))
+            self.assertEqual(check, 'mismatch')
+            try:
+                setDecompression('stdlib', 2)
+                self.assertTupleEqual(readVerified(files['bgzf'], partial(count, limit=10))[1:], (None, 'ok'))
+            finally:
+                setDecompression('stdlib', 1)
+
+            validAssemblies = {
+                name: (name, {'assembly_level': 'Contig', 'local_filename': f})
+                for name, f in list(files.items()) + [('noSum', noSum)]
+            }
+            validAssemblies['flipped'][1]['assembly_level'] = 'Complete Genome'
+            validAssemblies, tooManyContigs, corrupt, unreadable = filterVerified(
+                validAssemblies, 400, [], [])
+            self.assertListEqual(list(validAssemblies), [])
+            self.assertListEqual(tooManyContigs, [('ok', 'ok', '>400'), ('bgzf', 'bgzf', '>400'),
+                                                  ('noSum', 'noSum', '>400')])
+            self.assertListEqual([c[0] for c in corrupt], ['truncated', 'flipped'])
+            self.assertTrue(corrupt[0][2].startswith('md5 mismatch, EOFError'))
+            self.assertEqual(corrupt[1][2], 'md5 mismatch')
+            self.assertListEqual(unreadable, [])
+
+            # an I/O error while only hashing is reported, not raised
+            def failingHash(file):
+                raise OSError(errno.EIO, 'Input/output error', file)
+            with patch('tidy.tidy.getFileHash', failingHash):
+                n, error, check = readVerified(files['ok'])
+                self.assertTrue(error.startswith('OSError'))
+                self.assertEqual(check, 'unread')
+                validAssemblies = {'ok': ('ok', {'assembly_level': 'Complete Genome',
+                                                 'local_filename': files['ok']})}
+                validAssemblies, tooManyContigs, corrupt, unreadable = filterVerified(
+                    validAssemblies, 400, [], [])
+            self.assertListEqual(list(validAssemblies), [])
+            self.assertListEqual(corrupt, [])
+            self.assertEqual([u[0] for u in unreadable], ['ok'])
+
+class Test_transfer(unittest.TestCase):
+    def test_transferFile(self):
+        src = 'tests/test_data/numCtgs/test.fna.gz'
+        with open(src, 'rb') as fh:
+            content = fh.read()
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for mode in ['copy', 'hardlink', 'reflink', 'symlink']:
+                dst = os.path.join(tmpDir, f'{mode}.fna.gz')
+                used = transferFile(src, dst, mode)
+                # reflink falls back on file systems without support
+                self.assertIn(used, {'reflink': ['reflink', 'hardlink', 'copy']}.get(mode, [mode]))
+                with open(dst, 'rb') as fh:
+                    self.assertEqual(fh.read(), content)
+            self.assertTrue(os.path.samefile(src, os.path.join(tmpDir, 'hardlink.fna.gz')))
+            self.assertTrue(os.path.islink(os.path.join(tmpDir, 'symlink.fna.gz')))
+            # copy over an existing link must not write into the source
+            dst = os.path.join(tmpDir, 'hardlink.fna.gz')
+            self.assertEqual(transferFile('tests/test_data/numCtgs/test.gpff.gz', dst, 'copy'), 'copy')
+            with open(src, 'rb') as fh:
+                self.assertEqual(fh.read(), content)
+            self.assertFalse(os.path.samefile(src, dst))
+            self.assertRaises(ValueError, transferFile, src, dst, 'move')
+
+    def test_transferFileHardlinkAgain(self):
+        # the second hardlink of the same pair must not leave the .part link
+        with tempfile.TemporaryDirectory() as tmpDir:
+            src = os.path.join(tmpDir, 'src.fna.gz')
+            shutil.copy('tests/test_data/numCtgs/test.fna.gz', src)
+            targetDir = os.path.join(tmpDir, 'target')
+            os.makedirs(targetDir)
+            dst = os.path.join(targetDir, 'dst.fna.gz')
+            for _ in range(2):
+                self.assertEqual(transferFile(src, dst, 'hardlink'), 'hardlink')
+                self.assertListEqual(os.listdir(targetDir), ['dst.fna.gz'])
+                self.assertTrue(os.path.samefile(src, dst))
+
+    def test_transferFiles(self):
+        srcDir = 'tests/test_data/ncbi-ftp-download/refseq/bacteria'
+        srcs = sorted(os.path.join(root, f) for root, _, fs in os.walk(srcDir) for f in fs)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            pairs = [(src, os.path.join(tmpDir, f'{i}.fna.gz')) for i, src in enumerate(srcs)]
+            # leftover of an interrupted run
+            with open(os.path.join(tmpDir, '.0.fna.gz.part'), 'w') as fh:
+                fh.write('truncated')
+            usedModes = transferFiles(pairs, 'copy', threads=4)
+            self.assertEqual(usedModes['copy'], len(srcs))
+            self.assertSetEqual(set(os.listdir(tmpDir)), {os.path.split(d)[1] for _, d in pairs})
+            for src, dst in pairs:
+                with open(src, 'rb') as s, open(dst, 'rb') as d:
+                    self.assertEqual(s.read(), d.read())
+
+    def test_syncFiles(self):
+        srcDir = 'tests/test_data/ncbi-ftp-download/refseq/bacteria'
+        srcs = sorted(os.path.join(root, f) for root, _, fs in os.walk(srcDir) for f in fs)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            srcTmp = os.path.join(tmpDir, 'src')
+            targetDir = os.path.join(tmpDir, 'target')
+            os.makedirs(srcTmp)
+            os.makedirs(targetDir)
+            for src in srcs:
+                shutil.copy(src, srcTmp)
+            srcs = sorted(os.path.join(srcTmp, f) for f in os.listdir(srcTmp))
+            pairs = [(src, os.path.join(targetDir, f'{i}.fna.gz')) for i, src in enumerate(srcs)]
+            usedModes = syncFiles(pairs, targetDir)
+            self.assertEqual(usedModes['copy'], len(srcs))
+            self.assertEqual(len(readManifest(getManifestFile(targetDir))), len(srcs))
+            # nothing changed
+            self.assertEqual(sum(syncFiles(pairs, targetDir).values()), 0)
+            # one source changed, one target deleted, one no longer selected
+            os.utime(srcs[0], ns=(0, 0))
+            os.remove(pairs[1][1])
+            usedModes = syncFiles(pairs[:-1], targetDir)
+            self.assertEqual(usedModes['copy'], 2)
+            self.assertSetEqual(set(os.listdir(targetDir)),
+                                {os.path.split(d)[1] for _, d in pairs[:-1]})
+            self.assertSetEqual(set(readManifest(getManifestFile(targetDir))),
+                                {os.path.split(d)[1] for _, d in pairs[:-1]})
+            # another link mode is a change
+            self.assertEqual(sum(syncFiles(pairs[:2], targetDir, 'symlink').values()), 2)
+            self.assertListEqual(sorted(os.listdir(targetDir)), ['0.fna.gz', '1.fna.gz'])
+            self.assertTrue(os.path.islink(pairs[0][1]))
+
+    def test_transferFilesRetry(self):
+        calls = []
+        def flakyPlaceFile(src, dst, mode):
+            calls.append(mode)
+            if len(calls) < 3:
+                raise OSError(errno.EIO, 'Input/output error', dst)
+            shutil.copy(src, dst)
+        src = 'tests/test_data/numCtgs/test.fna.gz'
+        with tempfile.TemporaryDirectory() as tmpDir, \
+                patch('tidy.transfer.placeFile', flakyPlaceFile), \
+                patch('tidy.transfer.time.sleep'):
+            dst = os.path.join(tmpDir, 'test.fna.gz')
+            usedModes = transferFiles([(src, dst)], 'hardlink')
+            self.assertEqual(usedModes, {'hardlink': 1})
+            self.assertEqual(len(calls), 3)
+            self.assertListEqual(os.listdir(tmpDir), ['test.fna.gz'])
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_transferFilesErrorCancels(self, mock_stdout):
+        # A non transient error stops the transfer, queued files are not started
+        calls = []
+        done = []
+        def failingPlaceFile(src, dst, mode):
+            calls.append(dst)
+            if len(calls) == 1:
+                raise OSError(errno.EACCES, 'Permission denied', dst)
+            shutil.copy(src, dst)
+        src = 'tests/test_data/numCtgs/test.fna.gz'
+        with tempfile.TemporaryDirectory() as tmpDir, \
+                patch('tidy.transfer.placeFile', failingPlaceFile):
+            pairs = [(src, os.path.join(tmpDir, f'{i}.fna.gz')) for i in range(200)]
+            self.assertRaises(OSError, transferFiles, pairs, 'copy', 2,
+                              onDone=lambda s, d: done.append(d))
+            self.assertLessEqual(len(calls), 5)
+            self.assertListEqual(sorted(os.listdir(tmpDir)), sorted(os.path.split(d)[1] for d in done))
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_transcodeFiles(self, mock_stdout):
+        self.assertEqual(getTranscodedName('a.fna.gz', 'zstd'), 'a.fna.zst')
+        self.assertEqual(getTranscodedName('a.fna.xz', 'plain'), 'a.fna')
+        self.assertEqual(getTranscodedName('a.gbff', 'bgzf'), 'a.gbff.gz')
+        self.assertEqual(getTranscodeMode('bgzf'), 'bgzf:6')
+        self.assertEqual(getTranscodeMode('plain', 9), 'plain')
+        self.assertRaises(ValueError, getTranscodeMode, 'lz4')
+        if zstandard is None:
+            self.assertRaises(ValueError, getTranscodeMode, 'zstd')
+        srcs = ['tests/test_data/numCtgs/test.fna.gz', 'tests/test_data/numCtgs/test.gpff.gz']
+        contents = []
+        for src in srcs:
+            with gzip.open(src, 'rb') as fh:
+                contents.append(fh.read())
+        fmts = ['plain', 'bgzf'] + ([] if zstandard is None else ['zstd'])
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for fmt in fmts:
+                mode = getTranscodeMode(fmt, 1)
+                pairs = [(src, os.path.join(tmpDir, getTranscodedName(os.path.split(src)[1], fmt)))
+                         for src in srcs]
+                usedModes = syncFiles(pairs, tmpDir, mode, threads=2, transfer=transcodeFiles)
+                self.assertEqual(usedModes[mode], 2)
+                for (_, dst), content in zip(pairs, contents):
+                    self.assertEqual(b''.join(iterChunks(dst)), content)
+                # nothing changed, another level is a change
+                self.assertEqual(sum(syncFiles(pairs, tmpDir, mode, transfer=transcodeFiles).values()), 0)
+                if fmt != 'plain':
+                    self.assertEqual(sum(syncFiles(pairs, tmpDir, getTranscodeMode(fmt, 2),
+                                                   transfer=transcodeFiles).values()), 2)
+            # targets of the plain run are removed as no longer selected
+            self.assertNotIn('test.gpff', os.listdir(tmpDir))
+            with open(os.path.join(tmpDir, 'test.fna.gz'), 'rb') as fh:
+                self.assertTrue(isBgzf(fh.read(64)))
+            self.assertEqual(countRecords(iterChunks(os.path.join(tmpDir, 'test.gpff.gz')),
+                                          recordStarts['genbank']), 27)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_transcodeFileRetry(self, mock_stdout):
+        calls = []
+        def flakyWrite(chunks, fh, mode):
+            calls.append(mode)
+            if len(calls) < 3:
+                raise OSError(errno.EIO, 'Input/output error')
+            for chunk in chunks:
+                fh.write(chunk)
+        src = 'tests/test_data/numCtgs/test.fna.gz'
+        with tempfile.TemporaryDirectory() as tmpDir, \
+                patch('tidy.transcode.writeTranscoded', flakyWrite), \
+                patch('tidy.transfer.time.sleep'):
+            dst = os.path.join(tmpDir, 'test.fna')
+            self.assertEqual(transcodeFileRetry(src, dst, 'plain'), 'plain')
+            self.assertEqual(len(calls), 3)
+            self.assertListEqual(os.listdir(tmpDir), ['test.fna'])
+            calls.clear()
+            self.assertRaises(OSError, transcodeFileRetry, src, dst, 'plain', 1)
+        self.assertIn('retry 1/3', mock_stdout.getvalue())
+
 class Test_basicFunctions(unittest.TestCase):
     # not biosequencereading, not strain name comprehension
     # not based on other functions
@@ -96,6 +599,24 @@ class Test_basicFunctions(unittest.TestCase):
         self.assertListEqual(getExclusion('tests/test_data/exclusion.txt'), targetList)
         self.assertListEqual(getExclusion('tests/test_data/notExist.txt'), [])
 
+    def test_substringMatcher(self):
+        patterns = ['he', 'she', 'his', 'hers', 'Streptomyces coelicolor A3(2)', 'x']
+        matcher = SubstringMatcher(patterns)
+        for text in ['ushers', 'his', 'Streptomyces coelicolor A3(2) R4-mCherry-17', '', 'ahishe']:
+            self.assertSetEqual(matcher.search(text),
+                {i for i, p in enumerate(patterns) if p in text}, text)
+        # empty pattern is in every text
+        self.assertSetEqual(SubstringMatcher(['', 'a']).search('b'), {0})
+
+    def test_compileExclusions(self):
+        exclusions = getExclusion('tests/test_data/exclusion.txt')
+        accIndex, matcher, nameLines = compileExclusions(exclusions)
+        self.assertDictEqual(accIndex, {'GCF_001013905.1': [2]})
+        self.assertListEqual(nameLines, [0, 1])
+        self.assertSetEqual(
+            {nameLines[i] for i in matcher.search('Streptomyces coelicolor A3(2) R4-mCherry-17')},
+            {1})
+
     def test_generateTargetDir(self):
         withTargetDirArgs = argParser(dir='', tsv='',
             excludeList='', maxCtg='', targetDir='targetDir')
@@ -129,6 +650,40 @@ class Test_crossDependentFunctions(unittest.TestCase):
             'Streptomyces specialis GW41-1564/R2'
         ]
         self.assertListEqual(sorted(keys), keysSorted)
+        record = strains['Streptomyces specialis GW41-1564/R2']['GCF_001493375.1']
+        self.assertIsInstance(record, AssemblyRecord)
+        self.assertEqual(record['assembly_level'], 'Scaffold')
+        self.assertEqual(record.get('refseq_category'), 'representative genome')
+        self.assertEqual(record['local_filename'], os.path.join(self.args.dir,
+            'refseq/bacteria/GCF_001493375.1/GCF_001493375.1_Streptomyces_specialis_genomic.fna.gz'))
+        self.assertRaises(KeyError, lambda: record['ftp_path'])
+        self.assertFalse(hasattr(record, '__dict__'))
+        # assembly levels are shared, not one string per row
+        levels = [r['assembly_level'] for accs in strains.values() for r in accs.values()]
+        self.assertEqual(len({id(l) for l in levels}), len(set(levels)))
+
+    def test_getInfoMissingFiles(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            downloadDir = os.path.join(tmpDir, 'ncbi-ftp-download')
+            shutil.copytree(self.args.dir, downloadDir)
+            index = scanDownloadDir(downloadDir, threads=4)
+            self.assertEqual(len(index), 9)
+            self.assertListEqual(index['GCF_001493375.1'], [os.path.join(
+                downloadDir, 'refseq/bacteria/GCF_001493375.1/GCF_001493375.1_Streptomyces_specialis_genomic.fna.gz')])
+            shutil.rmtree(os.path.join(downloadDir, 'refseq/bacteria/GCF_001493375.1'))
+            orphanDir = os.path.join(downloadDir, 'refseq/bacteria/GCF_999999999.1')
+            os.makedirs(orphanDir)
+            with open(os.path.join(orphanDir, 'GCF_999999999.1_x_genomic.fna.gz'), 'w') as fh:
+                fh.write('')
+            args = self.args._replace(dir=downloadDir)
+            strains = getInfoFrom(args)
+            self.assertNotIn('Streptomyces specialis GW41-1564/R2', strains)
+            self.assertEqual(sum(len(accs) for accs in strains.values()), 8)
+            with open(getScanReportFile(downloadDir), 'r') as rf:
+                report = rf.read()
+            self.assertIn('GCF_001493375.1\t', report)
+            self.assertIn('GCF_999999999.1\t', report)
+        self.assertFalse(os.path.isfile(getScanReportFile(self.args.dir)))
 
     def test_filterTooManyCtgs(self):
         strains = getInfoFrom(self.args)
@@ -136,12 +691,77 @@ class Test_crossDependentFunctions(unittest.TestCase):
             'Streptomyces specialis GW41-1564/R2': ('GCF_001493375.1', strains['Streptomyces specialis GW41-1564/R2']['GCF_001493375.1']),
             'Streptomyces albidoflavus 145/R3': ('GCF_002289305.1', strains['Streptomyces albidoflavus 145/R3']['GCF_002289305.1'])
         }
-        validAssemblies, tooManyContigs = filterTooManyCtgs(validAssemblies, self.args.maxCtg, [])
-        self.assertListEqual(tooManyContigs,[('Streptomyces albidoflavus 145/R3', 'GCF_002289305.1')])
+        validAssemblies, tooManyContigs, unreadable = filterTooManyCtgs(validAssemblies, self.args.maxCtg, [])
+        self.assertListEqual(tooManyContigs,[('Streptomyces albidoflavus 145/R3', 'GCF_002289305.1', '>400')])
+        self.assertListEqual(unreadable, [])
         self.assertEqual(len(validAssemblies), 1)
         vaKeys = list(validAssemblies.keys())
         self.assertListEqual(vaKeys, ['Streptomyces specialis GW41-1564/R2'])
 
+    def test_filterTooManyCtgsParallel(self):
+        strains = getInfoFrom(self.args)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            # truncated download
+            brokenFile = os.path.join(tmpDir, 'broken.fna.gz')
+            with open('tests/test_data/ncbi-ftp-download/refseq/bacteria/GCF_002289305.1/GCF_002289305.1_CMB-CS145_genomic.fna.gz', 'rb') as fh:
+                with open(brokenFile, 'wb') as bf:
+                    bf.write(fh.read(500))
+            brokenData = dict(strains['Streptomyces coelicolor A3(2) R4-mCherry-17']['GCF_008124975.1'])
+            brokenData['local_filename'] = brokenFile
+            validAssemblies = {
+                'Streptomyces specialis GW41-1564/R2': ('GCF_001493375.1', strains['Streptomyces specialis GW41-1564/R2']['GCF_001493375.1']),
+                'Streptomyces coelicolor A3(2) R4-mCherry-17': ('GCF_008124975.1', brokenData),
+                'Streptomyces albidoflavus 145/R3': ('GCF_002289305.1', strains['Streptomyces albidoflavus 145/R3']['GCF_002289305.1']),
+            }
+            validAssemblies, tooManyContigs, unreadable = filterTooManyCtgs(
+                validAssemblies, self.args.maxCtg, [], jobs=2)
+        self.assertListEqual(tooManyContigs,[('Streptomyces albidoflavus 145/R3', 'GCF_002289305.1', '>400')])
+        self.assertListEqual([u[:2] for u in unreadable],
+            [('Streptomyces coelicolor A3(2) R4-mCherry-17', 'GCF_008124975.1')])
+        self.assertListEqual(list(validAssemblies.keys()), ['Streptomyces specialis GW41-1564/R2'])
+
+    def test_filterTooManyCtgsCache(self):
+        strains = getInfoFrom(self.args)
+        def getValid():
+            return {
+                'Streptomyces specialis GW41-1564/R2': ('GCF_001493375.1', strains['Streptomyces specialis GW41-1564/R2']['GCF_001493375.1']),
+                'Streptomyces albidoflavus 145/R3': ('GCF_002289305.1', strains['Streptomyces albidoflavus 145/R3']['GCF_002289305.1'])
+            }
+        specialisFile = strains['Streptomyces specialis GW41-1564/R2']['GCF_001493375.1']['local_filename']
+        albidoflavusFile = strains['Streptomyces albidoflavus 145/R3']['GCF_002289305.1']['local_filename']
+        with tempfile.TemporaryDirectory() as tmpDir:
+            cacheFile = os.path.join(tmpDir, 'cache.sqlite')
+            with CtgCache(cacheFile) as cache:
+                validAssemblies, tooManyContigs, _ = filterTooManyCtgs(getValid(), 400, [], cache=cache)
+                self.assertEqual((cache.hits, cache.misses), (0, 2))
+            with CtgCache(cacheFile) as cache:
+                self.assertEqual(cache.get(specialisFile, 400), 143)
+                # count stopped early at 400, not usable with a higher limit
+                self.assertIsNone(cache.get(albidoflavusFile, 500))
+                self.assertGreater(cache.get(albidoflavusFile, 300), 300)
+                validAssemblies2, tooManyContigs2, _ = filterTooManyCtgs(getValid(), 400, [], cache=cache)
+                self.assertEqual((cache.hits, cache.misses), (4, 1))
+            self.assertListEqual(tooManyContigs, tooManyContigs2)
+            self.assertListEqual(list(validAssemblies), list(validAssemblies2))
+            # changed file invalidates the entry
+            changedFile = os.path.join(tmpDir, 'changed.fna.gz')
+            shutil.copy(specialisFile, changedFile)
+            with CtgCache(cacheFile, useHash=True) as cache:
+                cache.put(changedFile, 143)
+                os.utime(changedFile, ns=(0, 0))
+                # same content, only mtime changed
+                self.assertEqual(cache.get(changedFile), 143)
+                with open(changedFile, 'ab') as fh:
+                    fh.write(b'x')
+                self.assertIsNone(cache.get(changedFile))
+            with CtgCache(cacheFile, rebuild=True) as cache:
+                self.assertIsNone(cache.get(specialisFile))
+            self.assertIsNone(openCtgCache(tmpDir, mode='off'))
+            with open(getCacheFile(tmpDir), 'w') as fh:
+                fh.write('')
+            self.assertIsNone(openCtgCache(tmpDir, mode='clear'))
+            self.assertFalse(os.path.isfile(getCacheFile(tmpDir)))
+
     def test_filterDownloads(self):
         exclusions = [
             ['Streptomyces coelicolor M1154',],
@@ -153,7 +773,7 @@ class Test_crossDependentFunctions(unittest.TestCase):
                 ("Streptomyces avermitilis MA-4680 NBRC 14893", "GCF_000009765.2"),
                 ("Streptomyces albidoflavus J1074", "GCF_000359525.2"),
         )
-        validAssemblies, _, _, _= \
+        validAssemblies, _, _, _, _ = \
             filterDownloads(getInfoFrom(self.args), exclusions, maxCtg=400)
         # Only accession is checked, not data
         # strains = getInfoFrom(self.args)
@@ -161,6 +781,40 @@ class Test_crossDependentFunctions(unittest.TestCase):
         #     print(f'"{name}": ("{validAssemblies[name][0]}", strains["{name}"]["{validAssemblies[name][0]}"]),')
         vas = [(s, validAssemblies[s][0]) for s in validAssemblies]
         self.assertSetEqual(set(strainAccs), set(vas))
+        # matched lines are removed, the ones never matched are left
+        self.assertListEqual(exclusions, [['Streptomyces coelicolor M1154',],])
+
+    def test_selectBestAssemblies(self):
+        def data(level, date, category='na', relation=float('nan')):
+            return {'assembly_level': level, 'seq_rel_date': date,
+                    'refseq_category': category, 'relation_to_type_material': relation}
+        strains = {
+            'a': {
+                'A1': data('Scaffold', '01/12/2015'),
+                'A2': data('Complete Genome', '09/04/2013'),
+                'A3': data('Complete Genome', '08/05/2013'), # later, despite string order
+            },
+            'b': {
+                'B1': data('Contig', '01/01/2020'),
+            },
+            'c': {
+                'C1': data('Contig', '01/01/2020'),
+                'C2': data('Contig', '01/01/2020', 'representative genome'),
+                'C3': data('Contig', '01/01/2020', 'na', 'assembly from type material'),
+            },
+        }
+        validAssemblies, skippedAccs = selectBestAssemblies(strains)
+        self.assertListEqual([(s, validAssemblies[s][0]) for s in validAssemblies],
+                             [('a', 'A3'), ('b', 'B1'), ('c', 'C1')])
+        self.assertListEqual(skippedAccs, [('a', 'A2'), ('a', 'A1'), ('c', 'C2'), ('c', 'C3')])
+        validAssemblies, _ = selectBestAssemblies(strains, ['refseq_category'])
+        self.assertEqual(validAssemblies['c'][0], 'C2')
+        validAssemblies, _ = selectBestAssemblies(strains, ['relation_to_type_material', 'refseq_category'])
+        self.assertEqual(validAssemblies['c'][0], 'C3')
+        self.assertEqual(selectBestAssemblies({}), ({}, []))
+        self.assertListEqual(
+            parseDates(pd.Series(['24/03/2016', '2016/03/24', 'nan'])).dt.strftime('%Y%m%d').fillna('').tolist(),
+            ['20160324', '20160324', ''])
 
     def test_safeName(self):
         testSet = [
@@ -199,6 +853,7 @@ class Test_crossDependentFunctions(unittest.TestCase):
         self.assertSetEqual(set(targetFiles), set(os.listdir(targetDir)))
         self.assertSetEqual(set(targetFilesCorrect), set(os.listdir(targetDir)))
         shutil.rmtree(targetDir)
+        os.remove(getManifestFile(targetDir))
 
         n = 0
         with open(includeListFile, 'r') as elf:
@@ -219,7 +874,7 @@ class Test_crossDependentFunctions(unittest.TestCase):
             for l in elf:
                 l = l.strip()
                 if not '\t' in l: continue
-                s, a = l.split('\t')
+                s, a = l.split('\t')[:2]
                 self.assertIn(a, excludedList[s])
                 if len(excludedList[s]) == 1:
                     excludedList.pop(s)
@@ -229,5 +884,123 @@ class Test_crossDependentFunctions(unittest.TestCase):
         self.assertEqual(n, cn)
         os.remove(excludeListFile)
 
+    def test_gatherAssembliesStats(self):
+        args = self.args._replace(maxCtg=None, excludeList='', minLength=1000)
+        targetFiles, includeListFile, excludeListFile = gatherAssemblies(args)
+        targetDir = generateTargetDir(args)
+        shutil.rmtree(targetDir)
+        os.remove(getManifestFile(targetDir))
+        with open(includeListFile, 'r') as ilf:
+            rows = [l.rstrip('\n').split('\t') for l in ilf if '\t' in l]
+        os.remove(includeListFile)
+        self.assertListEqual(rows[0], ['strain', 'assembly_accession', 'name'] + statsColumns)
+        self.assertSetEqual({r[1] for r in rows[1:]},
+                            {'GCF_001493375.1', 'GCF_002289305.1', 'GCF_008124975.1'})
+        self.assertTrue(all(int(r[4]) >= 1000 for r in rows[1:]))
+        with open(excludeListFile, 'r') as elf:
+            content = elf.read()
+        os.remove(excludeListFile)
+        self.assertIn('GCF_001013905.1\ttotal_length=240 (minLength 1000)', content)
+        self.assertIn('GCF_000009765.2\ttotal_length=160 (minLength 1000)', content)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_gatherAssembliesVerifyMd5(self, mock_stdout):
+        # no MD5SUMS in the test data, nothing is verified or excluded
+        for stats in [False, True]:
+            args = self.args._replace(verifyMd5=True, stats=stats)
+            targetFiles, includeListFile, excludeListFile = gatherAssemblies(args)
+            targetDir = generateTargetDir(args)
+            shutil.rmtree(targetDir)
+            os.remove(getManifestFile(targetDir))
+            os.remove(includeListFile)
+            with open(excludeListFile, 'r') as elf:
+                content = elf.read()
+            os.remove(excludeListFile)
+            self.assertEqual(len(targetFiles), 3)
+            self.assertIn('GCF_002289305.1', content)
+            self.assertIn('4 file(s) not listed in a MD5SUMS file, not verified.', mock_stdout.getvalue())
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_gatherAssembliesTranscode(self, mock_stdout):
+        args = self.args._replace(transcode='plain')
+        targetFiles, includeListFile, excludeListFile = gatherAssemblies(args)
+        targetDir = generateTargetDir(args)
+        try:
+            self.assertSetEqual(set(targetFiles), {
+                "Streptomyces_albidoflavus_J1074.fna",
+                "Streptomyces_avermitilis_MA-4680_NBRC_14893.fna",
+                "Streptomyces_specialis_GW41-1564_R2.fna",
+            })
+            with open(os.path.join(targetDir, targetFiles[0]), 'rb') as fh:
+                self.assertEqual(fh.read(1), b'>')
+            self.assertIn('--transcode plain', mock_stdout.getvalue())
+        finally:
+            shutil.rmtree(targetDir)
+            os.remove(getManifestFile(targetDir))
+            os.remove(includeListFile)
+            os.remove(excludeListFile)
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_gatherAssembliesConcat(self, mock_stdout):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            args = self.args._replace(concat=os.path.join(tmpDir, 'all.fna'))
+            targetFiles, includeListFile, excludeListFile = gatherAssemblies(args)
+            # the concatenated file replaces the target dir
+            self.assertListEqual(targetFiles, ['all.fna', 'all.fna.fai', 'all.fna.accessions.tsv'])
+            self.assertFalse(os.path.exists(generateTargetDir(self.args)))
+            self.assertListEqual(sorted(os.listdir(tmpDir)), [
+                'all-excluded.tsv', 'all-included.tsv', 'all.fna',
+                'all.fna.accessions.tsv', 'all.fna.fai'])
+            with open(os.path.join(tmpDir, 'all.fna.accessions.tsv'), 'r') as fh:
+                rows = [l.rstrip('\n').split('\t') for l in fh][1:]
+            with open(os.path.join(tmpDir, 'all.fna.fai'), 'r') as fh:
+                names = [l.split('\t')[0] for l in fh]
+            self.assertListEqual([r[0] for r in rows], names)
+            self.assertSetEqual({r[1] for r in rows},
+                                {'GCF_001493375.1', 'GCF_000009765.2', 'GCF_000359525.2'})
+            self.assertTrue(all(r[0].startswith(safeName(r[2]) + '|') for r in rows))
+
+            # other formats are rejected before anything is read or written
+            args = self.args._replace(concat=os.path.join(tmpDir, 'gb.fna'))
+            with patch('tidy.concat.getSeqFormat', return_value='genbank'), \
+                    patch('tidy.tidy.concatAssemblies') as mock_concat:
+                self.assertRaises(ValueError, gatherAssemblies, args)
+                mock_concat.assert_not_called()
+            self.assertFalse(any(f.startswith('gb') for f in os.listdir(tmpDir)))
+            self.assertRaises(ValueError, gatherAssemblies,
+                              args._replace(transcode='bgzf'))
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_gatherAssembliesArchive(self, mock_stdout):
+        names = [
+            "Streptomyces_albidoflavus_J1074.fna.gz",
+            "Streptomyces_avermitilis_MA-4680_NBRC_14893.fna.gz",
+            "Streptomyces_specialis_GW41-1564_R2.fna.gz",
+        ]
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for ext in ['.tar', '.zip']:
+                args = self.args._replace(targetDir=os.path.join(tmpDir, 'ready' + ext))
+                targetFiles, includeListFile, excludeListFile = gatherAssemblies(args)
+                self.assertListEqual(sorted(targetFiles), names)
+                self.assertEqual(includeListFile, os.path.join(os.path.realpath(tmpDir), 'ready-included.tsv'))
+                if ext == '.tar':
+                    with tarfile.open(args.targetDir) as tf:
+                        members = tf.getnames()
+                        content = tf.extractfile('ready/' + names[0]).read()
+                else:
+                    with zipfile.ZipFile(args.targetDir) as zf:
+                        members = zf.namelist()
+                        content = zf.read('ready/' + names[0])
+                self.assertListEqual(sorted(members), ['ready-excluded.tsv', 'ready-included.tsv'] +
+                                     ['ready/' + n for n in names])
+                with open('tests/test_data/ncbi-ftp-download/refseq/bacteria/GCF_000359525.2/' +
+                          'GCF_000359525.2_ASM35952v1_genomic.fna.gz', 'rb') as fh:
+                    self.assertEqual(content, fh.read())
+            self.assertListEqual(sorted(os.listdir(tmpDir)), [
+                'ready-excluded.tsv', 'ready-included.tsv', 'ready.tar', 'ready.zip'])
+            # an existing archive is not replaced
+            mtime = os.stat(os.path.join(tmpDir, 'ready.tar')).st_mtime_ns
+            args = self.args._replace(targetDir=os.path.join(tmpDir, 'ready.tar'))
+            self.assertRaises(FileExistsError, gatherAssemblies, args)
+            self.assertEqual(os.stat(os.path.join(tmpDir, 'ready.tar')).st_mtime_ns, mtime)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1 +1,14 @@
-from .tidy import *
\ No newline at end of file
+from .tidy import *
+from .seqfile import *
+from .cache import *
+from .assembly_stats import *
+from .transfer import *
+from .exclusion import *
+from .scan import *
+from .records import *
+from .genome_stats import *
+from .bgzf import *
+from .md5sums import *
+from .transcode import *
+from .concat import *
+from .archive import *
@@ -0,0 +1,124 @@
+# Archive target (.tar or .zip) instead of a target dir: each selected file is
+# streamed into the archive, there is no intermediate copy on disk.
+# Files are stored under "<name>/" (the archive name without extension) and
+# reports at the top level, extracting gives the same layout as a target dir
+# with its reports next to it. Files are stored without compression (they
+# usually are compressed already, or see --transcode).
+# The archive is written to a hidden temporary name and renamed when
+# complete, it is always written as a whole (no manifest, no update).
+
+import os
+import time
+import tarfile
+import tempfile
+import zipfile
+from tqdm import tqdm
+from .seqfile import iterChunks
+from .transcode import writeTranscoded, parseTranscodeMode
+from .transfer import getTempName
+
+archiveExts = ['.tar', '.zip']
+
+
+def getArchiveExt(path: str) -> None|str:
+    # None when path is not an archive (a target dir)
+    for ext in archiveExts:
+        if path.lower().endswith(ext):
+            return ext
+    return None
+
+
+def getArchiveBase(path: str) -> str:
+    # "/data/set.tar" -> "/data/set", reports are named after it
+    return os.path.realpath(path)[:-len(getArchiveExt(path))]
+
+
+class ArchiveWriter:
+    def __init__(self, path: str):
+        ext = getArchiveExt(path)
+        if ext is None:
+            raise ValueError(f'Archive type not known: {path}, should be one of {archiveExts}')
+        self.path = os.path.realpath(path)
+        self.dirName = os.path.split(getArchiveBase(path))[1]
+        self.tmp = getTempName(self.path)
+        if ext == '.tar':
+            self.archive = tarfile.open(self.tmp, 'w', format=tarfile.PAX_FORMAT)
+        else:
+            self.archive = zipfile.ZipFile(self.tmp, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self.names = [] # files added, without reports
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+    def addMember(self, src: str, arcname: str):
+        # Content of src (links followed) as a regular file
+        if isinstance(self.archive, tarfile.TarFile):
+            st = os.stat(src)
+            info = tarfile.TarInfo(arcname)
+            info.size = st.st_size
+            info.mtime = int(st.st_mtime)
+            info.mode = 0o644
+            with open(src, 'rb') as fh:
+                self.archive.addfile(info, fh)
+        else:
+            self.archive.write(src, arcname)
+
+    def addFile(self, src: str, name: str):
+        self.addMember(src, f'{self.dirName}/{name}')
+        self.names.append(name)
+
+    def addTranscoded(self, src: str, name: str, mode: str):
+        # A tar member needs its size first, the data is transcoded to a
+        # temporary file next to the archive. A zip member is written directly.
+        arcname = f'{self.dirName}/{name}'
+        if isinstance(self.archive, tarfile.TarFile):
+            with tempfile.TemporaryFile(dir=os.path.split(self.path)[0]) as tmp:
+                writeTranscoded(iterChunks(src), tmp, mode)
+                info = tarfile.TarInfo(arcname)
+                info.size = tmp.tell()
+                info.mtime = int(time.time())
+                info.mode = 0o644
+                tmp.seek(0)
+                self.archive.addfile(info, tmp)
+        else:
+            with self.archive.open(arcname, 'w', force_zip64=True) as fh:
+                writeTranscoded(iterChunks(src), fh, mode)
+        self.names.append(name)
+
+    def addReport(self, file: str):
+        self.addMember(file, os.path.split(file)[1])
+
+    def close(self):
+        self.archive.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self.archive.close()
+        if os.path.lexists(self.tmp):
+            os.remove(self.tmp)
+
+
+def archiveFiles(archive: ArchiveWriter, pairs: list[tuple[str, str]],
+                 transcode: None|str = None):
+    # pairs: [(src, name in archive)...], transcode: a transcode mode
+    # ("<format>[:<level>]") or None to store the files as they are.
+    if not transcode is None:
+        parseTranscodeMode(transcode)
+    sizes = [os.path.getsize(src) for src, _ in pairs]
+    start = time.perf_counter()
+    with tqdm(total=sum(sizes), unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+        for (src, name), size in zip(pairs, sizes):
+            if transcode is None:
+                archive.addFile(src, name)
+            else:
+                archive.addTranscoded(src, name, transcode)
+            pbar.update(size)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'Archived {len(pairs)} file(s), {sum(sizes) / 1024**2:.1f} MiB in ' +
+          f'{elapsed:.1f}s ({sum(sizes) / 1024**2 / elapsed:.1f} MiB/s) to "{archive.path}"')
@@ -0,0 +1,39 @@
+# Read the "*_assembly_stats.txt" files downloaded by ncbi-genome-download
+# (`-F assembly-stats`). They are stored next to the sequence files:
+#   GCF_000009765.2/GCF_000009765.2_ASM976v2_genomic.fna.gz
+#   GCF_000009765.2/GCF_000009765.2_ASM976v2_assembly_stats.txt
+
+# Number of sequences in the genome file, in the order of preference.
+ctgStatistics = ['scaffold-count', 'contig-count']
+
+
+def getStatsFile(seqFile: str) -> str:
+    # "<acc>_<asm_name>_genomic.fna.gz" -> "<acc>_<asm_name>_assembly_stats.txt"
+    return seqFile.rsplit('_', 1)[0] + '_assembly_stats.txt'
+
+
+def getAssemblyStats(statsFile: str) -> dict[str, int]:
+    # Statistics of the whole assembly, rows with "all" in the first 4 columns
+    stats = {}
+    with open(statsFile, 'r') as fh:
+        for l in fh:
+            if l.startswith('#'): continue
+            cols = l.rstrip('\n').split('\t')
+            if len(cols) != 6 or cols[:4] != ['all'] * 4: continue
+            try:
+                stats[cols[4]] = int(cols[5])
+            except ValueError:
+                pass
+    return stats
+
+
+def getNumCtgsFromStats(seqFile: str) -> None|int:
+    # None if the stats file is missing or does not contain the counts
+    try:
+        stats = getAssemblyStats(getStatsFile(seqFile))
+    except FileNotFoundError:
+        return None
+    for s in ctgStatistics:
+        if s in stats:
+            return stats[s]
+    return None
@@ -0,0 +1,121 @@
+# BGZF (blocked gzip, as written by bgzip/htslib): a series of gzip members of
+# at most 64 KiB uncompressed data, each with its compressed size in the
+# header. Blocks can be found without decompressing, and are decompressed in
+# parallel by a thread pool (zlib releases the GIL).
+# Other multi-member gzip files carry no sizes, the member boundaries are only
+# known after decompression, they are read sequentially.
+
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .md5sums import HashingReader
+
+BGZF_BLOCK_SIZE = 0xff00 # uncompressed data per block, as bgzip does
+# empty block marking the end of the file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+headerFmt = '<4BI2BH' # magic, CM, FLG, MTIME, XFL, OS, XLEN
+headerSize = struct.calcsize(headerFmt)
+
+
+def isBgzf(head: bytes) -> bool:
+    # head: at least the first 18 bytes of the file
+    if len(head) < headerSize + 6 or head[:4] != b'\x1f\x8b\x08\x04':
+        return False
+    xlen = struct.unpack_from('<H', head, 10)[0]
+    return getBlockSize(head[headerSize:headerSize + xlen]) is not None
+
+
+def getBlockSize(extra: bytes) -> None|int:
+    # total block size from the BC subfield of the gzip extra field
+    i = 0
+    while i + 4 <= len(extra):
+        si1, si2, slen = extra[i], extra[i + 1], struct.unpack_from('<H', extra, i + 2)[0]
+        if si1 == 66 and si2 == 67 and slen == 2:
+            return struct.unpack_from('<H', extra, i + 4)[0] + 1
+        i += 4 + slen
+    return None
+
+
+def iterBlocks(fh):
+    # Raw BGZF blocks of an open (binary) file
+    while True:
+        header = fh.read(headerSize)
+        if len(header) == 0:
+            return
+        if len(header) < headerSize or header[:4] != b'\x1f\x8b\x08\x04':
+            raise OSError(f'Not a BGZF block at offset {fh.tell() - len(header)}')
+        xlen = struct.unpack_from('<H', header, 10)[0]
+        extra = fh.read(xlen)
+        size = getBlockSize(extra)
+        if size is None:
+            raise OSError(f'BGZF block without size at offset {fh.tell() - len(header) - xlen}')
+        rest = fh.read(size - headerSize - xlen)
+        if len(rest) < size - headerSize - xlen:
+            raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+        yield rest
+
+
+def inflateBlock(rest: bytes, decompress=zlib.decompress) -> bytes:
+    # rest: block after the header, deflate data + CRC32 + ISIZE
+    data = decompress(rest[:-8], -15)
+    crc, isize = struct.unpack('<2I', rest[-8:])
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise zlib.error('BGZF block CRC or length mismatch')
+    return data
+
+
+def iterBgzf(file: str, threads: int = 2, chunkSize: int = 4 * 1024 * 1024,
+             decompress=zlib.decompress, hasher=None):
+    # Decompressed data in order, joined to chunks of about chunkSize.
+    # At most a few blocks per thread are in flight, memory use is bounded.
+    # With hasher, all bytes of the file are fed to it, also when the chunks
+    # are not read to the end.
+    maxPending = 4 * max(1, threads)
+    with open(file, 'rb') as fh, ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        if not hasher is None:
+            fh = HashingReader(fh, hasher)
+        try:
+            yield from iterInflated(fh, executor, maxPending, chunkSize, decompress)
+        finally:
+            if not hasher is None:
+                fh.drain()
+
+
+def iterInflated(fh, executor, maxPending, chunkSize, decompress):
+    # Ordered results of inflateBlock, at most maxPending blocks in flight
+    pending = deque()
+    parts = []
+    nBytes = 0
+    blocks = iterBlocks(fh)
+    done = False
+    while not done or pending:
+        while not done and len(pending) < maxPending:
+            try:
+                pending.append(executor.submit(inflateBlock, next(blocks), decompress))
+            except StopIteration:
+                done = True
+        if len(pending) == 0:
+            break
+        data = pending.popleft().result()
+        parts.append(data)
+        nBytes += len(data)
+        if nBytes >= chunkSize:
+            yield b''.join(parts)
+            parts = []
+            nBytes = 0
+    if nBytes > 0:
+        yield b''.join(parts)
+
+
+def compressBlock(data: bytes, level: int = 6) -> bytes:
+    # One BGZF block of at most BGZF_BLOCK_SIZE bytes of data
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    size = headerSize + 6 + len(cdata) + 8
+    if size > 0x10000:
+        raise ValueError(f'BGZF block of {size} bytes, more than 64 KiB')
+    return struct.pack(headerFmt, 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6) + \
+        struct.pack('<2BHH', 66, 67, 2, size - 1) + cdata + \
+        struct.pack('<2I', zlib.crc32(data), len(data))
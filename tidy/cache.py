@@ -0,0 +1,107 @@
+# On-disk cache of contig counts, so that repeated runs on the same download
+# dir only scan new or changed files.
+# An entry is valid while path, size and mtime of the file are unchanged. With
+# `useHash`, the md5 of the (compressed) file is also stored, and an entry is
+# still valid if only the mtime changed but the content is the same (eg.
+# re-downloaded file).
+
+import os
+import sqlite3
+import hashlib
+
+HASH_BLOCK = 4 * 1024 * 1024
+
+
+def getFileHash(file: str) -> str:
+    md5 = hashlib.md5()
+    with open(file, 'rb') as fh:
+        while True:
+            block = fh.read(HASH_BLOCK)
+            if not block:
+                break
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def getCacheFile(dir: str) -> str:
+    return os.path.realpath(dir) + '-ctgcache.sqlite'
+
+
+class CtgCache:
+    def __init__(self, cacheFile: str, useHash: bool = False, rebuild: bool = False):
+        self.cacheFile = cacheFile
+        self.useHash = useHash
+        self.hits = 0
+        self.misses = 0
+        self.con = sqlite3.connect(cacheFile)
+        if rebuild:
+            self.con.execute('DROP TABLE IF EXISTS ctgs')
+        self.con.execute(
+            'CREATE TABLE IF NOT EXISTS ctgs ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT, '
+            'numCtgs INTEGER, exact INTEGER)'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.con.commit()
+        self.con.close()
+
+    def get(self, file: str, maxCtg: None|int = None) -> None|int:
+        # Return cached number of contigs, or None if the file needs a scan.
+        # A count stored from an early-exited scan is a lower bound, it is only
+        # useful when it is still above maxCtg.
+        path = os.path.realpath(file)
+        row = self.con.execute(
+            'SELECT size, mtime, hash, numCtgs, exact FROM ctgs WHERE path = ?',
+            (path,)
+        ).fetchone()
+        n = None
+        if row is not None:
+            size, mtime, fileHash, numCtgs, exact = row
+            st = os.stat(path)
+            valid = (st.st_size == size and st.st_mtime_ns == mtime)
+            if not valid and self.useHash and st.st_size == size \
+                    and fileHash is not None and getFileHash(path) == fileHash:
+                valid = True
+                self.con.execute('UPDATE ctgs SET mtime = ? WHERE path = ?',
+                                 (st.st_mtime_ns, path))
+            if not valid:
+                self.con.execute('DELETE FROM ctgs WHERE path = ?', (path,))
+            elif exact or (maxCtg is not None and numCtgs > maxCtg):
+                n = numCtgs
+        if n is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return n
+
+    def put(self, file: str, numCtgs: int, exact: bool = True):
+        path = os.path.realpath(file)
+        st = os.stat(path)
+        fileHash = (getFileHash(path) if self.useHash else None)
+        self.con.execute(
+            'INSERT OR REPLACE INTO ctgs VALUES (?, ?, ?, ?, ?, ?)',
+            (path, st.st_size, st.st_mtime_ns, fileHash, numCtgs, int(exact))
+        )
+
+
+def openCtgCache(dir: str, mode: str = 'use', useHash: bool = False) -> None|CtgCache:
+    # mode: "use" existing cache, "rebuild" it from scratch, "clear" (remove)
+    # it, or "off"
+    cacheFile = getCacheFile(dir)
+    if mode == 'clear':
+        try:
+            os.remove(cacheFile)
+            print(f'Removed contig count cache {cacheFile}')
+        except FileNotFoundError:
+            pass
+        return None
+    if mode == 'off':
+        return None
+    return CtgCache(cacheFile, useHash=useHash, rebuild=(mode == 'rebuild'))
@@ -0,0 +1,149 @@
+# Stream the selected genomes into one fasta file, each header prefixed by
+# the (safe) strain name: ">Streptomyces_coelicolor_A3_2|NC_003888.3 ...".
+# In gatherAssemblies this file replaces the target dir, the genomes are read
+# once for it and not copied.
+# Sequences are rewrapped to a fixed line width, so that a samtools faidx
+# compatible index (.fai) can be written in the same pass, together with a
+# map of each sequence to its assembly accession and strain.
+# All three files are written to hidden temporary names and renamed when
+# complete.
+
+import os
+import re
+import time
+from tqdm import tqdm
+from .seqfile import iterChunks, getSeqFormat
+from .genome_stats import iterLines
+from .transfer import getTempName
+
+CONCAT_LINE_WIDTH = 80
+
+headerPattern = re.compile(rb'^>[^\n]*\n', re.M)
+whitespace = b' \t\r\n\v\f'
+mapHeader = ['sequence', 'assembly_accession', 'strain']
+
+
+def getConcatFiles(concatFile: str) -> tuple[str, str]:
+    # index and sequence -> accession map next to the concatenated file
+    return concatFile + '.fai', concatFile + '.accessions.tsv'
+
+
+class FastaConcatWriter:
+    # Writes records to the open binary file fh and keeps their .fai entries
+    def __init__(self, fh, lineWidth: int = CONCAT_LINE_WIDTH):
+        self.fh = fh
+        self.lineWidth = lineWidth
+        self.offset = 0 # bytes written so far
+        self.col = 0 # bases on the last, unfinished line
+        self.record = None # [name, length, offset] of the open record
+        # [(name, length, offset, linebases, linewidth)...], the .fai columns
+        self.index = []
+
+    def write(self, data: bytes):
+        self.fh.write(data)
+        self.offset += len(data)
+
+    def startRecord(self, header: bytes, prefix: bytes) -> bytes:
+        # header without ">" and newline, returns the new sequence name
+        self.endRecord()
+        parts = header.split(None, 1)
+        name = prefix + b'|' + (parts[0] if len(parts) > 0 else b'')
+        self.write(b'>' + name + (b' ' + parts[1] if len(parts) > 1 else b'') + b'\n')
+        self.record = [name, 0, self.offset]
+        return name
+
+    def addSequence(self, seq: bytes):
+        # seq: sequence letters only, continuing the open record
+        w = self.lineWidth
+        parts = []
+        i = 0
+        if self.col > 0:
+            i = min(w - self.col, len(seq))
+            parts.append(seq[:i])
+            self.col += i
+            if self.col == w:
+                parts.append(b'\n')
+                self.col = 0
+        full = (len(seq) - i) // w * w
+        if full > 0:
+            parts.append(b'\n'.join(seq[j:j + w] for j in range(i, i + full, w)) + b'\n')
+        if i + full < len(seq):
+            parts.append(seq[i + full:])
+            self.col = len(seq) - i - full
+        self.record[1] += len(seq)
+        self.write(b''.join(parts))
+
+    def endRecord(self):
+        if self.record is None:
+            return
+        if self.col > 0:
+            self.write(b'\n')
+            self.col = 0
+        name, length, offset = self.record
+        # as samtools faidx: the first line of the sequence
+        lineBases = min(length, self.lineWidth)
+        self.index.append((name, length, offset, lineBases, (lineBases + 1 if length > 0 else 0)))
+        self.record = None
+
+    def addFile(self, file: str, prefix: bytes) -> list[bytes]:
+        # Returns the names of the sequences written
+        names = []
+        for buf in iterLines(iterChunks(file)):
+            pos = 0
+            for m in headerPattern.finditer(buf):
+                self.addBlock(buf[pos:m.start()], file)
+                names.append(self.startRecord(m.group()[1:].rstrip(b'\r\n'), prefix))
+                pos = m.end()
+            self.addBlock(buf[pos:], file)
+        self.endRecord()
+        return names
+
+    def addBlock(self, block: bytes, file: str):
+        seq = block.translate(None, whitespace)
+        if len(seq) == 0:
+            return
+        if self.record is None:
+            raise Exception(f'Sequence before the first header in {file}')
+        self.addSequence(seq)
+
+
+def checkConcatFormats(files: list[str]):
+    notFasta = [f for f in files if getSeqFormat(f) != 'fasta']
+    if len(notFasta) > 0:
+        raise ValueError(f'Only fasta files can be concatenated, {len(notFasta)} file(s) are not, ' +
+                         f'eg. {notFasta[0]}')
+
+
+def concatAssemblies(assemblies: list[tuple[str, str, str, str]], concatFile: str,
+                     lineWidth: int = CONCAT_LINE_WIDTH) -> tuple[str, str]:
+    # assemblies: [(header prefix, strain, accession, file)...], the prefix
+    # is safeName(strain) in gatherAssemblies.
+    # Returns the index and map files.
+    checkConcatFormats([file for _, _, _, file in assemblies])
+    faiFile, mapFile = getConcatFiles(concatFile)
+    tmps = [getTempName(f) for f in [concatFile, faiFile, mapFile]]
+    sizes = [os.path.getsize(file) for _, _, _, file in assemblies]
+    start = time.perf_counter()
+    try:
+        with open(tmps[0], 'wb') as fh, open(tmps[2], 'w') as mf, \
+                tqdm(total=sum(sizes), unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+            writer = FastaConcatWriter(fh, lineWidth)
+            mf.write('\t'.join(mapHeader) + '\n')
+            for (prefix, strain, acc, file), size in zip(assemblies, sizes):
+                for name in writer.addFile(file, prefix.encode()):
+                    mf.write(f'{name.decode()}\t{acc}\t{strain}\n')
+                pbar.update(size)
+        with open(tmps[1], 'w') as ff:
+            for entry in writer.index:
+                ff.write('\t'.join([entry[0].decode()] + [str(v) for v in entry[1:]]) + '\n')
+        for tmp, f in zip(tmps, [concatFile, faiFile, mapFile]):
+            os.replace(tmp, f)
+    except BaseException:
+        for tmp in tmps:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+        raise
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'Concatenated {len(writer.index)} sequence(s) of {len(assemblies)} genome(s) ' +
+          f'to "{concatFile}", {writer.offset / 1024**2:.1f} MiB in {elapsed:.1f}s')
+    return faiFile, mapFile
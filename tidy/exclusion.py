@@ -0,0 +1,62 @@
+# Exclusion list compiled into indexes, so that each strain is checked in
+# time proportional to its name length and number of accessions instead of the
+# length of the exclusion list.
+
+from collections import deque
+
+
+class SubstringMatcher:
+    # Aho-Corasick automaton, finds all patterns contained in a text in one
+    # pass over the text.
+    def __init__(self, patterns: list[str]):
+        self.goto: list[dict[str, int]] = [{}]
+        self.out: list[list[int]] = [[]]
+        for i, pattern in enumerate(patterns):
+            node = 0
+            for c in pattern:
+                if not c in self.goto[node]:
+                    self.goto.append({})
+                    self.out.append([])
+                    self.goto[node][c] = len(self.goto) - 1
+                node = self.goto[node][c]
+            self.out[node].append(i)
+        # breadth first, fail link of a node is the longest proper suffix that
+        # is also in the trie
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and not c in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(c, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def search(self, text: str) -> set[int]:
+        # indices of the patterns found in text
+        found = set(self.out[0])
+        node = 0
+        for c in text:
+            while node and not c in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(c, 0)
+            found.update(self.out[node])
+        return found
+
+
+def compileExclusions(exclusions: list[list[str]]) -> tuple[dict[str, list[int]], SubstringMatcher, list[int]]:
+    # Lines with an accession (2nd column) are matched by accession only,
+    # other lines by strain name as a substring.
+    # Returns {accession: [line index]}, a matcher over the strain names, and
+    # the line index of each pattern in the matcher.
+    accIndex: dict[str, list[int]] = {}
+    nameLines: list[int] = []
+    for i, ex in enumerate(exclusions):
+        if len(ex) > 1:
+            accIndex.setdefault(ex[1], []).append(i)
+        else:
+            nameLines.append(i)
+    matcher = SubstringMatcher([exclusions[i][0] for i in nameLines])
+    return accIndex, matcher, nameLines
@@ -0,0 +1,109 @@
+# Genome statistics in one read of the sequence file: number of contigs, total
+# length, N50/L50, GC and N content.
+# The decompressed chunks are cut at line ends and each one is handled as a
+# NumPy byte array, there is no Python loop over lines or bases.
+# Sequence lines are the lines after a ">" header (fasta) or between "ORIGIN"
+# and "//" (genbank), only letters on them are counted.
+
+from contextlib import closing
+import numpy as np
+from .seqfile import getSeqFormat, iterChunks
+
+statsColumns = ['contigs', 'total_length', 'N50', 'L50', 'GC_percent', 'N_percent']
+
+
+def iterLines(chunks):
+    # Same data as chunks, but each buffer ends with a complete line
+    carry = b''
+    for chunk in chunks:
+        buf = carry + chunk
+        cut = buf.rfind(b'\n') + 1
+        carry = buf[cut:]
+        if cut > 0:
+            yield buf[:cut]
+    if len(carry) > 0:
+        yield carry + b'\n'
+
+
+def lineStartsWith(arr: np.ndarray, starts: np.ndarray, prefix: bytes) -> np.ndarray:
+    found = np.ones(len(starts), dtype=bool)
+    for k, b in enumerate(prefix):
+        idx = np.minimum(starts + k, len(arr) - 1)
+        found &= (starts + k < len(arr)) & (arr[idx] == b)
+    return found
+
+
+def getSeqLines(arr: np.ndarray, starts: np.ndarray, fmt: str,
+                inSeq: bool) -> tuple[np.ndarray, np.ndarray, bool]:
+    # Per line: is it a record start, is it a sequence line. inSeq is the
+    # genbank state (inside ORIGIN) at the start of the buffer, returned
+    # updated for the next one.
+    if fmt == 'fasta':
+        isStart = (arr[starts] == ord('>'))
+        return isStart, ~isStart, inSeq
+    isStart = lineStartsWith(arr, starts, b'LOCUS ')
+    isOrigin = lineStartsWith(arr, starts, b'ORIGIN')
+    isEnd = lineStartsWith(arr, starts, b'//')
+    toggles = isOrigin | isEnd
+    # last ORIGIN or // line up to each line
+    last = np.maximum.accumulate(np.where(toggles, np.arange(len(starts)), -1))
+    isSeq = np.where(last >= 0, isOrigin[np.maximum(last, 0)], inSeq) & ~toggles
+    if toggles.any():
+        inSeq = bool(isOrigin[last[-1]])
+    return isStart, isSeq, inSeq
+
+
+def getGenomeStats(file: str) -> dict[str, int|float]:
+    with closing(iterChunks(file)) as chunks:
+        return getChunkStats(chunks, getSeqFormat(file))
+
+
+def getChunkStats(chunks, fmt: str) -> dict[str, int|float]:
+    # fmt: "fasta" or "genbank"
+    lengths = [] # arrays of lengths of finished records
+    current = 0 # length of the record still open at the end of a buffer
+    opened = False
+    inSeq = False
+    counts = np.zeros(256, dtype=np.int64)
+    for buf in iterLines(chunks):
+        arr = np.frombuffer(buf, dtype=np.uint8)
+        ends = np.flatnonzero(arr == ord('\n'))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        isStart, isSeq, inSeq = getSeqLines(arr, starts, fmt, inSeq)
+        lower = arr | 0x20
+        isLetter = (lower >= ord('a')) & (lower <= ord('z'))
+        isSeqByte = np.repeat(isSeq, ends + 1 - starts) & isLetter
+        counts += np.bincount(arr[isSeqByte], minlength=256)
+        # letters per line, summed per record (0 is the one still open)
+        perLine = np.add.reduceat(isSeqByte, starts, dtype=np.int64)
+        perRecord = np.bincount(np.cumsum(isStart), weights=perLine,
+                                minlength=int(isStart.sum()) + 1).astype(np.int64)
+        current += int(perRecord[0])
+        if len(perRecord) > 1:
+            if opened:
+                lengths.append(np.array([current]))
+            lengths.append(perRecord[1:-1])
+            current = int(perRecord[-1])
+            opened = True
+    if opened:
+        lengths.append(np.array([current]))
+    lengths = (np.sort(np.concatenate(lengths))[::-1] if opened
+               else np.zeros(0, dtype=np.int64))
+
+    total = int(lengths.sum())
+    if total > 0:
+        i = int(np.searchsorted(np.cumsum(lengths), total / 2))
+        n50, l50 = int(lengths[i]), i + 1
+    else:
+        n50, l50 = 0, 0
+    gc = int(counts[[ord(c) for c in 'GCgc']].sum())
+    acgt = int(counts[[ord(c) for c in 'ACGTacgt']].sum())
+    ns = int(counts[[ord(c) for c in 'Nn']].sum())
+    return {
+        'contigs': len(lengths),
+        'total_length': total,
+        'N50': n50,
+        'L50': l50,
+        'GC_percent': (round(gc / acgt * 100, 2) if acgt > 0 else 0.0),
+        'N_percent': (round(ns / total * 100, 4) if total > 0 else 0.0),
+    }
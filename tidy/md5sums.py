@@ -0,0 +1,59 @@
+# Checksums written by ncbi-genome-download: a MD5SUMS file in each assembly
+# folder, with lines "<md5>  ./<file name>".
+# The md5 of a sequence file is computed while it is decompressed, the file is
+# read only once.
+
+import os
+from .cache import HASH_BLOCK
+
+
+def readMd5Sums(md5File: str) -> dict[str, str]:
+    # {file name: md5}, empty if there is no MD5SUMS file
+    md5Sums = {}
+    try:
+        with open(md5File, 'r') as mf:
+            for l in mf:
+                parts = l.strip().split(maxsplit=1)
+                if len(parts) == 2:
+                    md5Sums[os.path.basename(parts[1].lstrip('*'))] = parts[0].lower()
+    except FileNotFoundError:
+        pass
+    return md5Sums
+
+
+def getExpectedMd5(file: str) -> None|str:
+    # md5 of file in MD5SUMS next to it, None if not listed
+    d, n = os.path.split(file)
+    return readMd5Sums(os.path.join(d, 'MD5SUMS')).get(n)
+
+
+class HashingReader:
+    # Binary file wrapper feeding all bytes read to hasher (eg. hashlib.md5),
+    # the decompressors read the compressed bytes through it.
+    def __init__(self, fh, hasher):
+        self.fh = fh
+        self.hasher = hasher
+        self.mode = 'rb'
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fh.read(size)
+        self.hasher.update(data)
+        return data
+
+    def drain(self):
+        # hash what the decompressor did not read (eg. after early exit)
+        while self.read(HASH_BLOCK):
+            pass
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.fh.close()
+
+    @property
+    def closed(self):
+        return self.fh.closed
@@ -0,0 +1,57 @@
+# Compact storage of the metadata table: only the columns that are used, one
+# __slots__ object per assembly. Repeated strings (assembly level, categories)
+# are read as categoricals and shared between records.
+
+# Columns read from the metadata table
+infoColumns = [
+    'assembly_accession', 'organism_name', 'infraspecific_name',
+    'assembly_level', 'seq_rel_date', 'refseq_category',
+    'relation_to_type_material', 'local_filename',
+]
+infoDtypes = {
+    'assembly_accession': str,
+    'organism_name': str,
+    'infraspecific_name': str,
+    'assembly_level': 'category',
+    'seq_rel_date': 'category',
+    'refseq_category': 'category',
+    'relation_to_type_material': 'category',
+    'local_filename': str,
+}
+
+
+class AssemblyRecord:
+    # Fields kept per assembly, read like a dict: record['assembly_level']
+    __slots__ = ('assembly_level', 'seq_rel_date', 'refseq_category',
+                 'relation_to_type_material', 'local_filename')
+
+    def __init__(self, assembly_level=None, seq_rel_date=None,
+                 refseq_category=None, relation_to_type_material=None,
+                 local_filename=None):
+        self.assembly_level = assembly_level
+        self.seq_rel_date = seq_rel_date
+        self.refseq_category = refseq_category
+        self.relation_to_type_material = relation_to_type_material
+        self.local_filename = local_filename
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        return 'AssemblyRecord(' + ', '.join(
+            f'{f}={getattr(self, f)!r}' for f in self.__slots__) + ')'
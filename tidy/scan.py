@@ -0,0 +1,89 @@
+# Index of the download dir, built with one scandir per directory instead of a
+# stat per metadata row. Directories are listed concurrently, which hides the
+# latency of network file systems.
+# ncbi-genome-download layout: <dir>/<section>/<group>/<accession>/<files>
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def listDir(dir: str) -> tuple[list[str], list[str]]:
+    # (sub dirs, files), file types come from the dir entries, no extra stat
+    subDirs = []
+    files = []
+    with os.scandir(dir) as it:
+        for entry in it:
+            if entry.is_dir():
+                subDirs.append(entry.path)
+            else:
+                files.append(entry.path)
+    return subDirs, files
+
+
+def scanDownloadDir(dir: str, threads: int = 8) -> dict[str, list[str]]:
+    # {accession: [file path]}, accession is the name of the parent dir.
+    # Paths are normalized with os.path.normpath.
+    index: dict[str, list[str]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        pending = {executor.submit(listDir, dir)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subDirs, files = future.result()
+                for f in files:
+                    f = os.path.normpath(f)
+                    acc = os.path.basename(os.path.dirname(f))
+                    index.setdefault(acc, []).append(f)
+                pending.update(executor.submit(listDir, d) for d in subDirs)
+    return index
+
+
+def checkDownloadDir(
+    filePaths: dict[str, str],
+    index: dict[str, list[str]]
+) -> tuple[list[tuple[str, str]], list[tuple[str, str]]]:
+    # filePaths is {accession: file path} from the metadata table.
+    # Returns rows whose file is missing [(acc, path)], and files of
+    # accessions on disk that are not in the table [(acc, path)].
+    missing = []
+    referenced = set()
+    for acc, f in filePaths.items():
+        f = os.path.normpath(f)
+        referenced.add(f)
+        if not f in index.get(acc, []) and not f in index.get(os.path.basename(os.path.dirname(f)), []):
+            missing.append((acc, f))
+    orphans = [(acc, f) for acc in sorted(index) if not acc in filePaths
+               for f in sorted(index[acc]) if not f in referenced]
+    return missing, orphans
+
+
+def getScanReportFile(dir: str) -> str:
+    return os.path.realpath(dir) + '-scan.tsv'
+
+
+def reportDownloadDir(dir: str, missing: list[tuple[str, str]],
+                      orphans: list[tuple[str, str]]) -> None|str:
+    # Print a summary and write the details next to the download dir.
+    # Returns the report file, None when there is nothing to report.
+    reportFile = getScanReportFile(dir)
+    if len(missing) == 0 and len(orphans) == 0:
+        if os.path.isfile(reportFile):
+            os.remove(reportFile)
+        return None
+    print(f'\n{len(missing)} accession(s) in the table have no file in "{dir}", ' +
+          f'{len(orphans)} file(s) on disk are not in the table.')
+    for acc, f in missing[:10]:
+        print(f'\tmissing\t{acc}\t{f}')
+    if len(missing) > 10:
+        print(f'\t... and {len(missing) - 10} more')
+    print(f'Details in {reportFile}')
+    with open(reportFile, 'w') as rf:
+        rf.write(f'Scan of download dir:\n{os.path.realpath(dir)}\n')
+        for text, entries in [
+            ('Accessions in table, file missing (excluded)', missing),
+            ('Files on disk, accession not in table', orphans),
+        ]:
+            rf.write('\n' + text + '\n')
+            for acc, f in entries:
+                rf.write(f'{acc}\t{f}\n')
+    return reportFile
@@ -0,0 +1,158 @@
+# Streaming access to (compressed) sequence files.
+# Files are decompressed in large fixed-size chunks and record starts are
+# counted directly on the byte buffers, no external process is involved.
+# gzip is decompressed by a faster zlib implementation when installed
+# (python-isal, zlib-ng), BGZF files by a thread pool when more than one
+# thread is set, see setDecompression.
+
+import bz2
+import gzip
+import lzma
+import os
+import zlib
+from .bgzf import isBgzf, iterBgzf
+from .md5sums import HashingReader
+try:
+    from isal import igzip, isal_zlib
+except ImportError:
+    igzip = isal_zlib = None
+try:
+    from zlib_ng import gzip_ng, zlib_ng
+except ImportError:
+    gzip_ng = zlib_ng = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+faFmts = ['fna', 'fa', 'faa', 'fasta', 'ffn', 'frn']
+gbFmts = ['gbff', 'gb', 'gbk', 'gpff']
+compressExts = ['gz', 'xz', 'bz2', 'zst']
+
+# Record start marker of each format, always anchored at a line start.
+recordStarts = {
+    'fasta': b'\n>',
+    'genbank': b'\nLOCUS ',
+}
+
+# gzip backends: (open, raw deflate decompress), None if not installed
+gzipBackends = {
+    'stdlib': (gzip.open, zlib.decompress),
+    'isal': (None if igzip is None else (igzip.open, isal_zlib.decompress)),
+    'zlib-ng': (None if gzip_ng is None else (gzip_ng.open, zlib_ng.decompress)),
+}
+decompressors = ['auto'] + list(gzipBackends)
+
+# Used by all readers of this process, set once per run
+decompression = {'backend': 'stdlib', 'threads': 1}
+
+
+def setDecompression(backend: str = 'auto', threads: int = 1):
+    # backend: one of decompressors, "auto" is the fastest one installed.
+    # threads: BGZF blocks decompressed at the same time.
+    if not backend in decompressors:
+        raise ValueError(f'Decompressor not known: {backend}, should be one of {decompressors}')
+    if backend == 'auto':
+        backend = next(b for b in ['isal', 'zlib-ng', 'stdlib'] if not gzipBackends[b] is None)
+    elif gzipBackends[backend] is None:
+        raise ValueError(f'Decompressor {backend} is not installed.')
+    decompression['backend'] = backend
+    decompression['threads'] = max(1, threads)
+
+
+def getDecompression() -> tuple[str, int]:
+    return decompression['backend'], decompression['threads']
+
+
+def openGzip(file: str, mode: str = 'rb'):
+    return gzipBackends[decompression['backend']][0](file, mode)
+
+
+def openZstd(file, mode: str = 'rb'):
+    if zstandard is None:
+        raise OSError(f'Reading zstd compressed files needs the zstandard package: {file}')
+    return zstandard.open(file, mode)
+
+
+magicNumbers = [
+    (b'\x1f\x8b', openGzip),
+    (b'\xfd7zXZ\x00', lzma.open),
+    (b'BZh', bz2.open),
+    (b'\x28\xb5\x2f\xfd', openZstd),
+]
+
+
+def getSeqFormat(file: str) -> str:
+    parts = os.path.basename(file).split('.')
+    if len(parts) > 1 and parts[-1] in compressExts:
+        parts = parts[:-1]
+    ext = (parts[-1] if len(parts) > 1 else '')
+    if ext in faFmts:
+        return 'fasta'
+    elif ext in gbFmts:
+        return 'genbank'
+    else:
+        raise Exception(f'File format not known: {file}, should be one of {faFmts + gbFmts}')
+
+
+def openSeqFile(file: str, fileobj=None):
+    # Compression is detected from the magic number, not the extension.
+    # With fileobj, the (compressed) data is read from it instead of file.
+    with open(file, 'rb') as fh:
+        head = fh.read(6)
+    for magic, opener in magicNumbers:
+        if head.startswith(magic):
+            return opener((file if fileobj is None else fileobj), 'rb')
+    return (open(file, 'rb') if fileobj is None else fileobj)
+
+
+def iterChunks(file: str, chunkSize: int = CHUNK_SIZE, hasher=None):
+    # With hasher, all bytes of the (compressed) file are fed to it in the
+    # same read, also when the chunks are not read to the end.
+    if decompression['threads'] > 1:
+        with open(file, 'rb') as fh:
+            head = fh.read(64)
+        if isBgzf(head):
+            yield from iterBgzf(file, decompression['threads'], chunkSize,
+                                gzipBackends[decompression['backend']][1], hasher=hasher)
+            return
+    if hasher is None:
+        fh = openSeqFile(file)
+    else:
+        raw = HashingReader(open(file, 'rb'), hasher)
+        fh = openSeqFile(file, raw)
+    try:
+        while True:
+            chunk = fh.read(chunkSize)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        try:
+            if not hasher is None:
+                raw.drain()
+        finally:
+            fh.close()
+            if not hasher is None:
+                raw.close()
+
+
+def countRecords(chunks, pattern: bytes, limit: None|int = None) -> int:
+    # `pattern` starts with b'\n', a virtual newline is put before the first
+    # chunk so that a record at the very start of the file is counted.
+    # Only the last len(pattern)-1 bytes are carried over to the next chunk,
+    # a match spanning the boundary is found in tail + head of the chunk.
+    # With `limit` set, reading stops after the chunk where the count passes
+    # the limit, the returned number is then only a lower bound.
+    k = len(pattern) - 1
+    tail = b'\n'
+    n = 0
+    for chunk in chunks:
+        n += chunk.count(pattern)
+        n += (tail + chunk[:k]).count(pattern)
+        tail = (chunk[-k:] if len(chunk) >= k else (tail + chunk)[-k:])
+        if limit is not None and n > limit:
+            break
+    return n
@@ -1,88 +1,123 @@
-import subprocess
 import os
 import re
+import hashlib
+import zlib
+import lzma
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import partial, lru_cache
 from tqdm import tqdm
 import pandas as pd
-import shutil
+from .cache import openCtgCache, getFileHash
+from .transfer import syncFiles, printUsedModes
+from .assembly_stats import getNumCtgsFromStats
+from .exclusion import compileExclusions
+from .records import AssemblyRecord, infoColumns, infoDtypes
+from .scan import scanDownloadDir, checkDownloadDir, reportDownloadDir
+from .seqfile import getSeqFormat, iterChunks, countRecords, recordStarts, \
+    setDecompression, getDecompression, compressExts
+from .transcode import getTranscodeMode, getTranscodedName, transcodeFiles
+from .concat import concatAssemblies, checkConcatFormats
+from .archive import getArchiveExt, getArchiveBase, ArchiveWriter, archiveFiles
+from .genome_stats import getGenomeStats, getChunkStats, statsColumns
+from .md5sums import getExpectedMd5
+
+def collapseRepeat(tokens: tuple) -> tuple:
+    # "NBRC 14893 NBRC 14893" -> "NBRC 14893"
+    while len(tokens) > 1 and len(tokens) % 2 == 0 \
+            and tokens[:len(tokens)//2] == tokens[len(tokens)//2:]:
+        tokens = tokens[:len(tokens)//2]
+    return tokens
+
+def normalizeParts(parts: tuple) -> tuple:
+    # Parts of an "a = b = c" strain name as token tuples. Identical parts are
+    # kept once, and a part that shows up inside another part is removed from
+    # it: ("MA-4680", "NBRC 14893 MA-4680") -> ("MA-4680", "NBRC 14893")
+    parts = [collapseRepeat(p) for p in parts]
+    parts = [p for p in dict.fromkeys(parts) if len(p) > 0]
+    partSet = set(parts)
+    lengths = sorted({len(p) for p in parts}, reverse=True)
+    newParts = []
+    for p in parts:
+        kept = []
+        i = 0
+        while i < len(p):
+            for l in lengths:
+                if l < len(p) and p[i:i+l] in partSet:
+                    i += l
+                    break
+            else:
+                kept.append(p[i])
+                i += 1
+        if len(kept) > 0:
+            newParts.append(tuple(kept))
+    return tuple(dict.fromkeys(newParts))
 
 def removeEqu(names):
-    newNames = [removeDup(n) for n in names]
-    names = newNames.copy()
-    changed = False
-    for i, n in enumerate(names):
-        for j, r in enumerate(newNames):
-            if n in r and n != r:
-                newNames[j] = r.replace(n, '').strip()
-                changed = True
-    if changed:
-        newNames = [n for n in newNames if n!=""]
-        return removeEqu(newNames)
-    else:
-        return names
+    parts = normalizeParts(tuple(tuple(n.split()) for n in names))
+    return [' '.join(p) for p in parts]
 
+@lru_cache(maxsize=2**16)
 def removeDup(name):
-    changed = False
-    if "=" in name:
-        name = " ".join(removeEqu([n.strip() for n in name.split("=")]))
-        changed = True
-    if name == "":
-        return ""
-    midi = int((len(name) - 1)/2)
-    if name[midi] == " " and name[:midi] == name[midi+1:]:
-        name = name[:midi]
-        changed = True
-    if changed:
-        return removeDup(name)
-    else:
-        return name
-
-def getNumCtgs(file):
-    ext = file.split(".")[-2]
-    faFmts = ['fna', 'fa', 'faa']
-    gbFmts = ['gbff', 'gb', 'gbk', 'gpff']
-    if ext in faFmts:
-        return int(
-            subprocess.check_output(
-                f"gzip -cd {file} | grep \">\" | wc -l",
-                shell=True
-            ).decode().strip()
-        )
-    elif ext in gbFmts:
-        return int(
-            subprocess.check_output(
-                f"gzip -cd {file} | grep \"LOCUS       \" | wc -l",
-                shell=True
-            ).decode().strip()
-        )
-    else:
-        raise Exception(f'File format not known: {file}, should be one of {faFmts + gbFmts}')
+    parts = normalizeParts(tuple(tuple(n.split()) for n in name.split('=')))
+    return ' '.join(collapseRepeat(tuple(t for p in parts for t in p)))
+
+def getNumCtgs(file, maxCtg=None):
+    # If maxCtg is set, stop reading once the count passes it. The returned
+    # number is then larger than maxCtg but not the real count.
+    pattern = recordStarts[getSeqFormat(file)]
+    with closing(iterChunks(file)) as chunks:
+        return countRecords(chunks, pattern, limit=maxCtg)
+
+def getStrainNames(infoDf):
+    # Column-wise version of the strain name cleaning, one name per row.
+    org = infoDf['organism_name'].astype(str).str.strip()
+    strain = infoDf['infraspecific_name'].fillna('nan').astype(str)\
+        .str.replace('strain=', '', regex=False).str.strip()
+    # remove type strain: "type strain (a = b = c)" "type strain: a"
+    isType = strain.str.contains('type strain', regex=False)
+    strain = strain.mask(isType, strain.str.replace('type strain', '', regex=False)
+        .str.replace(r'[:()]', '', regex=True).str.strip())
+    strain = strain.mask(strain == 'nan', '')
+    # some strain name are duplicated in orgnism name
+    names = (org + ' ' + strain).str.split(' ', regex=False)
+    org = names.str[:2].str.join(' ')
+    strain = names.str[2:].str.join(' ')
+    # each distinct name is normalized only once
+    strain = strain.map({s: removeDup(s) for s in strain.unique()})
+    return (org + ' ' + strain).str.strip()
 
 def getInfoFrom(args):
     dirName = os.path.split(args.dir)[1]
-    infoDf = pd.read_csv(args.tsv, sep='\t', header=0, index_col=0)
+    # only the columns that are used, repeated strings as categories
+    infoDf = pd.read_csv(args.tsv, sep='\t', header=0,
+                         usecols=lambda c: c in infoColumns, dtype=infoDtypes,
+                         index_col='assembly_accession')
+
+    names = getStrainNames(infoDf)
+    filePaths = os.path.join(args.dir, '') + infoDf['local_filename'].astype(str)\
+        .str.split(dirName, n=1, regex=False).str[1].str[1:]
+    infoDf['local_filename'] = filePaths
+
+    # Check file existance against one scan of the download dir, rows
+    # without file are reported and left out
+    missing, orphans = checkDownloadDir(
+        dict(zip(infoDf.index.tolist(), filePaths.tolist())),
+        scanDownloadDir(args.dir, threads=args.threads))
+    reportDownloadDir(args.dir, missing, orphans)
+    if len(missing) > 0:
+        infoDf = infoDf.drop(index=[acc for acc, _ in missing])
+        names = names.drop(index=[acc for acc, _ in missing])
 
-    # Data table to dict, check file existance
+    # Data table to records
     strains = {}
-    for acc, row in infoDf.iterrows():
-        org = row.organism_name.strip()
-        strain = str(row.infraspecific_name).replace( 'strain=', '').strip()
-        # remove type strain: "type strain (a = b = c)" "type strain: a"
-        if "type strain" in strain:
-            strain = strain.replace('type strain', '').\
-                replace(':', '').replace('(', '').replace(')', '').strip()
-        # some strain name are duplicated in orgnism name
-        if strain == 'nan': strain = ''
-        names = f'{org} {strain}'.split(' ')
-        org = " ".join(names[:2])
-        strain = removeDup(" ".join(names[2:]))
-        name = f'{org} {strain}'.strip()
-
-        filePath = os.path.join(args.dir,
-            row.local_filename.split(dirName)[1][1:])
-
-        assert os.path.isfile(filePath), filePath
-        data = row.to_dict()
-        data['local_filename'] = filePath
+    columns = [
+        (infoDf[f].to_numpy(dtype=object).tolist() if f in infoDf
+         else [None] * len(infoDf))
+        for f in AssemblyRecord.__slots__
+    ]
+    for acc, values, name in zip(infoDf.index.tolist(), zip(*columns), names.tolist()):
+        data = AssemblyRecord(*values)
         try:
             strains[name][acc] = data
         except KeyError:
@@ -99,84 +134,316 @@ def getExclusion(excludeList):
         exclusions = []
     return exclusions
 
-def filterTooManyCtgs(assemblies, maxCtg, tooManyContigs):
+# Errors of reading a broken (eg. truncated) sequence file
+readErrors = (OSError, EOFError, zlib.error, lzma.LZMAError)
+
+def readSafe(func, file, *args, **kwargs):
+    # For worker processes: (func(file, ...), None), or (None, error) when
+    # file is broken, it is reported, not raised
+    try:
+        return func(file, *args, **kwargs), None
+    except readErrors as e:
+        return None, f'{type(e).__name__}: {e}'
+
+def readVerified(file, func=None):
+    # One read of file: func(chunks) on the decompressed chunks, and the md5
+    # of the compressed bytes checked against MD5SUMS. Without func, the file
+    # is only hashed.
+    # Returns (result of func, read error, md5 check "ok"/"mismatch"/"missing"),
+    # the check is "unread" when the file could not be hashed at all.
+    expected = getExpectedMd5(file)
+    result = None
+    error = None
+    md5 = None
+    if func is None:
+        if not expected is None:
+            try:
+                md5 = getFileHash(file)
+            except OSError as e:
+                return None, f'{type(e).__name__}: {e}', 'unread'
+    else:
+        hasher = (None if expected is None else hashlib.md5())
+        try:
+            with closing(iterChunks(file, hasher=hasher)) as chunks:
+                result = func(chunks)
+        except readErrors as e:
+            error = f'{type(e).__name__}: {e}'
+        if not hasher is None:
+            md5 = hasher.hexdigest()
+    if expected is None:
+        return result, error, 'missing'
+    return result, error, ('ok' if md5 == expected else 'mismatch')
+
+def countVerifiedSafe(file, maxCtg=None):
+    pattern = recordStarts[getSeqFormat(file)]
+    return readVerified(file, partial(countRecords, pattern=pattern, limit=maxCtg))
+
+def statsVerifiedSafe(file):
+    return readVerified(file, partial(getChunkStats, fmt=getSeqFormat(file)))
+
+def mapJobs(func, items, jobs=1):
+    # Ordered map over a process pool (jobs > 1) with a progress bar
+    if jobs is None or jobs <= 1:
+        yield from tqdm(map(func, items), total=len(items))
+        return
+    chunksize = max(1, len(items) // (jobs * 16))
+    # workers use the decompression set in this process
+    with ProcessPoolExecutor(max_workers=jobs, initializer=setDecompression,
+                             initargs=getDecompression()) as executor:
+        yield from tqdm(executor.map(func, items, chunksize=chunksize),
+                        total=len(items))
+
+def filterTooManyCtgs(assemblies, maxCtg, tooManyContigs, unreadable=None,
+                      jobs=1, cache=None):
+    if unreadable is None: unreadable = []
     if not maxCtg is None:
         # Filter base on genome quality
         print(f'\nChecking contig number of {len(assemblies)} sequences.')
         print(f'"Complete Genome" and "chromosome" level assembly will be skipped.')
-        allKeys = list(assemblies.keys())
-        for name in tqdm(allKeys):
-            _, assemblyData = assemblies[name]
-            assemblyLevel = assemblyData['assembly_level']
-            if assemblyLevel in ['Complete Genome', 'Chromosome']:
-                continue
-            n = getNumCtgs(assemblyData['local_filename'])
-            if n > maxCtg:
-                tooManyContigs.append((name, assemblies.pop(name)[0]))
-    return assemblies, tooManyContigs
-
-def filterDownloads(strains, exclusions, maxCtg):
-    validAssemblies = {} # store target genome info [(strain, {data..}), (strain, {data...}), ...]
+        toCheck = [name for name in assemblies if not
+            assemblies[name][1]['assembly_level'] in ['Complete Genome', 'Chromosome']]
+        results = {}
+        # assembly_stats files next to the genomes, then the cache, only the
+        # rest is counted from the sequence file
+        fromStats = set() # exact counts, others may stop early above maxCtg
+        for name in toCheck:
+            n = getNumCtgsFromStats(assemblies[name][1]['local_filename'])
+            if not n is None:
+                results[name] = (n, None)
+                fromStats.add(name)
+        if len(results) > 0:
+            print(f'{len(results)} contig number(s) read from assembly_stats files')
+        if not cache is None:
+            nFound = 0
+            for name in toCheck:
+                if name in results: continue
+                n = cache.get(assemblies[name][1]['local_filename'], maxCtg)
+                if not n is None:
+                    results[name] = (n, None)
+                    nFound += 1
+            print(f'{nFound} contig number(s) found in cache {cache.cacheFile}')
+        toCount = [name for name in toCheck if not name in results]
+        files = [assemblies[name][1]['local_filename'] for name in toCount]
+        countFunc = partial(readSafe, getNumCtgs, maxCtg=maxCtg)
+        for name, f, (n, error) in zip(toCount, files, mapJobs(countFunc, files, jobs)):
+            results[name] = (n, error)
+            if not cache is None and error is None:
+                cache.put(f, n, exact=(n <= maxCtg))
+        for name in toCheck:
+            n, error = results[name]
+            if error is not None:
+                unreadable.append((name, assemblies.pop(name)[0], error))
+            elif n > maxCtg:
+                # unless read from assembly_stats, counting stopped early, only
+                # known to be more than maxCtg
+                tooManyContigs.append((name, assemblies.pop(name)[0],
+                                       (str(n) if name in fromStats else f'>{maxCtg}')))
+    return assemblies, tooManyContigs, unreadable
+
+# Quality filters on genome statistics, option: (statistic, "min" or "max")
+statsFilterOptions = {
+    'minN50': ('N50', 'min'),
+    'minLength': ('total_length', 'min'),
+    'maxNs': ('N_percent', 'max'),
+    'minGC': ('GC_percent', 'min'),
+    'maxGC': ('GC_percent', 'max'),
+}
+
+def getStatsFilters(args):
+    return {opt: getattr(args, opt) for opt in statsFilterOptions
+            if not getattr(args, opt, None) is None}
+
+def checkGenomeStats(stats, statsFilters):
+    # Reason to exclude, None if all filters pass
+    reasons = []
+    for opt, value in statsFilters.items():
+        stat, bound = statsFilterOptions[opt]
+        if (bound == 'min' and stats[stat] < value) or (bound == 'max' and stats[stat] > value):
+            reasons.append(f'{stat}={stats[stat]} ({opt} {value})')
+    return ('; '.join(reasons) if len(reasons) > 0 else None)
+
+def filterGenomeStats(assemblies, statsFilters, lowQuality, unreadable=None,
+                      maxCtg=None, tooManyContigs=None, jobs=1, corrupt=None):
+    # One read of each sequence file for all statistics. The contig number
+    # from the statistics is used for maxCtg, with the same levels skipped as
+    # in filterTooManyCtgs.
+    # With corrupt (a list), md5 is verified in the same read, see
+    # filterVerified.
+    # Returns the statistics of the assemblies kept: {strain: stats}
+    if unreadable is None: unreadable = []
+    if tooManyContigs is None: tooManyContigs = []
+    print(f'\nComputing genome statistics of {len(assemblies)} sequences' +
+          ('' if corrupt is None else ', verifying md5') + '.')
+    names = list(assemblies)
+    files = [assemblies[name][1]['local_filename'] for name in names]
+    if corrupt is None:
+        results = ((stats, error, None) for stats, error in mapJobs(partial(readSafe, getGenomeStats), files, jobs))
+    else:
+        results = mapJobs(statsVerifiedSafe, files, jobs)
+    genomeStats = {}
+    nMissing = 0
+    for name, (stats, error, check) in zip(names, results):
+        if check == 'missing':
+            nMissing += 1
+        elif check == 'mismatch':
+            corrupt.append((name, assemblies.pop(name)[0], getMismatchReason(error)))
+            continue
+        if error is not None:
+            unreadable.append((name, assemblies.pop(name)[0], error))
+            continue
+        if not maxCtg is None and stats['contigs'] > maxCtg and not \
+                assemblies[name][1]['assembly_level'] in ['Complete Genome', 'Chromosome']:
+            tooManyContigs.append((name, assemblies.pop(name)[0], str(stats['contigs'])))
+            continue
+        reason = checkGenomeStats(stats, statsFilters)
+        if not reason is None:
+            lowQuality.append((name, assemblies.pop(name)[0], reason))
+            continue
+        genomeStats[name] = stats
+    printMissingMd5(nMissing)
+    return assemblies, genomeStats, tooManyContigs, lowQuality, unreadable
+
+def getMismatchReason(error):
+    return 'md5 mismatch' + ('' if error is None else f', {error}')
+
+def printMissingMd5(nMissing):
+    if nMissing > 0:
+        print(f'{nMissing} file(s) not listed in a MD5SUMS file, not verified.')
+
+def filterVerified(assemblies, maxCtg, tooManyContigs, corrupt, unreadable=None, jobs=1):
+    # Check the md5 of each sequence file against MD5SUMS in its folder, and
+    # count contigs (if maxCtg is set) in the same read. Files of which the
+    # contigs are not counted are only hashed, not decompressed.
+    # md5 mismatches go to corrupt [("strain", "acc", "reason")...], read
+    # errors of files with the right md5 to unreadable.
+    if unreadable is None: unreadable = []
+    print(f'\nVerifying md5 of {len(assemblies)} sequence files' +
+          ('' if maxCtg is None else ', counting contigs') + '.')
+    toCount = [name for name in assemblies if not maxCtg is None and not
+        assemblies[name][1]['assembly_level'] in ['Complete Genome', 'Chromosome']]
+    toHash = [name for name in assemblies if not name in toCount]
+    results = {}
+    for names, func in [(toCount, partial(countVerifiedSafe, maxCtg=maxCtg)),
+                        (toHash, readVerified)]:
+        files = [assemblies[name][1]['local_filename'] for name in names]
+        results.update(zip(names, mapJobs(func, files, jobs)))
+    nMissing = 0
+    for name in list(assemblies):
+        n, error, check = results[name]
+        if check == 'missing':
+            nMissing += 1
+        elif check == 'mismatch':
+            corrupt.append((name, assemblies.pop(name)[0], getMismatchReason(error)))
+            continue
+        if error is not None:
+            unreadable.append((name, assemblies.pop(name)[0], error))
+        elif not n is None and n > maxCtg:
+            tooManyContigs.append((name, assemblies.pop(name)[0], f'>{maxCtg}'))
+    printMissingMd5(nMissing)
+    return assemblies, tooManyContigs, corrupt, unreadable
+
+"""Assembly level - the highest level of assembly for any object in the assembly:
+Complete genome - all chromosomes are gapless and have no runs of 10 or more ambiguous bases (Ns), there are no unplaced or unlocalized scaffolds, and all the expected chromosomes are present (i.e. the assembly is not noted as having partial genome representation). Plasmids and organelles may or may not be included in the assembly but if present then the sequences are gapless.
+Chromosome - there is sequence for one or more chromosomes. This could be a completely sequenced chromosome without gaps or a chromosome containing scaffolds or contigs with gaps between them. There may also be unplaced or unlocalized scaffolds.
+Scaffold - some sequence contigs have been connected across gaps to create scaffolds, but the scaffolds are all unplaced or unlocalized
+Contig - nothing is assembled beyond the level of sequence contigs"""
+levelRanks = {'Complete Genome': 0, 'Chromosome': 1, 'Scaffold': 2, 'Contig': 3}
+
+# Optional tie-breakers, lower rank is better
+tieBreakerRanks = {
+    'refseq_category': lambda col: col.map(
+        {'reference genome': 0, 'representative genome': 1}).fillna(2),
+    'relation_to_type_material': lambda col: col.fillna('').astype(str)\
+        .str.strip().eq('').astype(int),
+}
+
+def parseDates(col):
+    # seq_rel_date is "dd/mm/yyyy" in the metadata table, "yyyy/mm/dd" also
+    # accepted. Unknown dates are NaT.
+    col = col.astype(str)
+    dates = pd.to_datetime(col, format='%d/%m/%Y', errors='coerce')
+    return dates.fillna(pd.to_datetime(col, format='%Y/%m/%d', errors='coerce'))
+
+def selectBestAssemblies(strains, tieBreakers=()):
+    # Rank all assemblies of all strains at once: assembly level, then the
+    # latest release date, then the tie-breakers, then the original order.
+    # Returns {strain: (acc, data)} of the best assembly per strain and the
+    # [(strain, acc)] of the others.
+    rows = [(s, acc, data) for s in strains for acc, data in strains[s].items()]
+    if len(rows) == 0:
+        return {}, []
+    ranking = pd.DataFrame({
+        'strain': pd.Categorical([r[0] for r in rows], categories=list(strains)).codes,
+        'level': [levelRanks.get(r[2]['assembly_level'], len(levelRanks)) for r in rows],
+        'date': parseDates(pd.Series([r[2]['seq_rel_date'] for r in rows])),
+    })
+    sortBy = ['strain', 'level', 'date']
+    ascending = [True, True, False]
+    for tb in tieBreakers:
+        ranking[tb] = tieBreakerRanks[tb](pd.Series([r[2].get(tb) for r in rows]))
+        sortBy.append(tb)
+        ascending.append(True)
+    ranking['order'] = range(len(rows))
+    ranking = ranking.sort_values(sortBy + ['order'], ascending=ascending + [True],
+                                  na_position='last', kind='stable')
+    isBest = ~ranking['strain'].duplicated()
+
+    validAssemblies = {}
+    skippedAccs = []
+    for i, best in zip(ranking['order'].tolist(), isBest.tolist()):
+        s, acc, data = rows[i]
+        if best:
+            validAssemblies[s] = (acc, data)
+        else:
+            skippedAccs.append((s, acc))
+    return validAssemblies, skippedAccs
+
+def filterDownloads(strains, exclusions, maxCtg, jobs=1, cache=None, tieBreakers=()):
     excludedAccs = [] # store excluded (by input) accessions: [("strain", "acc"), ("strain", "acc")...]
-    skippedAccs  = [] # store accessions that are not the best for one strain name
-    tooManyContigs = [] # store genomes that have too many contigs (if --maxCtg is set)
+    tooManyContigs = [] # store genomes that have too many contigs (if --maxCtg is set): [("strain", "acc", ">maxCtg")...]
+    unreadable = [] # store genomes that could not be read when counting contigs: [("strain", "acc", "error")...]
+    # Each exclusion line is used at most once, by the first strain it
+    # matches, lines are tried in the order of the exclusion list.
+    accIndex, nameMatcher, nameLines = compileExclusions(exclusions)
+    used = [False] * len(exclusions)
+    remaining = {} # strains left after exclusion
     for s in strains:
         inEx = False
-        exs = []
-        for ex in exclusions:
-            exStrainname = ex[0]
-            try:
-                exAcc = ex[1]
-            except IndexError:
-                exAcc = None
-            if not exAcc is None:
-                for acc in strains[s]:
-                    if acc == exAcc:
-                        excludedAccs.append((s, acc))
-                        strains[s].pop(acc)
-                        exs.append(ex)
-                        break
-            elif exStrainname in s:
+        exCandidates = {nameLines[i] for i in nameMatcher.search(s)}
+        for acc in strains[s]:
+            exCandidates.update(accIndex.get(acc, []))
+        for i in sorted(exCandidates):
+            if used[i]: continue
+            ex = exclusions[i]
+            if len(ex) > 1:
+                if ex[1] in strains[s]:
+                    excludedAccs.append((s, ex[1]))
+                    strains[s].pop(ex[1])
+                    used[i] = True
+            else:
                 inEx = True
                 excludedAccs.extend([(s, acc) for acc in strains[s]])
-                exs.append(ex)
+                used[i] = True
                 break
-        [exclusions.remove(ex) for ex in exs]
 
         if inEx or len(strains[s]) == 0: continue
-        """Assembly level - the highest level of assembly for any object in the assembly:
-        Complete genome - all chromosomes are gapless and have no runs of 10 or more ambiguous bases (Ns), there are no unplaced or unlocalized scaffolds, and all the expected chromosomes are present (i.e. the assembly is not noted as having partial genome representation). Plasmids and organelles may or may not be included in the assembly but if present then the sequences are gapless.
-        Chromosome - there is sequence for one or more chromosomes. This could be a completely sequenced chromosome without gaps or a chromosome containing scaffolds or contigs with gaps between them. There may also be unplaced or unlocalized scaffolds.
-        Scaffold - some sequence contigs have been connected across gaps to create scaffolds, but the scaffolds are all unplaced or unlocalized
-        Contig - nothing is assembled beyond the level of sequence contigs"""
-
-        if len(strains[s])>1:
-            complete   = [(acc,strains[s][acc]) for acc in strains[s] if \
-                strains[s][acc]['assembly_level'] == 'Complete Genome']
-            chromosome = [(acc,strains[s][acc]) for acc in strains[s] if \
-                strains[s][acc]['assembly_level'] == 'Chromosome']
-            scaffold   = [(acc,strains[s][acc]) for acc in strains[s] if \
-                strains[s][acc]['assembly_level'] == 'Scaffold']
-            contig     = [(acc,strains[s][acc]) for acc in strains[s] if \
-                strains[s][acc]['assembly_level'] == 'Contig']
-
-            assert len(complete + chromosome + scaffold + contig) == len(strains[s])
-
-            complete.sort(  key=lambda d: d[1]['seq_rel_date'], reverse=True)
-            chromosome.sort(key=lambda d: d[1]['seq_rel_date'], reverse=True)
-            scaffold.sort(  key=lambda d: d[1]['seq_rel_date'], reverse=True)
-            contig.sort(    key=lambda d: d[1]['seq_rel_date'], reverse=True)
-
-            sortedAssemblies = (complete + chromosome + scaffold + contig)
-            topAssembly = sortedAssemblies[0]
-            validAssemblies[s] = topAssembly
-            skippedAccs.extend([(s, ass[0]) for ass in sortedAssemblies[1:]])
-        else:
-            validAssemblies[s] = strains[s].popitem()
+        remaining[s] = strains[s]
+
+    # store target genome info {strain: (acc, {data..}), ...}, and accessions
+    # that are not the best for one strain name [("strain", "acc")...]
+    validAssemblies, skippedAccs = selectBestAssemblies(remaining, tieBreakers)
+
+    # only exclusions that never matched are left in the list
+    exclusions[:] = [ex for ex, u in zip(exclusions, used) if not u]
+    if len(exclusions) > 0:
+        print(f'\n{len(exclusions)} line(s) in exclusion list never matched:')
+        for ex in exclusions:
+            print('\t' + '\t'.join(ex))
 
-    validAssemblies, tooManyContigs = filterTooManyCtgs(validAssemblies, maxCtg, tooManyContigs)
+    validAssemblies, tooManyContigs, unreadable = filterTooManyCtgs(
+        validAssemblies, maxCtg, tooManyContigs, unreadable, jobs=jobs, cache=cache)
 
-    return validAssemblies, excludedAccs, skippedAccs, tooManyContigs
+    return validAssemblies, excludedAccs, skippedAccs, tooManyContigs, unreadable
 
 def generateTargetDir(args):
     if args.targetDir is None:
@@ -184,35 +451,118 @@ def generateTargetDir(args):
     else: targetDir = os.path.realpath(args.targetDir)
     return targetDir
 
+illegalChars = re.compile(r"[ _:,();{}+*'\"[\]\/\t\n]+")
+
 def safeName(name: str) -> str:
-    return re.sub(r"[ _:,();{}+*'\"[\]\/\t\n]+", '_', name)
+    return illegalChars.sub('_', name)
+
+def safeNames(names: list[str]) -> list[str]:
+    # safeName of many names in one regex pass, file names never contain \0
+    if len(names) == 0:
+        return []
+    return illegalChars.sub('_', '\0'.join(names)).split('\0')
 
 def gatherAssemblies(args):
-    validAssemblies, excludedAccs, skippedAccs, tooManyContigs = \
-        filterDownloads(getInfoFrom(args), getExclusion(args.excludeList), args.maxCtg)
-    targetDir = generateTargetDir(args)
-    print(f'\nCopying file to "{targetDir}"')
+    if not args.concat is None and (not args.targetDir is None or not args.transcode is None):
+        raise ValueError('--concat writes one file instead of a target dir, ' +
+                         'it can not be combined with --targetDir or --transcode.')
+    if args.concat is None:
+        # as in combine, an existing archive is not replaced
+        target = generateTargetDir(args)
+        if not getArchiveExt(target) is None and os.path.lexists(target):
+            raise FileExistsError(f'Archive target exists: {target}')
+    setDecompression(args.decompressor, args.decompressThreads)
+    # With genome statistics or md5 verification, contigs are counted in the
+    # same read
+    statsFilters = getStatsFilters(args)
+    withStats = args.stats or len(statsFilters) > 0
+    maxCtg = (None if withStats or args.verifyMd5 else args.maxCtg)
+    # the cache is only needed when counting contigs, but can always be cleared
+    cacheMode = (args.cache if not maxCtg is None or args.cache == 'clear' else 'off')
+    cache = openCtgCache(args.dir, mode=cacheMode, useHash=args.cacheHash)
+    try:
+        validAssemblies, excludedAccs, skippedAccs, tooManyContigs, unreadable = \
+            filterDownloads(getInfoFrom(args), getExclusion(args.excludeList),
+                            maxCtg, jobs=args.jobs, cache=cache,
+                            tieBreakers=args.tieBreakers)
+    finally:
+        if not cache is None: cache.close()
+    if not args.concat is None:
+        # before reading the genomes again or writing anything
+        checkConcatFormats([a[1]['local_filename'] for a in validAssemblies.values()])
+    lowQuality = [] # [("strain", "acc", "reason")...]
+    corrupt = [] # [("strain", "acc", "reason")...]
+    genomeStats = {}
+    if withStats:
+        validAssemblies, genomeStats, tooManyContigs, lowQuality, unreadable = \
+            filterGenomeStats(validAssemblies, statsFilters, lowQuality, unreadable,
+                              maxCtg=args.maxCtg, tooManyContigs=tooManyContigs,
+                              jobs=args.jobs, corrupt=(corrupt if args.verifyMd5 else None))
+    elif args.verifyMd5:
+        validAssemblies, tooManyContigs, corrupt, unreadable = \
+            filterVerified(validAssemblies, args.maxCtg, tooManyContigs, corrupt,
+                           unreadable, jobs=args.jobs)
+    # With concat, the concatenated file is the only output, reports are
+    # named after it. An archive target is written after the reports, they
+    # are put in it.
+    isConcat = not args.concat is None
+    targetDir = (os.path.realpath(args.concat) if isConcat else generateTargetDir(args))
+    isArchive = not isConcat and not getArchiveExt(targetDir) is None
+    if isConcat:
+        reportBase = os.path.splitext(targetDir)[0]
+    else:
+        reportBase = (getArchiveBase(targetDir) if isArchive else os.path.realpath(targetDir))
+    mode = (args.linkMode if args.transcode is None
+            else getTranscodeMode(args.transcode, args.transcodeLevel))
+    if isConcat:
+        print(f'\nConcatenating genomes to "{targetDir}"')
+    elif isArchive:
+        print(f'\nArchiving file to "{targetDir}"' +
+              ('' if args.transcode is None else f' (--transcode {mode})'))
+    elif args.transcode is None:
+        print(f'\nCopying file to "{targetDir}" (--linkMode {args.linkMode})')
+    else:
+        print(f'\nTranscoding file to "{targetDir}" (--transcode {mode})')
 
-    for name in tqdm(validAssemblies):
-        fp = validAssemblies[name][1]['local_filename']
+    if not isArchive and not isConcat:
         os.makedirs(targetDir, exist_ok=True)
+    pairs = []
+    for name in validAssemblies:
+        fp = validAssemblies[name][1]['local_filename']
         # t = os.path.join(targetDir, os.path.split(fp)[1])
         fn, ext = os.path.splitext(fp)
-        if ext == '.gz':
+        if ext[1:] in compressExts:
             ext = os.path.splitext(fn)[1] + ext
-        t = os.path.join(targetDir, safeName(name) + ext)
-        shutil.copy(fp, t)
+        if not args.transcode is None:
+            ext = getTranscodedName(ext, args.transcode)
+        t = (safeName(name) + ext if isArchive else os.path.join(targetDir, safeName(name) + ext))
+        pairs.append((fp, t))
+    if isConcat:
+        concatFiles = [targetDir] + list(concatAssemblies(
+            [(safeName(strain), strain, strainData[0], strainData[1]['local_filename'])
+             for strain, strainData in validAssemblies.items()], targetDir))
+    elif not isArchive:
+        if args.transcode is None:
+            usedModes = syncFiles(pairs, targetDir, mode, threads=args.threads)
+        else:
+            usedModes = syncFiles(pairs, targetDir, mode, threads=args.jobs,
+                                  transfer=transcodeFiles)
+        printUsedModes(usedModes, mode)
 
-    includeListFile = os.path.realpath(targetDir) + '-included.tsv'
+    includeListFile = reportBase + '-included.tsv'
     with open(includeListFile, 'w') as ef:
         ef.write('List of accessions in source dir:\n')
         ef.write(os.path.realpath(args.dir)+'\n')
         ef.write('Included in:\n')
         ef.write(targetDir+'\n')
+        if withStats:
+            ef.write('\nstrain\tassembly_accession\tname\t' + '\t'.join(statsColumns))
         for strain, strainData in validAssemblies.items():
             ef.write('\n'+strain+'\t'+strainData[0]+'\t'+safeName(strain))
+            if withStats:
+                ef.write('\t' + '\t'.join(str(genomeStats[strain][c]) for c in statsColumns))
 
-    excludeListFile = os.path.realpath(targetDir) + '-excluded.tsv'
+    excludeListFile = reportBase + '-excluded.tsv'
     with open(excludeListFile, 'w') as ef:
         ef.write('List of accessions in source dir:\n')
         ef.write(os.path.realpath(args.dir)+'\n')
@@ -222,9 +572,20 @@ def gatherAssemblies(args):
                 ('Excluded by --excludeList', excludedAccs),
                 ('Excluded because not the best for the strain', skippedAccs),
                 ('Excluded because the assembly has too many contigs', tooManyContigs),
+                ('Excluded because of genome statistics (--minN50, --minLength, --maxNs, --minGC, --maxGC)', lowQuality),
+                ('Excluded because the sequence file could not be read', unreadable),
+                ('Excluded because the download is corrupt or truncated (md5 mismatch, --verify-md5)', corrupt),
         ]:
             ef.write('\n'+text+'\n')
-            for strain, acc in excludedList:
-                ef.write(f'{strain}\t{acc}\n')
+            for entry in excludedList:
+                ef.write('\t'.join(entry)+'\n')
 
+    if isArchive:
+        with ArchiveWriter(targetDir) as archive:
+            archiveFiles(archive, pairs, (None if args.transcode is None else mode))
+            archive.addReport(includeListFile)
+            archive.addReport(excludeListFile)
+        return archive.names, includeListFile, excludeListFile
+    if isConcat:
+        return [os.path.split(f)[1] for f in concatFiles], includeListFile, excludeListFile
     return os.listdir(targetDir), includeListFile, excludeListFile
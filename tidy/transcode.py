@@ -0,0 +1,129 @@
+# Recompress files on their way to the target dir, so that downstream tools
+# do not have to gunzip the same genomes again on every run:
+#   plain -> decompressed text
+#   bgzf  -> blocked gzip (as bgzip), readable by any gzip reader and by
+#            htslib/samtools with random access
+#   zstd  -> Zstandard, much faster to decompress than gzip (needs the
+#            zstandard package)
+# Any input compression known to openSeqFile is read. Files are transcoded by
+# a process pool, each one to a hidden temporary name that is renamed when
+# done, like transferFiles.
+# The format and level are given as one mode string "<format>[:<level>]", it
+# is recorded in the manifest, changing it transcodes the files again.
+
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from .bgzf import BGZF_BLOCK_SIZE, BGZF_EOF, compressBlock
+from .seqfile import iterChunks, setDecompression, getDecompression
+from .transfer import getTempName, retryTransient, runPairs
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+transcodeFormats = ['plain', 'bgzf', 'zstd']
+transcodeExts = {'plain': '', 'bgzf': '.gz', 'zstd': '.zst'}
+defaultLevels = {'plain': None, 'bgzf': 6, 'zstd': 3}
+# compression extensions replaced by the one of the format
+knownCompressExts = ['.gz', '.xz', '.bz2', '.zst']
+
+
+def getTranscodeMode(fmt: str, level: None|int = None) -> str:
+    if not fmt in transcodeFormats:
+        raise ValueError(f'Transcode format not known: {fmt}, should be one of {transcodeFormats}')
+    if fmt == 'zstd' and zstandard is None:
+        raise ValueError('Transcoding to zstd needs the zstandard package (pip install zstandard).')
+    if level is None:
+        level = defaultLevels[fmt]
+    return (fmt if level is None or fmt == 'plain' else f'{fmt}:{level}')
+
+
+def parseTranscodeMode(mode: str) -> tuple[str, None|int]:
+    fmt, _, level = mode.partition(':')
+    if not fmt in transcodeFormats:
+        raise ValueError(f'Transcode format not known: {fmt}, should be one of {transcodeFormats}')
+    return fmt, (int(level) if level else defaultLevels[fmt])
+
+
+def getTranscodedName(name: str, fmt: str) -> str:
+    # "a.fna.gz" -> "a.fna.zst" (zstd), "a.fna" (plain)
+    stem, ext = os.path.splitext(name)
+    if ext in knownCompressExts:
+        name = stem
+    return name + transcodeExts[fmt]
+
+
+class BgzfWriter:
+    # Buffers written data and writes it to fh as full BGZF blocks
+    def __init__(self, fh, level: int = 6):
+        self.fh = fh
+        self.level = level
+        self.buffer = bytearray()
+
+    def write(self, data: bytes):
+        self.buffer += data
+        n = len(self.buffer) // BGZF_BLOCK_SIZE * BGZF_BLOCK_SIZE
+        for i in range(0, n, BGZF_BLOCK_SIZE):
+            self.fh.write(compressBlock(bytes(self.buffer[i:i + BGZF_BLOCK_SIZE]), self.level))
+        del self.buffer[:n]
+
+    def close(self):
+        if len(self.buffer) > 0:
+            self.fh.write(compressBlock(bytes(self.buffer), self.level))
+            self.buffer = bytearray()
+        self.fh.write(BGZF_EOF)
+
+
+def writeTranscoded(chunks, fh, mode: str):
+    # Write the decompressed chunks to the open binary file fh
+    fmt, level = parseTranscodeMode(mode)
+    if fmt == 'plain':
+        for chunk in chunks:
+            fh.write(chunk)
+    elif fmt == 'bgzf':
+        writer = BgzfWriter(fh, level)
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.close()
+    else:
+        if zstandard is None:
+            raise ValueError('Transcoding to zstd needs the zstandard package (pip install zstandard).')
+        cctx = zstandard.ZstdCompressor(level=level)
+        with cctx.stream_writer(fh, closefd=False) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+
+
+def transcodeFile(src: str, dst: str, mode: str) -> str:
+    # Returns the mode, to be counted like the link modes of transferFile
+    tmp = getTempName(dst)
+    try:
+        with open(tmp, 'wb') as fh:
+            writeTranscoded(iterChunks(src), fh, mode)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return mode
+
+
+def transcodeFileRetry(src: str, dst: str, mode: str, retries: int = 3) -> str:
+    return retryTransient(transcodeFile, src, dst, mode, retries=retries)
+
+
+def transcodeFiles(pairs: list[tuple[str, str]], mode: str = 'bgzf',
+                   threads: int = 1, retries: int = 3, onDone=None) -> Counter:
+    # Same interface as transferFiles, to be used by syncFiles.
+    # threads: number of processes.
+    parseTranscodeMode(mode)
+    usedModes = runPairs(pairs, transcodeFileRetry, (mode, retries),
+                         executorClass=ProcessPoolExecutor, threads=threads, onDone=onDone,
+                         verb='Transcoded', suffix=f' to {mode}', initializer=setDecompression,
+                         initargs=getDecompression())
+    if len(pairs) > 0:
+        inSize = sum(os.path.getsize(src) for src, _ in pairs)
+        outSize = sum(os.path.getsize(dst) for _, dst in pairs)
+        print(f'Size {inSize / 1024**2:.1f} MiB -> {outSize / 1024**2:.1f} MiB')
+    return usedModes
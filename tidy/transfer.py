@@ -0,0 +1,274 @@
+# Put selected files into the target directory, by copying or linking.
+# Link modes fall back when not supported (eg. across devices):
+#   reflink -> hardlink -> copy
+#   hardlink -> copy
+#   symlink -> copy
+# Each file is first written (or linked) to a hidden temporary name in the
+# target dir and then renamed, an interrupted run never leaves a truncated
+# file under the final name.
+
+import os
+import sys
+import time
+import errno
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+linkModes = ['copy', 'hardlink', 'reflink', 'symlink']
+fallbackModes = {
+    'copy': [],
+    'hardlink': ['copy'],
+    'reflink': ['hardlink', 'copy'],
+    'symlink': ['copy'],
+}
+
+FICLONE = 0x40049409 # linux/fs.h
+
+# Errors worth another try, typical for network file systems
+transientErrnos = {
+    errno.EAGAIN, errno.EINTR, errno.EIO, errno.EBUSY,
+    errno.ETIMEDOUT, errno.ESTALE, errno.ECONNRESET,
+}
+
+
+def reflinkFile(src: str, dst: str):
+    # Copy-on-write clone (btrfs, xfs, ...), only through the Linux ioctl.
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported on this platform', dst)
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+        try:
+            os.remove(dst)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def placeFile(src: str, dst: str, mode: str = 'copy'):
+    if mode == 'copy':
+        shutil.copy(src, dst)
+    elif mode == 'hardlink':
+        os.link(src, dst)
+    elif mode == 'reflink':
+        reflinkFile(src, dst)
+    elif mode == 'symlink':
+        os.symlink(os.path.realpath(src), dst)
+    else:
+        raise ValueError(f'Link mode not known: {mode}, should be one of {linkModes}')
+
+
+def isTransient(e: OSError) -> bool:
+    return e.errno in transientErrnos
+
+
+def getTempName(dst: str) -> str:
+    d, n = os.path.split(dst)
+    return os.path.join(d, f'.{n}.part')
+
+
+def transferFile(src: str, dst: str, mode: str = 'copy') -> str:
+    # Returns the mode actually used.
+    if not mode in fallbackModes:
+        raise ValueError(f'Link mode not known: {mode}, should be one of {linkModes}')
+    tmp = getTempName(dst)
+    for m in [mode] + fallbackModes[mode]:
+        # leftover of an interrupted run or a failed mode
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        try:
+            placeFile(src, tmp, m)
+        except OSError as e:
+            if m == 'copy' or isTransient(e):
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                raise
+            continue
+        # rename(2) does nothing when tmp and dst are links to the same inode
+        # (hardlinked again), tmp would be left behind
+        if os.path.lexists(dst):
+            t, d = os.lstat(tmp), os.lstat(dst)
+            if (t.st_dev, t.st_ino) == (d.st_dev, d.st_ino):
+                os.remove(tmp)
+                return m
+        # atomic, and replaces a link at dst instead of writing through it
+        os.replace(tmp, dst)
+        return m
+    raise AssertionError('copy either succeeds or raises')
+
+
+def retryTransient(func, *args, retries: int = 3, wait: float = 1):
+    # func(*args), retried with growing waits after transient I/O errors
+    for i in range(retries + 1):
+        try:
+            return func(*args)
+        except OSError as e:
+            if not isTransient(e) or i == retries:
+                raise
+            print(f'{e}, retry {i + 1}/{retries} in {wait * 2**i:.1f}s')
+            time.sleep(wait * 2**i)
+
+
+def transferFileRetry(src: str, dst: str, mode: str = 'copy',
+                      retries: int = 3, wait: float = 1) -> str:
+    return retryTransient(transferFile, src, dst, mode, retries=retries, wait=wait)
+
+
+def runPairs(pairs: list[tuple[str, str]], worker, args: tuple = (),
+             executorClass=ThreadPoolExecutor, threads: int = 1, onDone=None,
+             verb: str = 'Transferred', suffix: str = '', **executorArgs) -> Counter:
+    # worker(src, dst, *args) for all (src, dst) pairs in a bounded pool of
+    # executorClass (eg. ProcessPoolExecutor for CPU bound work), with a
+    # progress bar of source bytes and a throughput summary
+    # ("<verb> N file(s)<suffix>, ...").
+    # onDone(src, dst) is called in the calling thread after each file.
+    # Returns {result of worker: number of files}.
+    results = Counter()
+    if len(pairs) == 0:
+        return results
+    sizes = [os.path.getsize(src) for src, _ in pairs]
+    start = time.perf_counter()
+    # At most maxPending files are submitted at a time. After an error (or
+    # Ctrl-C) the queued ones are cancelled, those already running are
+    # finished and passed to onDone before the error is raised.
+    maxPending = 2 * max(1, threads)
+    with tqdm(total=sum(sizes), unit='B', unit_scale=True, unit_divisor=1024) as pbar, \
+            executorClass(max_workers=max(1, threads), **executorArgs) as executor:
+        todo = iter(zip(pairs, sizes))
+        pending = {} # future: (pair, size)
+        try:
+            while True:
+                for pair, size in todo:
+                    pending[executor.submit(worker, *pair, *args)] = (pair, size)
+                    if len(pending) >= maxPending:
+                        break
+                if len(pending) == 0:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[future.result()] += 1
+                    pair, size = pending.pop(future)
+                    pbar.update(size)
+                    if not onDone is None:
+                        onDone(*pair)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            for future, (pair, size) in pending.items():
+                if not future.cancelled() and future.exception() is None and not onDone is None:
+                    onDone(*pair)
+            raise
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'{verb} {len(pairs)} file(s){suffix}, {sum(sizes) / 1024**2:.1f} MiB in ' +
+          f'{elapsed:.1f}s ({sum(sizes) / 1024**2 / elapsed:.1f} MiB/s)')
+    return results
+
+
+def transferFiles(pairs: list[tuple[str, str]], mode: str = 'copy',
+                  threads: int = 1, retries: int = 3, onDone=None) -> Counter:
+    # Transfer (src, dst) pairs with a bounded thread pool.
+    # onDone(src, dst) is called in the calling thread after each file.
+    # Returns {mode: number of files} of the modes actually used.
+    return runPairs(pairs, transferFileRetry, (mode, retries), threads=threads,
+                    onDone=onDone)
+
+
+def getManifestFile(targetDir: str) -> str:
+    return os.path.realpath(targetDir) + '-manifest.tsv'
+
+
+manifestHeader = ['source', 'size', 'mtime_ns', 'target', 'link_mode']
+
+
+def getManifestEntry(src: str, dst: str, mode: str) -> tuple[str, str, str, str, str]:
+    st = os.stat(src)
+    return (os.path.realpath(src), str(st.st_size), str(st.st_mtime_ns),
+            os.path.split(dst)[1], mode)
+
+
+def readManifest(manifestFile: str) -> dict[str, tuple[str, str, str, str, str]]:
+    # {target name: entry}, empty if there is no manifest yet
+    manifest = {}
+    try:
+        with open(manifestFile, 'r') as mf:
+            for l in mf:
+                entry = tuple(l.rstrip('\n').split('\t'))
+                if len(entry) != len(manifestHeader) or list(entry) == manifestHeader:
+                    continue
+                manifest[entry[3]] = entry
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def diffManifest(
+    pairs: list[tuple[str, str]],
+    manifest: dict[str, tuple[str, str, str, str, str]],
+    mode: str = 'copy'
+) -> tuple[list[tuple[str, str]], list[tuple[str, str, str, str, str]], list[str]]:
+    # Split pairs in the ones to transfer and the ones unchanged since the
+    # manifest was written. Also return targets in the manifest that are not
+    # selected any more (to be deleted).
+    toTransfer = []
+    unchanged = []
+    selected = set()
+    for src, dst in pairs:
+        entry = getManifestEntry(src, dst, mode)
+        selected.add(entry[3])
+        if manifest.get(entry[3]) == entry and os.path.lexists(dst):
+            unchanged.append(entry)
+        else:
+            toTransfer.append((src, dst))
+    toDelete = [t for t in manifest if not t in selected]
+    return toTransfer, unchanged, toDelete
+
+
+def syncFiles(pairs: list[tuple[str, str]], targetDir: str, mode: str = 'copy',
+              threads: int = 1, retries: int = 3, delete: bool = True,
+              transfer=None) -> Counter:
+    # Incremental transferFiles: only new or changed sources are transferred,
+    # targets recorded in the manifest but no longer selected are removed
+    # (or, without delete, left in place and kept in the manifest).
+    # transfer: function used instead of transferFiles, same arguments (eg.
+    # transcodeFiles, mode is then the transcode mode).
+    # The manifest is appended after each file, an interrupted run is resumed.
+    manifestFile = getManifestFile(targetDir)
+    manifest = readManifest(manifestFile)
+    toTransfer, unchanged, toDelete = diffManifest(pairs, manifest, mode)
+    if delete:
+        print(f'{len(unchanged)} file(s) unchanged, {len(toTransfer)} to transfer, ' +
+              f'{len(toDelete)} to remove from "{targetDir}".')
+        for t in toDelete:
+            try:
+                os.remove(os.path.join(targetDir, t))
+            except FileNotFoundError:
+                pass
+    else:
+        print(f'{len(unchanged)} file(s) unchanged, {len(toTransfer)} to transfer, ' +
+              f'{len(toDelete)} other(s) kept in "{targetDir}".')
+        unchanged = unchanged + [manifest[t] for t in toDelete]
+    with open(manifestFile, 'w') as mf:
+        mf.write('\t'.join(manifestHeader) + '\n')
+        for entry in unchanged:
+            mf.write('\t'.join(entry) + '\n')
+        mf.flush()
+        def record(src, dst):
+            mf.write('\t'.join(getManifestEntry(src, dst, mode)) + '\n')
+            mf.flush()
+        usedModes = (transferFiles if transfer is None else transfer)(
+            toTransfer, mode, threads=threads, retries=retries, onDone=record)
+    return usedModes
+
+
+def printUsedModes(usedModes: dict[str, int], mode: str):
+    # Summary of fallbacks, usedModes is {mode: number of files}
+    for m, n in usedModes.items():
+        if m != mode:
+            print(f'{n} file(s) fell back from {mode} to {m}.')